@@ -0,0 +1,110 @@
+"""Online snapshots of the QuestBot database.
+
+Copying quest_bot.db while the bot is writing can produce a torn file.
+These helpers use SQLite's online backup API instead, copying a few pages
+per step from a separate connection so the bot's writes only ever wait for
+one small step. Snapshots are written under a temporary name and renamed
+once complete, so a crash mid-backup never leaves a half-written snapshot
+that looks valid.
+"""
+import os
+import sqlite3
+import time
+from typing import List
+
+SNAPSHOT_PREFIX = "quest_bot-"
+SNAPSHOT_SUFFIX = ".db"
+
+# Writes from other connections restart the copy; after this many restarts
+# finish in one step rather than chasing a busy database forever
+MAX_RESTARTS = 5
+
+# A .partial file untouched for this long belongs to a backup that died; younger ones may still be
+# written by another process (any cluster worker can run -backupdb)
+STALE_PARTIAL_SECONDS = 3600
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def snapshot_path(backup_dir: str, timestamp: float = None) -> str:
+    timestamp = timestamp or time.time()
+    # Millisecond suffix keeps two snapshots in the same second from colliding
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime(timestamp)) + f"{int(timestamp * 1000) % 1000:03d}"
+    return os.path.join(backup_dir, f"{SNAPSHOT_PREFIX}{stamp}{SNAPSHOT_SUFFIX}")
+
+
+def list_snapshots(backup_dir: str) -> List[str]:
+    """Completed snapshots, oldest first (timestamps sort lexically)"""
+    if not os.path.isdir(backup_dir):
+        return []
+    names = sorted(name for name in os.listdir(backup_dir)
+                   if name.startswith(SNAPSHOT_PREFIX) and name.endswith(SNAPSHOT_SUFFIX))
+    return [os.path.join(backup_dir, name) for name in names]
+
+
+def prune_snapshots(backup_dir: str, keep: int) -> List[str]:
+    """Delete all but the newest `keep` snapshots and return the removed paths"""
+    snapshots = list_snapshots(backup_dir)
+    removed = snapshots[:-keep] if keep > 0 else snapshots
+    for path in removed:
+        os.remove(path)
+    # Leftovers from a backup interrupted by a crash
+    cutoff = time.time() - STALE_PARTIAL_SECONDS
+    for name in os.listdir(backup_dir) if os.path.isdir(backup_dir) else []:
+        if name.endswith(".partial"):
+            path = os.path.join(backup_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass  # finished and renamed meanwhile
+    return removed
+
+
+def create_snapshot(db_path: str, backup_dir: str, pages: int = 64, step_sleep: float = 0.005) -> dict:
+    """Copy db_path into a new timestamped snapshot using the online backup API
+
+    Blocking - call it from a worker thread.
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    final_path = snapshot_path(backup_dir)
+    partial_path = final_path + ".partial"
+    started = time.perf_counter()
+    restarts = 0
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal restarts, last_remaining
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > MAX_RESTARTS:
+                raise _TooManyRestarts()
+        last_remaining = remaining
+
+    source = sqlite3.connect(db_path, timeout=30)
+    try:
+        target = sqlite3.connect(partial_path)
+        try:
+            try:
+                source.backup(target, pages=pages, progress=progress, sleep=step_sleep)
+            except _TooManyRestarts:
+                print(f"Backup restarted {restarts} times, finishing in a single step")
+                source.backup(target, pages=-1)
+            check = target.execute('PRAGMA quick_check').fetchone()[0]
+        finally:
+            target.close()
+    finally:
+        source.close()
+
+    if check != "ok":
+        os.remove(partial_path)
+        raise sqlite3.DatabaseError(f"Snapshot failed quick_check: {check}")
+    os.replace(partial_path, final_path)
+    return {
+        "path": final_path,
+        "size_bytes": os.path.getsize(final_path),
+        "seconds": round(time.perf_counter() - started, 3),
+        "restarts": restarts,
+    }
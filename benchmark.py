@@ -0,0 +1,170 @@
+"""Offline benchmark suite for the QuestBot hot paths.
+
+Drives QuestBot and the bot.py event handlers against fake guilds of
+configurable size. Needs no network access and no Discord token.
+
+    python benchmark.py --members 1000 10000 100000 --roles 300
+    python benchmark.py --storage memory   # upper bound without SQLite
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Keep the module-level QuestBot away from the real quest_bot.db
+_scratch_dir = tempfile.mkdtemp(prefix="questbot-bench-")
+os.environ.setdefault('QUEST_BOT_DB', os.path.join(_scratch_dir, 'quest_bot.db'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bot as questbot  # noqa: E402
+import storage  # noqa: E402
+from fakes import FakeClient, FakeContext, FakeMessage, FakeReaction, LatencyRecorder, RestSink, build_guild  # noqa: E402
+
+
+async def _drain_background_tasks():
+    """Wait for the role-sync tasks the bot spawns so they don't bleed into the next measurement"""
+    current = asyncio.current_task()
+    # Queued completions are part of the operation; awarding them queues notices and spawns role syncs
+    await questbot.quest_bot.completions.flush()
+    # Coalesced notices would wait out their collection window, and wait_for runs that wait as a task of
+    # its own - drop them instead, they aren't part of any measurement
+    questbot.quest_bot.notices.close()
+    # Role syncs can spawn further tasks, so keep gathering until nothing new shows up
+    while True:
+        ledger_tasks = questbot.quest_bot.ledger.tasks
+        pending = [task for task in asyncio.all_tasks() if task is not current and task not in ledger_tasks]
+        if not pending:
+            return
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def _measure(name: str, operation, iterations: int, time_budget: float) -> dict:
+    recorder = LatencyRecorder(name)
+    recorder.start()
+    deadline = time.perf_counter() + time_budget
+    for i in range(iterations):
+        started = time.perf_counter()
+        await operation(i)
+        recorder.add(time.perf_counter() - started)
+        if time.perf_counter() > deadline:
+            break
+    await _drain_background_tasks()
+    recorder.stop()
+    return recorder.summary()
+
+
+async def run_size(member_count: int, args) -> list:
+    quest_bot = questbot.QuestBot(db_path=os.path.join(_scratch_dir, f"bench_{member_count}.db"), backend=args.storage)
+    # Handlers in bot.py use the module-level instance
+    questbot.quest_bot = quest_bot
+
+    client = FakeClient()
+    client.install(questbot.bot)
+    guild, extra = build_guild(quest_bot, member_count, role_count=args.roles, seed=args.seed,
+                               sink=RestSink(latency=args.rest_latency))
+    client.add_guild(guild)
+
+    rng = random.Random(args.seed)
+    opted_in = [m for m in guild.members if any(r.name.startswith("Level ") for r in m.roles)]
+    channel = guild.text_channels[0]
+    results = []
+
+    async def leaderboard(_):
+        # Cold build: full scan into the ranking index, then the top page
+        quest_bot.build_ranking(guild.id)
+        quest_bot.get_leaderboard(guild.id, 10)
+
+    async def rank_lookup(_):
+        quest_bot.get_user_rank(guild.id, rng.choice(opted_in).id)
+
+    ctx = FakeContext(guild, guild.me)
+
+    async def leaderboard_command(_):
+        # Goes through the rendered-embed cache like real -leaderboard calls
+        await questbot.leaderboard.callback(ctx)
+
+    async def xp_update(_):
+        member = rng.choice(opted_in)
+        quest_bot.update_user_xp(member.id, guild.id, rng.randint(-20, 80))
+
+    quest_message = FakeMessage(channel)
+    quest_bot.storage.add_quest(quest_message.id, guild.id, channel.id, "Benchmark Quest", "React to complete", 50)
+    completers = rng.sample(opted_in, min(len(opted_in), args.iterations))
+
+    async def quest_completion(i):
+        member = completers[i % len(completers)]
+        await questbot.on_reaction_add(FakeReaction(quest_message), member)
+
+    gainable = extra["streak_roles"] + extra["badge_roles"] + extra["auto_badge_roles"]
+
+    async def role_change(_):
+        member = rng.choice(opted_in)
+        before = member.copy()
+        role = rng.choice(gainable)
+        if role not in member.roles:
+            member.roles.append(role)
+        await questbot.on_member_update(before, member)
+
+    operations = [
+        ("leaderboard", leaderboard, args.leaderboard_iterations),
+        ("leaderboard_cmd", leaderboard_command, args.iterations),
+        ("rank_lookup", rank_lookup, args.iterations),
+        ("xp_update", xp_update, args.iterations),
+        ("quest_completion", quest_completion, len(completers)),
+        ("role_change", role_change, args.iterations),
+    ]
+    for name, operation, iterations in operations:
+        if args.only and name not in args.only:
+            continue
+        # The bot logs heavily to stdout; keep it out of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            summary = await _measure(name, operation, iterations, args.time_budget)
+        summary["members"] = member_count
+        results.append(summary)
+
+    # Completion notices still waiting out their window aren't part of any measurement
+    quest_bot.notices.close()
+    quest_bot.ledger.close()
+    quest_bot.storage.close()
+    return results
+
+
+def print_report(results: list):
+    header = f"{'operation':<18}{'members':>9}{'count':>8}{'ops/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['op']:<18}{r['members']:>9,}{r['count']:>8}{r['ops_per_sec']:>12,.1f}"
+              f"{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['max_ms']:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline QuestBot benchmarks")
+    parser.add_argument("--members", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="Guild sizes to benchmark")
+    parser.add_argument("--roles", type=int, default=300, help="Number of non-level roles per guild")
+    parser.add_argument("--iterations", type=int, default=500, help="Iterations for per-user operations")
+    parser.add_argument("--leaderboard-iterations", type=int, default=20)
+    parser.add_argument("--time-budget", type=float, default=30.0,
+                        help="Stop an operation early after this many seconds")
+    parser.add_argument("--rest-latency", type=float, default=0.0,
+                        help="Simulated latency in seconds for every stubbed REST call")
+    parser.add_argument("--only", nargs="*", help="Run only these operations")
+    parser.add_argument("--storage", choices=storage.BACKENDS, default="sqlite", help="Storage backend to benchmark")
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+
+    results = []
+    for member_count in args.members:
+        print(f"Benchmarking guild with {member_count:,} members and {args.roles} roles...", file=sys.stderr)
+        results.extend(asyncio.run(run_size(member_count, args)))
+    print_report(results)
+
+
+if __name__ == "__main__":
+    main()
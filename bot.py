@@ -1,17 +1,35 @@
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord import app_commands
-import sqlite3
 import asyncio
-from typing import Optional, Dict, List
-import json
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Optional, Dict, List, Union
+import csv
+import io
+import math
+import time
 import requests
 import os
+import tempfile
+import backup
 import webserver
+import xp_totals
+import xp_transfer
+from completions import CompletionPipeline
+from ledger import LedgerWriter
+from notices import NoticeCoalescer
+from ranking import RankingStore
+from scheduler import EXPIRE, PUBLISH, QuestScheduler
+import storage
 
 # Bot configuration
 TOKEN = None  # Set this through environment variables
 PREFIX = '-'
+DB_PATH = os.getenv('QUEST_BOT_DB', 'quest_bot.db')  # Override to point the bot at a scratch database
+DB_BUSY_TIMEOUT = float(os.getenv('QUEST_BOT_DB_BUSY_TIMEOUT', 5))  # seconds to wait for another process's write
+STORAGE_BACKEND = os.getenv('QUEST_BOT_STORAGE', 'sqlite')  # "memory" keeps everything in RAM (tests, benchmarks)
+MEMORY_SNAPSHOT_PATH = os.getenv('QUEST_BOT_MEMORY_SNAPSHOT')  # in-memory backend writes a SQLite copy here on close
 
 # XP Level thresholds
 LEVEL_THRESHOLDS = {
@@ -26,6 +44,81 @@ LEVEL_THRESHOLDS = {
     9: 9200,
     10: 11700
 }
+LEVEL_THRESHOLD_LIST = [LEVEL_THRESHOLDS[level] for level in range(1, 11)]
+
+@dataclass
+class XPBreakdown:
+    """Where a member's total XP comes from, plus their level and progress towards the next one"""
+    quest_xp: int = 0  # base XP in users - quests and manual changes
+    streak_xp: int = 0  # accumulated streak role gains
+    badge_xp: int = 0  # current roles with an assigned (non-streak) XP value
+    auto_badge_xp: int = 0  # current unassigned roles with "badge" in the name, 5 XP each
+    total: int = field(init=False)
+    level: int = field(init=False)
+    xp_to_next: int = field(init=False)  # 0 at max level
+    progress: float = field(init=False)  # percent of the way from this level to the next
+
+    def __post_init__(self):
+        self.total = self.quest_xp + self.streak_xp + self.badge_xp + self.auto_badge_xp
+        self.level = max(level for level, xp in LEVEL_THRESHOLDS.items() if self.total >= xp)
+        if self.level < 10:
+            current_level_xp = LEVEL_THRESHOLDS[self.level]
+            next_level_xp = LEVEL_THRESHOLDS[self.level + 1]
+            self.xp_to_next = max(0, next_level_xp - self.total)
+            self.progress = min(100, max(0, (self.total - current_level_xp) / (next_level_xp - current_level_xp) * 100))
+        else:
+            self.xp_to_next = 0
+            self.progress = 100
+
+    @property
+    def total_badge_xp(self) -> int:
+        return self.badge_xp + self.auto_badge_xp
+
+# Static part of the leaderboard embed, built once instead of on every call
+LEVEL_REQUIREMENTS_TEXT = "**Level Requirements:**\n" + "".join(
+    f"Level {level}: {xp:,} XP\n" for level, xp in LEVEL_THRESHOLDS.items()
+)
+
+# Leaderboard cache - rendered embeds are reused until an XP change touches the top N
+LEADERBOARD_SIZE = 10
+LEADERBOARD_CACHE_TTL = 60  # seconds, backstop for changes we don't track (renames, members leaving)
+
+# Online database snapshots (see backup.py)
+BACKUP_DIR = os.getenv('QUEST_BOT_BACKUP_DIR', 'backups')
+BACKUP_INTERVAL_HOURS = float(os.getenv('QUEST_BOT_BACKUP_INTERVAL_HOURS', 6))
+BACKUP_KEEP = int(os.getenv('QUEST_BOT_BACKUP_KEEP', 14))
+BACKUP_PAGES_PER_STEP = int(os.getenv('QUEST_BOT_BACKUP_PAGES', 64))
+
+# Streak gain rows older than this are rolled into per-user, per-role totals
+STREAK_HISTORY_DAYS = float(os.getenv('QUEST_BOT_STREAK_HISTORY_DAYS', 90))
+STREAK_COMPACTION_INTERVAL_HOURS = float(os.getenv('QUEST_BOT_STREAK_COMPACTION_HOURS', 24))
+
+# Level reconciliation - stored levels and Level roles drift when role XP assignments change or roles
+# change while the bot is offline; each worker periodically recomputes them for the guilds it owns
+LEVEL_RECONCILE_INTERVAL_HOURS = float(os.getenv('QUEST_BOT_LEVEL_RECONCILE_HOURS', 24))
+LEVEL_RECONCILE_BATCH = int(os.getenv('QUEST_BOT_LEVEL_RECONCILE_BATCH', 20))  # role edits between pauses
+LEVEL_RECONCILE_PAUSE = float(os.getenv('QUEST_BOT_LEVEL_RECONCILE_PAUSE', 2))  # seconds
+
+# Scheduled quests (see scheduler.py)
+QUEST_EXPIRY_BATCH = int(os.getenv('QUEST_BOT_QUEST_EXPIRY_BATCH', 25))  # ended quests closed per round of REST calls
+MIN_QUEST_REPEAT_SECONDS = 3600
+MAX_SCHEDULE_SECONDS = 366 * 86400  # longest duration, repeat interval or time until a start
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+REPEAT_ALIASES = {"hourly": 3600, "daily": 86400, "weekly": 604800}
+
+# Quest completion and opt-in notices are collected per channel and sent as one embed (see notices.py)
+NOTICE_WINDOW_SECONDS = float(os.getenv('QUEST_BOT_NOTICE_WINDOW', 2))
+
+# Quest completion reactions are queued per quest and awarded in batches (see completions.py)
+COMPLETION_WINDOW_SECONDS = float(os.getenv('QUEST_BOT_COMPLETION_WINDOW', 0.05))
+COMPLETION_BATCH_SIZE = int(os.getenv('QUEST_BOT_COMPLETION_BATCH', 500))
+
+# Every XP change is appended to the xp_ledger table - base XP changes in their own transaction, streak and
+# badge gains in batches (see ledger.py); snapshots of base XP let -rebuildxp replay only the rows after one
+LEDGER_BATCH_SIZE = int(os.getenv('QUEST_BOT_LEDGER_BATCH', 500))
+LEDGER_FLUSH_SECONDS = float(os.getenv('QUEST_BOT_LEDGER_FLUSH', 1))
+XP_SNAPSHOT_INTERVAL_HOURS = float(os.getenv('QUEST_BOT_XP_SNAPSHOT_HOURS', 24))
+XP_SNAPSHOT_KEEP = max(1, int(os.getenv('QUEST_BOT_XP_SNAPSHOT_KEEP', 3)))  # -rebuildxp needs one to start from
 
 # Bot setup - With message content intent for full functionality
 # NOTE: Requires "Message Content Intent" enabled in Discord Developer Portal
@@ -36,141 +129,97 @@ intents.guild_reactions = True
 intents.message_content = True  # Privileged intent - enable in Discord Developer Portal
 intents.members = True  # Privileged intent - enable in Discord Developer Portal to read member roles
 
-bot = commands.Bot(command_prefix=PREFIX, intents=intents, help_command=None)
+# Member cache policy. "full" chunks every guild at startup and caches every member. "participants"
+# skips chunking and caches only members with a row in users (plus anyone who reacts to a quest or
+# opt-in message), fetched by ID - memory then grows with participants instead of guild size.
+MEMBER_CACHE_MODE = os.getenv('QUEST_BOT_MEMBER_CACHE', 'full')
+MEMBER_QUERY_BATCH = 100  # query_members accepts at most 100 user IDs per request
+
+# Cluster mode (see cluster.py) - every worker process shares the database
+WORKER_ID = os.getenv('QUEST_BOT_WORKER_ID')  # unset when running as a single process
+INSTANCE_ID = f"{WORKER_ID or 'main'}:{os.getpid()}"  # tags our own cache invalidations
+RUN_MAINTENANCE = os.getenv('QUEST_BOT_MAINTENANCE', '1') != '0'  # backups, compaction, slash sync - one process only
+HEARTBEAT_SECONDS = float(os.getenv('QUEST_BOT_HEARTBEAT_SECONDS', 10))
+CACHE_POLL_SECONDS = float(os.getenv('QUEST_BOT_CACHE_POLL_SECONDS', 2))
+INVALIDATION_RETENTION_SECONDS = 24 * 3600
+
+# Sharding - leave unset to let Discord pick the shard count. QUEST_BOT_SHARD_IDS (comma separated)
+# limits this process to some of the shards, e.g. when several processes split the work
+SHARD_COUNT = int(os.getenv('QUEST_BOT_SHARD_COUNT')) if os.getenv('QUEST_BOT_SHARD_COUNT') else None
+SHARD_IDS = [int(shard_id) for shard_id in os.getenv('QUEST_BOT_SHARD_IDS', '').split(',') if shard_id.strip()] or None
+
+bot = commands.AutoShardedBot(command_prefix=PREFIX, intents=intents, help_command=None,
+                              shard_count=SHARD_COUNT, shard_ids=SHARD_IDS,
+                              chunk_guilds_at_startup=MEMBER_CACHE_MODE == "full",
+                              # Without member events filling the cache, only members we query are kept
+                              member_cache_flags=discord.MemberCacheFlags.none() if MEMBER_CACHE_MODE == "participants"
+                              else discord.MemberCacheFlags.from_intents(intents))
 
 class QuestBot:
-    def __init__(self):
-        self.db_connection = None
-        self.quest_ping_role_id = None
-        self.quest_channel_id = None
+    def __init__(self, db_path: str = DB_PATH, backend: str = STORAGE_BACKEND):
+        self.db_path = db_path
+        self.backend = backend
+        self.storage = None
+        self.guild_settings = {}  # guild_id -> quest ping role, quest channel and opt-in message IDs
         self.role_xp_assignments = {}
-        self.optin_message_id = None
-        self.optin_channel_id = None
+        self.whitelist_cache = {}  # guild_id -> [(channel_id, channel_name)]
+        self.last_invalidation_id = 0  # newest cache_invalidations row already seen
+        self.invalidations_applied = 0
+        self.leaderboard_cache = {}  # guild_id -> rendered leaderboard and the scores it was built from
+        self.rankings = RankingStore()  # guild_id -> opted-in users ordered by total XP
+        # Health state reported by the web server
+        self.startup_progress = {}  # guild_id -> "pending" | "loading" | "ready"
+        self.startup_complete = False
+        self.shard_status = {}  # shard_id -> connection state, guild count and timings
+        self.last_event_at = None
+        self.pending_role_syncs = set()
+        self.quest_scheduler = QuestScheduler()  # quests to post and quests to close, one timer for all guilds
+        self.notices = NoticeCoalescer(
+            lambda channel, embed: send_whitelisted_message(channel, embed=embed, delete_after=10),
+            window=NOTICE_WINDOW_SECONDS)
+        self.completions = CompletionPipeline(
+            lambda message_id, batch: process_completion_batch(message_id, batch),
+            window=COMPLETION_WINDOW_SECONDS, max_batch=COMPLETION_BATCH_SIZE)
+        # Streak and badge gains only; base XP changes write their ledger rows in their own transaction
+        self.ledger = LedgerWriter(lambda rows: self.storage.append_xp_ledger(rows),
+                                   max_batch=LEDGER_BATCH_SIZE, interval=LEDGER_FLUSH_SECONDS)
         self.init_database()
     
     def init_database(self):
-        """Initialize SQLite database for storing user XP and quest data"""
-        self.db_connection = sqlite3.connect('quest_bot.db')
-        cursor = self.db_connection.cursor()
-        
-        # Create users table for XP tracking
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                guild_id INTEGER NOT NULL,
-                xp INTEGER DEFAULT 0,
-                level INTEGER DEFAULT 1,
-                UNIQUE(user_id, guild_id)
-            )
-        ''')
-        
-        # Create quests table for active quests
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS quests (
-                message_id INTEGER PRIMARY KEY,
-                guild_id INTEGER,
-                channel_id INTEGER,
-                title TEXT,
-                content TEXT,
-                completed_users TEXT DEFAULT '[]',
-                xp_reward INTEGER DEFAULT 50
-            )
-        ''')
-        
-        # Add xp_reward column to existing tables if it doesn't exist
-        try:
-            cursor.execute('ALTER TABLE quests ADD COLUMN xp_reward INTEGER DEFAULT 50')
-        except sqlite3.OperationalError:
-            # Column already exists, ignore error
-            pass
-        
-        # Backfill old quests without xp_reward to use default 50 XP
-        cursor.execute('UPDATE quests SET xp_reward = 50 WHERE xp_reward IS NULL')
-        
-        # Create whitelisted_channels table for channel restrictions
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS whitelisted_channels (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                guild_id INTEGER NOT NULL,
-                channel_id INTEGER NOT NULL,
-                channel_name TEXT,
-                UNIQUE(guild_id, channel_id)
-            )
-        ''')
-        
-        self.db_connection.commit()
-        
-        # Create settings table for bot configuration
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS settings (
-                guild_id INTEGER PRIMARY KEY,
-                quest_ping_role_id INTEGER,
-                quest_channel_id INTEGER,
-                role_xp_assignments TEXT DEFAULT '{}'
-            )
-        ''')
-        
-        # Migrate settings table to add new columns if they don't exist
-        try:
-            # Check if optin_message_id column exists
-            cursor.execute("PRAGMA table_info(settings)")
-            columns = [row[1] for row in cursor.fetchall()]
-            
-            if 'optin_message_id' not in columns:
-                cursor.execute('ALTER TABLE settings ADD COLUMN optin_message_id INTEGER')
-                print("Added optin_message_id column to settings table")
-                
-            if 'optin_channel_id' not in columns:
-                cursor.execute('ALTER TABLE settings ADD COLUMN optin_channel_id INTEGER')
-                print("Added optin_channel_id column to settings table")
-                
-        except Exception as e:
-            print(f"Database migration warning: {e}")
-        
-        # Create streak_role_gains table for tracking streak role accumulation
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS streak_role_gains (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                guild_id INTEGER,
-                role_id INTEGER,
-                role_name TEXT,
-                xp_awarded INTEGER,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        self.db_connection.commit()
+        """Open the storage backend (creates the SQLite schema on first run)"""
+        self.storage = storage.open_storage(self.backend, self.db_path, busy_timeout=DB_BUSY_TIMEOUT,
+                                            snapshot_path=MEMORY_SNAPSHOT_PATH)
+        self.last_invalidation_id = self.storage.last_invalidation_id()
+    
+    def load_quest_schedule(self, guild_id: int) -> int:
+        """Queue a guild's pending postings and quest end times, e.g. after a restart"""
+        queued = 0
+        for scheduled in self.storage.list_scheduled_quests(guild_id):
+            self.quest_scheduler.schedule(scheduled['next_start'], PUBLISH, scheduled['id'])
+            queued += 1
+        for message_id, expires_at in self.storage.list_expiring_quests(guild_id):
+            self.quest_scheduler.schedule(expires_at, EXPIRE, message_id)
+            queued += 1
+        return queued
     
     def get_user_data(self, user_id: int, guild_id: int):
         """Get user XP and level data"""
-        if not self.db_connection:
-            return {'xp': 0, 'level': 1}
-        cursor = self.db_connection.cursor()
-        cursor.execute('SELECT xp, level FROM users WHERE user_id = ? AND guild_id = ?', (user_id, guild_id))
-        result = cursor.fetchone()
+        result = self.storage.get_user(user_id, guild_id)
         if result:
             return {'xp': result[0], 'level': result[1]}
         else:
             # Create new user entry
-            cursor.execute('INSERT INTO users (user_id, guild_id, xp, level) VALUES (?, ?, 0, 1)', (user_id, guild_id))
-            self.db_connection.commit()
+            self.storage.ensure_user(user_id, guild_id)
             return {'xp': 0, 'level': 1}
     
-    def update_user_xp(self, user_id: int, guild_id: int, xp_change: int):
+    def update_user_xp(self, user_id: int, guild_id: int, xp_change: int, source: str = "admin", ref: int = None):
         """Update user base XP and recalculate level based on total XP"""
-        if not self.db_connection:
-            return 0, 1
-        cursor = self.db_connection.cursor()
         current_data = self.get_user_data(user_id, guild_id)
         old_level = current_data['level']
         new_base_xp = max(0, current_data['xp'] + xp_change)
         
-        # Update base XP in database first
-        cursor.execute('UPDATE users SET xp = ? WHERE user_id = ? AND guild_id = ?', 
-                      (new_base_xp, user_id, guild_id))
-        self.db_connection.commit()
+        # Update base XP in database first, with its ledger row in the same transaction
+        self.storage.set_user_xp(user_id, guild_id, new_base_xp, source, ref)
         
         # Calculate level based on TOTAL XP (including roles), not just base XP
         total_xp = self.calculate_total_user_xp(user_id, guild_id)
@@ -178,13 +227,215 @@ class QuestBot:
         
         # Update level in database if changed
         if old_level != new_level:
-            cursor.execute('UPDATE users SET level = ? WHERE user_id = ? AND guild_id = ?', 
-                          (new_level, user_id, guild_id))
-            self.db_connection.commit()
-            asyncio.create_task(self.update_user_level_role(user_id, guild_id, old_level, new_level))
+            self.storage.set_user_level(user_id, guild_id, new_level)
+            self.schedule_role_sync(user_id, guild_id, old_level, new_level)
         
+        self.note_xp_change(guild_id, user_id, total_xp)
         return total_xp, new_level
     
+    def bulk_update_user_xp(self, guild_id: int, changes: Dict[int, int], mode: str = "add",
+                            source: str = "bulk", ref: int = None):
+        """Apply many XP changes in one transaction and recompute levels as a batch
+        
+        changes maps user_id -> amount; mode "add" adds the amount (negative removes),
+        mode "set" sets base XP to the amount. Returns {user_id: (total_xp, level)}.
+        """
+        if not changes:
+            return {}
+        old_levels = self.storage.apply_xp_changes(guild_id, changes, mode, source, ref)
+        return self.apply_level_changes(guild_id, list(changes), old_levels)
+    
+    def award_quest_completions(self, message_id: int, guild_id: int, user_ids: List[int], xp_reward: int):
+        """Record a batch of quest completions and award XP to the users completing it for the first time
+        
+        Completions, XP and ledger rows are written in one transaction. Returns {user_id: (total_xp, level)}
+        for the new completions only.
+        """
+        old_levels = self.storage.complete_quest(message_id, user_ids, xp_reward)
+        return self.apply_level_changes(guild_id, list(old_levels), old_levels)
+    
+    def apply_level_changes(self, guild_id: int, user_ids: List[int], old_levels: Dict[int, int]):
+        """Recompute levels after a batch of base XP changes and queue role updates for the ones that moved"""
+        if not user_ids:
+            return {}
+        totals = self.calculate_total_xp_bulk(guild_id, user_ids)
+        levels = self.calculate_levels_bulk(totals)
+        results = {}
+        level_changes = []
+        for user_id in user_ids:
+            total_xp = totals.get(user_id, 0)
+            new_level = levels.get(user_id, 1)
+            results[user_id] = (total_xp, new_level)
+            old_level = old_levels.get(user_id, 1)
+            if old_level != new_level:
+                level_changes.append((user_id, old_level, new_level))
+            self.note_xp_change(guild_id, user_id, total_xp)
+        
+        if level_changes:
+            self.storage.set_user_levels(guild_id, [(user_id, new_level) for user_id, _, new_level in level_changes])
+            self.schedule_bulk_role_sync(guild_id, level_changes)
+        return results
+    
+    async def reconcile_levels(self, guild, dry_run: bool = False, progress=None,
+                               batch_size: int = LEVEL_RECONCILE_BATCH, pause: float = LEVEL_RECONCILE_PAUSE) -> dict:
+        """Recompute every cached member's level in bulk and fix stored levels and Level roles that drifted
+        
+        Only members whose stored level or Level roles differ get an update, role edits go out in batches
+        of batch_size with a pause in between, and progress(report) is awaited after each batch.
+        With dry_run nothing is written; the report lists what would change.
+        """
+        stored_levels = self.storage.list_user_levels(guild.id)
+        members = {}
+        for user_id in stored_levels:
+            member = guild.get_member(user_id)
+            # Without the member we can't see their roles, and base XP alone would understate the level
+            if member:
+                members[user_id] = member
+        for member in guild.members:
+            if member.id not in members and any(role.name.startswith("Level ") for role in member.roles):
+                members[member.id] = member
+        
+        totals = self.calculate_total_xp_bulk(guild.id, list(members))
+        levels = self.calculate_levels_bulk(totals)
+        level_updates = []  # (user_id, level) where the stored level is wrong
+        role_fixes = []  # (user_id, old_level, new_level) for opted-in members whose Level roles are wrong
+        for user_id, member in members.items():
+            level = levels[user_id]
+            if user_id in stored_levels and stored_levels[user_id] != level:
+                level_updates.append((user_id, level))
+            level_roles = [role.name for role in member.roles if role.name.startswith("Level ")]
+            # Members without any Level role haven't opted in and don't get one here
+            if level_roles and level_roles != [f"Level {level}"]:
+                role_fixes.append((user_id, stored_levels.get(user_id, 1), level))
+        
+        report = {
+            "members": len(members),
+            "skipped": len(stored_levels) - sum(1 for user_id in stored_levels if user_id in members),
+            "level_updates": len(level_updates),
+            "role_fixes": len(role_fixes),
+            "roles_done": 0,
+            "dry_run": dry_run,
+            "sample": [(user_id, stored_levels.get(user_id, 1), level) for user_id, level in level_updates[:10]]
+                      or role_fixes[:10],
+        }
+        if dry_run:
+            return report
+        
+        if level_updates:
+            self.storage.set_user_levels(guild.id, level_updates)
+            for user_id, _ in level_updates:
+                self.note_xp_change(guild.id, user_id, totals.get(user_id, 0))
+        for start in range(0, len(role_fixes), batch_size):
+            for user_id, old_level, new_level in role_fixes[start:start + batch_size]:
+                await self.update_user_level_role(user_id, guild.id, old_level, new_level)
+            report["roles_done"] = min(start + batch_size, len(role_fixes))
+            if progress:
+                await progress(report)
+            if report["roles_done"] < len(role_fixes):
+                await asyncio.sleep(pause)
+        return report
+    
+    def take_xp_snapshot(self, guild_id: int):
+        """Materialize the guild's base XP at the newest ledger row, returns (ledger_id, users)"""
+        return self.storage.take_xp_snapshot(guild_id, XP_SNAPSHOT_KEEP)
+    
+    async def rebuild_xp(self, guild_id: int, exclude_ids: List[int] = (), dry_run: bool = False) -> dict:
+        """Replay the ledger from the newest usable snapshot into fresh base XP and fix users that differ
+        
+        Ledger rows in exclude_ids are left out (e.g. a bad admin command), so the replay starts from
+        the newest snapshot taken before the first of them. Fixes go through bulk_update_user_xp and
+        are recorded in the ledger themselves, so later snapshots and replays stay consistent. Base XP
+        changes commit together with their ledger rows, so there is nothing buffered to wait for.
+        The replay and the diff run on a worker thread; only the fixes are applied on the event loop.
+        """
+        snapshots = self.storage.list_xp_snapshots(guild_id)
+        if exclude_ids:
+            snapshots = [ledger_id for ledger_id in snapshots if ledger_id < min(exclude_ids)]
+        if not snapshots:
+            raise ValueError("no XP snapshot old enough to replay from")
+        snapshot_id = snapshots[0]
+        
+        def plan():
+            replayed, current = self.storage.compare_xp_ledger(guild_id, snapshot_id, exclude_ids)
+            rebuilt = {user_id: max(0, xp) for user_id, xp in replayed.items()}
+            changes = {user_id: rebuilt.get(user_id, 0) for user_id in current.keys() | rebuilt.keys()
+                       if rebuilt.get(user_id, 0) != current.get(user_id, 0)}
+            return rebuilt, current, changes
+        
+        rebuilt, current, changes = await asyncio.to_thread(plan)
+        report = {
+            "snapshot": snapshot_id,
+            "users": len(rebuilt),
+            "changed": len(changes),
+            "excluded": len(exclude_ids),
+            "dry_run": dry_run,
+            "sample": [(user_id, current.get(user_id, 0), xp) for user_id, xp in list(changes.items())[:10]],
+        }
+        if changes and not dry_run:
+            self.bulk_update_user_xp(guild_id, changes, mode="set", source="rebuild")
+        return report
+    
+    def calculate_total_xp_bulk(self, guild_id: int, user_ids: List[int]) -> Dict[int, int]:
+        """Total XP for many users with one base-XP query, one streak query and one pass over their roles
+        
+        Role XP is summed from per-role values (see xp_totals.py), vectorized when NumPy is installed.
+        """
+        if not user_ids:
+            return {}
+        base_xp = self.storage.get_users_xp(guild_id, user_ids)
+        streak_xp = self.storage.get_streak_xp_bulk(guild_id, user_ids)
+        
+        guild = bot.get_guild(guild_id)
+        if not guild:
+            # Same fallback as calculate_total_user_xp - database XP only
+            return {user_id: base_xp.get(user_id, 0) for user_id in user_ids}
+        members = [guild.get_member(user_id) for user_id in user_ids]
+        role_values = xp_totals.role_xp_values(guild.roles, self.role_xp_assignments.get(guild_id, {}))
+        return dict(zip(user_ids, xp_totals.total_xp(user_ids, members, base_xp, streak_xp, role_values)))
+    
+    def calculate_levels_bulk(self, totals: Dict[int, int]) -> Dict[int, int]:
+        """Levels for {user_id: total_xp} in one pass, same as calculate_level for each"""
+        return dict(zip(totals, xp_totals.levels(list(totals.values()), LEVEL_THRESHOLD_LIST)))
+    
+    def calculate_role_xp(self, member, guild_id: int):
+        """XP from a member's current roles in one walk, as (assigned non-streak roles, 5 XP per unassigned badge role)"""
+        assignments = self.role_xp_assignments.get(guild_id, {})
+        badge_xp = auto_badge_xp = 0
+        for role in member.roles:
+            # Level roles never count, to avoid a circular dependency
+            if role.name.startswith("Level "):
+                continue
+            role_data = assignments.get(str(role.id))
+            if role_data:
+                # Streak roles count through their accumulated gains instead
+                if role_data["type"] != "streak":
+                    badge_xp += role_data["xp"]
+            elif "badge" in role.name.lower():
+                auto_badge_xp += 5
+        return badge_xp, auto_badge_xp
+    
+    def schedule_bulk_role_sync(self, guild_id: int, level_changes):
+        """Queue level role updates for many users as one background task"""
+        async def sync_all():
+            for user_id, old_level, new_level in level_changes:
+                await self.update_user_level_role(user_id, guild_id, old_level, new_level)
+        
+        task = asyncio.create_task(sync_all())
+        self.pending_role_syncs.add(task)
+        task.add_done_callback(self.pending_role_syncs.discard)
+        return task
+    
+    def schedule_role_sync(self, user_id: int, guild_id: int, old_level: int, new_level: int):
+        """Queue a level role update in the background and track it until it finishes"""
+        task = asyncio.create_task(self.update_user_level_role(user_id, guild_id, old_level, new_level))
+        self.pending_role_syncs.add(task)
+        task.add_done_callback(self.pending_role_syncs.discard)
+        return task
+    
+    def probe_database(self, timeout: float = 1.0) -> float:
+        """Take and release the write lock on a separate connection, returns round-trip time in ms"""
+        return self.storage.probe(timeout)
+    
     async def create_level_roles(self, guild):
         """Create level roles if they don't exist"""
         try:
@@ -258,73 +509,22 @@ class QuestBot:
                 return level
         return 1
     
+    def get_xp_breakdown(self, user_id: int, guild_id: int, member=None) -> XPBreakdown:
+        """Quest, streak and badge XP, total, level and progress with one storage round trip and one role walk"""
+        if member is None:
+            guild = bot.get_guild(guild_id)
+            member = guild.get_member(user_id) if guild else None
+        quest_xp, streak_xp = self.storage.get_xp_sources(user_id, guild_id)
+        if member is None:
+            # Without the member we can't see their roles - database XP only
+            return XPBreakdown(quest_xp=quest_xp)
+        badge_xp, auto_badge_xp = self.calculate_role_xp(member, guild_id)
+        return XPBreakdown(quest_xp=quest_xp, streak_xp=streak_xp, badge_xp=badge_xp, auto_badge_xp=auto_badge_xp)
+    
     def calculate_total_user_xp(self, user_id: int, guild_id: int) -> int:
         """Calculate total XP including quest XP + role-based XP"""
         try:
-            guild = bot.get_guild(guild_id)
-            if not guild:
-                print(f"Guild {guild_id} not found")
-                user_data = self.get_user_data(user_id, guild_id)
-                return user_data.get('xp', 0)
-            
-            member = guild.get_member(user_id)
-            if not member:
-                print(f"Member {user_id} not found in guild {guild_id}")
-                user_data = self.get_user_data(user_id, guild_id)
-                return user_data.get('xp', 0)
-            
-            # Get base XP from database (quest completions and manual additions)
-            user_data = self.get_user_data(user_id, guild_id)
-            base_xp = user_data.get('xp', 0)
-            
-            # Add XP from custom assigned roles (excluding streak roles which use accumulated system)
-            custom_role_xp = 0
-            for role in member.roles:
-                # Skip level roles - they don't contribute to XP calculation to avoid circular dependency
-                if role.name.startswith("Level "):
-                    continue
-                    
-                role_xp_data = self.get_role_xp_and_type(guild_id, str(role.id))
-                if role_xp_data:
-                    xp_amount, role_type = role_xp_data
-                    # Skip streak roles since they now use accumulated XP system
-                    if role_type != "streak":
-                        custom_role_xp += xp_amount
-            
-            # Add XP from accumulated streak roles (historical gains)
-            accumulated_streak_xp = self.get_accumulated_streak_xp(user_id, guild_id)
-            
-            # Add XP from current badge roles (only for unassigned roles that have "badge" in name)
-            auto_role_xp = 0
-            badge_roles_found = []
-            for role in member.roles:
-                # Skip level roles - they don't contribute to XP calculation
-                if role.name.startswith("Level "):
-                    continue
-                    
-                role_name_lower = role.name.lower()
-                role_id_str = str(role.id)
-                role_xp_data = self.get_role_xp_and_type(guild_id, role_id_str)
-                # Only apply auto-detection fallback if role doesn't have explicit assignment
-                if not role_xp_data:
-                    # Badge roles give 5 XP each (fallback for unassigned roles)
-                    if "badge" in role_name_lower:
-                        auto_role_xp += 5
-                        badge_roles_found.append(role.name)
-                    # Note: Streak roles now use accumulated XP instead of current roles
-            
-            # Calculate total XP - sum of base XP + all role bonuses + accumulated streak XP
-            # NO level role XP to avoid circular dependency in level calculation
-            total_xp = base_xp + custom_role_xp + auto_role_xp + accumulated_streak_xp
-            
-            # Log badge roles found for debugging
-            if badge_roles_found:
-                print(f"Role XP for {member.display_name}: Badge roles: {badge_roles_found}, Auto XP: {auto_role_xp}")
-            if accumulated_streak_xp > 0:
-                print(f"Accumulated Streak XP for {member.display_name}: {accumulated_streak_xp}")
-            
-            return total_xp
-            
+            return self.get_xp_breakdown(user_id, guild_id).total
         except Exception as e:
             print(f"Error calculating total XP for user {user_id}: {e}")
             import traceback
@@ -333,91 +533,187 @@ class QuestBot:
             user_data = self.get_user_data(user_id, guild_id)
             return user_data.get('xp', 0)
     
-    def get_leaderboard(self, guild_id: int, limit: int = 10):
-        """Get top users for leaderboard with total XP including roles (opted-in users only)"""
-        if not self.db_connection:
-            return []
-        cursor = self.db_connection.cursor()
-        cursor.execute('SELECT user_id, xp, level FROM users WHERE guild_id = ? ORDER BY xp DESC', (guild_id,))
-        all_users = cursor.fetchall()
-        
-        # Calculate total XP for each user (including role bonuses) and filter for opted-in users only
-        users_with_total_xp = []
-        for user_id, base_xp, level in all_users:
-            # Only include users who are opted into the bot
+    def build_ranking(self, guild_id: int):
+        """Build the ranking index for a guild with one full scan of its users"""
+        # Only opted-in users (any Level role, as in is_user_opted_in) are ranked, by total XP including role bonuses
+        guild = bot.get_guild(guild_id)
+        if not guild:
+            return self.rankings.build(guild_id, [])
+        user_ids = []
+        for user_id in self.storage.list_user_ids(guild_id):
+            member = guild.get_member(user_id)
+            if member and any(role.name.startswith("Level ") for role in member.roles):
+                user_ids.append(user_id)
+        return self.rankings.build(guild_id, list(self.calculate_total_xp_bulk(guild_id, user_ids).items()))
+    
+    def get_ranking(self, guild_id: int):
+        """Get the ranking index for a guild, building it on first use"""
+        ranking = self.rankings.get(guild_id)
+        if ranking is None:
+            ranking = self.build_ranking(guild_id)
+        return ranking
+    
+    def get_leaderboard(self, guild_id: int, limit: int = 10, offset: int = 0):
+        """Get a page of the leaderboard as (user_id, total_xp, level) rows (opted-in users only)"""
+        ranking = self.get_ranking(guild_id)
+        return [(user_id, total_xp, self.calculate_level(total_xp))
+                for user_id, total_xp in ranking.page(offset, limit)]
+    
+    def get_user_rank(self, guild_id: int, user_id: int):
+        """Get a user's leaderboard position and the entries just above and below them"""
+        ranking = self.get_ranking(guild_id)
+        position = ranking.rank(user_id)
+        if position is None:
+            return None
+        above = ranking.page(position - 2, 1) if position > 1 else []
+        below = ranking.page(position, 1)
+        return {
+            'position': position,
+            'total_ranked': len(ranking),
+            'total_xp': ranking.total(user_id),
+            'above': above[0] if above else None,
+            'below': below[0] if below else None
+        }
+    
+    def get_cached_leaderboard(self, guild_id: int):
+        """Get the rendered leaderboard embed for a guild if it is still valid"""
+        entry = self.leaderboard_cache.get(guild_id)
+        if not entry:
+            return None
+        if time.monotonic() >= entry['expires_at']:
+            del self.leaderboard_cache[guild_id]
+            return None
+        return entry['embed']
+    
+    def cache_leaderboard(self, guild_id: int, embed, leaderboard_data):
+        """Store a rendered leaderboard along with the users and cutoff score it shows"""
+        self.leaderboard_cache[guild_id] = {
+            'embed': embed,
+            'user_ids': {user_id for user_id, _, _ in leaderboard_data},
+            'full': len(leaderboard_data) >= LEADERBOARD_SIZE,
+            'cutoff': min((xp for _, xp, _ in leaderboard_data), default=0),
+            'expires_at': time.monotonic() + LEADERBOARD_CACHE_TTL
+        }
+    
+    def invalidate_leaderboard(self, guild_id: int):
+        """Drop the cached leaderboard for a guild"""
+        self.leaderboard_cache.pop(guild_id, None)
+    
+    def remove_from_ranking(self, guild_id: int, user_id: int):
+        """Take a user off the leaderboard (e.g. they left the server)"""
+        ranking = self.rankings.get(guild_id)
+        if ranking is not None and user_id in ranking:
+            ranking.remove(user_id)
+            self.invalidate_leaderboard(guild_id)
+    
+    def note_xp_change(self, guild_id: int, user_id: int, total_xp: Optional[int] = None):
+        """Move the user in the ranking index and invalidate the cached leaderboard if it is affected"""
+        ranking = self.rankings.get(guild_id)
+        entry = self.leaderboard_cache.get(guild_id)
+        if ranking is None and entry is None:
+            return
+        if total_xp is None:
+            total_xp = self.calculate_total_user_xp(user_id, guild_id)
+        
+        if ranking is not None:
+            # Losing every Level role means the user opted out
             if self.is_user_opted_in(user_id, guild_id):
-                total_xp = self.calculate_total_user_xp(user_id, guild_id)
-                new_level = self.calculate_level(total_xp)
-                users_with_total_xp.append((user_id, total_xp, new_level))
+                ranking.update(user_id, total_xp)
+            else:
+                ranking.remove(user_id)
         
-        # Sort by total XP and limit results
-        users_with_total_xp.sort(key=lambda x: x[1], reverse=True)
-        return users_with_total_xp[:limit]
+        if not entry:
+            return
+        # Someone already on the board changed, or the board still has free slots
+        if user_id in entry['user_ids'] or not entry['full']:
+            self.invalidate_leaderboard(guild_id)
+            return
+        # Outside the top N - only matters if they now reach the cutoff score
+        if total_xp >= entry['cutoff']:
+            self.invalidate_leaderboard(guild_id)
+    
+    def get_guild_settings(self, guild_id: int) -> dict:
+        """Per-guild bot settings, created with defaults on first use"""
+        if guild_id not in self.guild_settings:
+            self.guild_settings[guild_id] = {
+                "quest_ping_role_id": None,
+                "quest_channel_id": None,
+                "optin_message_id": None,
+                "optin_channel_id": None,
+            }
+        return self.guild_settings[guild_id]
     
     def save_settings(self, guild_id: int):
         """Save bot settings to database"""
-        if not self.db_connection:
-            return
-        cursor = self.db_connection.cursor()
-        role_xp_json = json.dumps(self.role_xp_assignments.get(guild_id, {}))
-        cursor.execute('''
-            INSERT OR REPLACE INTO settings 
-            (guild_id, quest_ping_role_id, quest_channel_id, role_xp_assignments, optin_message_id, optin_channel_id) 
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (guild_id, self.quest_ping_role_id, self.quest_channel_id, role_xp_json, self.optin_message_id, self.optin_channel_id))
-        self.db_connection.commit()
+        self.storage.save_settings(guild_id, self.get_guild_settings(guild_id))
+        self.publish_invalidation(guild_id, "settings")
+    
+    def publish_invalidation(self, guild_id: int, kind: str):
+        """Tell other worker processes to reload a guild's cached data ("settings", "whitelist" or "guild")"""
+        self.storage.publish_invalidation(guild_id, kind, INSTANCE_ID)
+    
+    def apply_invalidation(self, guild_id: int, kind: str):
+        """Drop or reload whatever a cache invalidation covers"""
+        if kind in ("whitelist", "guild"):
+            self.whitelist_cache.pop(guild_id, None)
+        if kind in ("settings", "guild"):
+            self.load_settings(guild_id)
+            # Role XP may have changed, so every total in the ranking may be stale
+            self.rankings.drop(guild_id)
+            self.invalidate_leaderboard(guild_id)
+        if kind == "guild":
+            # An import gives scheduled quests new IDs and may bring quests with end times. Entries left
+            # for the replaced rows are skipped when they come due, and the scheduler ignores duplicates.
+            self.load_quest_schedule(guild_id)
+    
+    def poll_invalidations(self) -> int:
+        """Apply invalidations published by other processes for guilds this process serves"""
+        applied = 0
+        for row_id, guild_id, kind, source in self.storage.invalidations_since(self.last_invalidation_id):
+            self.last_invalidation_id = row_id
+            if source == INSTANCE_ID or not bot.get_guild(guild_id):
+                continue
+            self.apply_invalidation(guild_id, kind)
+            applied += 1
+        self.invalidations_applied += applied
+        return applied
+    
+    def prune_invalidations(self, max_age_seconds: float = INVALIDATION_RETENTION_SECONDS):
+        self.storage.prune_invalidations(time.time() - max_age_seconds)
+    
+    def write_heartbeat(self, worker_id: str, shard_ids, report: dict):
+        """Record this worker's health for the cluster launcher"""
+        self.storage.write_heartbeat(worker_id, shard_ids, report)
     
     def load_settings(self, guild_id: int):
         """Load bot settings from database"""
-        if not self.db_connection:
-            return
-        cursor = self.db_connection.cursor()
-        cursor.execute('SELECT quest_ping_role_id, quest_channel_id, role_xp_assignments, optin_message_id, optin_channel_id FROM settings WHERE guild_id = ?', (guild_id,))
-        result = cursor.fetchone()
+        result = self.storage.load_settings(guild_id)
+        # Start from defaults so a reload never keeps values the database no longer has
+        self.guild_settings.pop(guild_id, None)
+        settings = self.get_guild_settings(guild_id)
         if result:
-            self.quest_ping_role_id = result[0]
-            self.quest_channel_id = result[1]
-            loaded_assignments = json.loads(result[2])
-            self.optin_message_id = result[3] if len(result) > 3 else None
-            self.optin_channel_id = result[4] if len(result) > 4 else None
-            
-            # Migrate old format to new format if needed
-            migrated_assignments = {}
-            for role_id, data in loaded_assignments.items():
-                if isinstance(data, int):
-                    # Old format: role_id -> xp_amount
-                    # Migrate to new format: role_id -> {"xp": xp_amount, "type": "badge"}
-                    # Default to "badge" for backward compatibility
-                    migrated_assignments[role_id] = {"xp": data, "type": "badge"}
-                else:
-                    # New format: role_id -> {"xp": xp_amount, "type": "streak"|"badge"}
-                    migrated_assignments[role_id] = data
-            
-            self.role_xp_assignments[guild_id] = migrated_assignments
+            for key in settings:
+                settings[key] = result[key]
+        # One scan of the guild's role_xp rows; the old JSON format is migrated once when the schema is opened
+        self.role_xp_assignments[guild_id] = self.storage.list_role_xp(guild_id)
     
     def record_streak_role_gain(self, user_id: int, guild_id: int, role_id: int, role_name: str, xp_awarded: int):
         """Record when a user gains a streak role for accumulation tracking"""
-        if not self.db_connection:
-            return
-        cursor = self.db_connection.cursor()
-        cursor.execute('''
-            INSERT INTO streak_role_gains (user_id, guild_id, role_id, role_name, xp_awarded)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user_id, guild_id, role_id, role_name, xp_awarded))
-        self.db_connection.commit()
+        self.storage.record_streak_gain(user_id, guild_id, role_id, role_name, xp_awarded)
+        self.ledger.append(guild_id, user_id, xp_awarded, "streak", role_id)
         print(f"Recorded streak role gain: {role_name} (+{xp_awarded} XP) for user {user_id}")
     
     def get_accumulated_streak_xp(self, user_id: int, guild_id: int) -> int:
-        """Get total accumulated streak XP from all historical role gains"""
-        if not self.db_connection:
-            return 0
-        cursor = self.db_connection.cursor()
-        cursor.execute('''
-            SELECT SUM(xp_awarded) FROM streak_role_gains 
-            WHERE user_id = ? AND guild_id = ?
-        ''', (user_id, guild_id))
-        result = cursor.fetchone()
-        return result[0] if result[0] else 0
+        """Get total accumulated streak XP from recent role gains plus compacted history"""
+        return self.storage.get_streak_xp(user_id, guild_id)
+
+    def compact_streak_history(self, max_age_days: float, batch_size: int = 5000, vacuum_pages: int = 2000) -> dict:
+        """Roll streak gains older than max_age_days into per-role totals (blocking, thread-safe)"""
+        return self.storage.compact_streak_history(max_age_days, batch_size, vacuum_pages)
+
+    def vacuum_database(self):
+        """Rebuild the whole database file - blocks writers while it runs"""
+        self.storage.vacuum()
     
     def get_role_xp_and_type(self, guild_id: int, role_id: str):
         """Get XP amount and type for a role, returns (xp, type) or None if not assigned"""
@@ -429,15 +725,22 @@ class QuestBot:
         return None
     
     def assign_role_xp(self, guild_id: int, role_id: str, xp_amount: int, role_type: str):
-        """Assign XP and type to a role"""
+        """Assign XP and type to a role, saved right away as a single row"""
+        self.storage.set_role_xp(guild_id, int(role_id), xp_amount, role_type)
         if guild_id not in self.role_xp_assignments:
             self.role_xp_assignments[guild_id] = {}
         self.role_xp_assignments[guild_id][role_id] = {"xp": xp_amount, "type": role_type}
+        # Every member holding this role may have a different total now
+        self.rankings.drop(guild_id)
+        self.invalidate_leaderboard(guild_id)
     
     def unassign_role_xp(self, guild_id: int, role_id: str):
-        """Remove XP assignment from a role"""
+        """Remove XP assignment from a role, deleting its row right away"""
+        self.storage.delete_role_xp(guild_id, int(role_id))
         if guild_id in self.role_xp_assignments and role_id in self.role_xp_assignments[guild_id]:
             del self.role_xp_assignments[guild_id][role_id]
+            self.rankings.drop(guild_id)
+            self.invalidate_leaderboard(guild_id)
     
     def is_user_opted_in(self, user_id: int, guild_id: int) -> bool:
         """Check if user is opted into the bot (has Level 1+ role)"""
@@ -462,14 +765,10 @@ class QuestBot:
     def add_whitelisted_channel(self, guild_id: int, channel_id: int, channel_name: str):
         """Add a channel to the whitelist"""
         try:
-            if self.db_connection:
-                cursor = self.db_connection.cursor()
-                cursor.execute('''
-                    INSERT OR REPLACE INTO whitelisted_channels (guild_id, channel_id, channel_name)
-                    VALUES (?, ?, ?)
-                ''', (guild_id, channel_id, channel_name))
-                self.db_connection.commit()
-                return True
+            self.storage.add_whitelisted_channel(guild_id, channel_id, channel_name)
+            self.whitelist_cache.pop(guild_id, None)
+            self.publish_invalidation(guild_id, "whitelist")
+            return True
         except Exception as e:
             print(f"Error adding whitelisted channel: {e}")
         return False
@@ -477,77 +776,298 @@ class QuestBot:
     def remove_whitelisted_channel(self, guild_id: int, channel_id: int):
         """Remove a channel from the whitelist"""
         try:
-            if self.db_connection:
-                cursor = self.db_connection.cursor()
-                cursor.execute('''
-                    DELETE FROM whitelisted_channels WHERE guild_id = ? AND channel_id = ?
-                ''', (guild_id, channel_id))
-                self.db_connection.commit()
-                return cursor.rowcount > 0
+            removed = self.storage.remove_whitelisted_channel(guild_id, channel_id)
+            self.whitelist_cache.pop(guild_id, None)
+            self.publish_invalidation(guild_id, "whitelist")
+            return removed
         except Exception as e:
             print(f"Error removing whitelisted channel: {e}")
         return False
     
     def get_whitelisted_channels(self, guild_id: int):
-        """Get all whitelisted channels for a guild"""
+        """Get all whitelisted channels for a guild (cached - runs on every command)"""
+        if guild_id in self.whitelist_cache:
+            return self.whitelist_cache[guild_id]
         try:
-            if self.db_connection:
-                cursor = self.db_connection.cursor()
-                cursor.execute('''
-                    SELECT channel_id, channel_name FROM whitelisted_channels WHERE guild_id = ?
-                ''', (guild_id,))
-                return cursor.fetchall()
+            self.whitelist_cache[guild_id] = self.storage.list_whitelisted_channels(guild_id)
+            return self.whitelist_cache[guild_id]
         except Exception as e:
             print(f"Error getting whitelisted channels: {e}")
         return []
     
     def is_channel_whitelisted(self, guild_id: int, channel_id: int):
         """Check if a channel is whitelisted"""
-        try:
-            if self.db_connection:
-                cursor = self.db_connection.cursor()
-                cursor.execute('''
-                    SELECT 1 FROM whitelisted_channels WHERE guild_id = ? AND channel_id = ?
-                ''', (guild_id, channel_id))
-                return cursor.fetchone() is not None
-        except Exception as e:
-            print(f"Error checking if channel is whitelisted: {e}")
-        return True  # Default to allowing if error occurs
+        return any(whitelisted_id == channel_id for whitelisted_id, _ in self.get_whitelisted_channels(guild_id))
     
     def clear_whitelisted_channels(self, guild_id: int):
         """Clear all whitelisted channels for a guild"""
         try:
-            if self.db_connection:
-                cursor = self.db_connection.cursor()
-                cursor.execute('DELETE FROM whitelisted_channels WHERE guild_id = ?', (guild_id,))
-                self.db_connection.commit()
-                return cursor.rowcount
+            cleared = self.storage.clear_whitelisted_channels(guild_id)
+            self.whitelist_cache.pop(guild_id, None)
+            self.publish_invalidation(guild_id, "whitelist")
+            return cleared
         except Exception as e:
             print(f"Error clearing whitelisted channels: {e}")
         return 0
 
 quest_bot = QuestBot()
 
-@bot.event
-async def on_ready():
-    print(f'{bot.user} has logged in to Discord!')
-    for guild in bot.guilds:
-        quest_bot.load_settings(guild.id)
-        # Create level roles on startup
-        await quest_bot.create_level_roles(guild)
-        # Cache members to improve role reading
+async def cache_members(guild, user_ids) -> int:
+    """Fetch members by ID in batches and keep them in the member cache, returns how many were found"""
+    missing = [user_id for user_id in user_ids if guild.get_member(user_id) is None]
+    found = 0
+    for start in range(0, len(missing), MEMBER_QUERY_BATCH):
+        batch = missing[start:start + MEMBER_QUERY_BATCH]
+        try:
+            members = await guild.query_members(user_ids=batch, limit=len(batch), cache=True)
+            found += len(members)
+        except asyncio.TimeoutError:
+            print(f"Timed out fetching {len(batch)} members for {guild.name}")
+        except Exception as e:
+            print(f"Failed to fetch members for {guild.name}: {e}")
+    return len(user_ids) - len(missing) + found
+
+async def initialize_guild(guild):
+    """Load settings, level roles, member cache and ranking for one guild"""
+    quest_bot.startup_progress[guild.id] = "loading"
+    quest_bot.load_settings(guild.id)
+    quest_bot.load_quest_schedule(guild.id)
+    # Create level roles on startup
+    await quest_bot.create_level_roles(guild)
+    # Cache members to improve role reading
+    if MEMBER_CACHE_MODE == "participants":
+        cached = await cache_members(guild, quest_bot.storage.list_user_ids(guild.id))
+        print(f"Cached {cached} participating members of {guild.member_count} for {guild.name}")
+    else:
         try:
             await guild.chunk()
             print(f"Cached {guild.member_count} members for {guild.name}")
         except Exception as e:
             print(f"Failed to cache members for {guild.name}: {e}")
-    # Sync slash commands
+    # Warm the leaderboard ranking so the first -leaderboard/-rank is fast
+    quest_bot.build_ranking(guild.id)
+    # Baseline for ledger replays - XP from before the ledger existed only lives in this snapshot
+    if not quest_bot.storage.list_xp_snapshots(guild.id):
+        quest_bot.take_xp_snapshot(guild.id)
+    quest_bot.startup_progress[guild.id] = "ready"
+
+def update_shard_status(shard_id: int, **changes):
+    status = quest_bot.shard_status.setdefault(shard_id, {
+        "state": "connecting", "guilds": 0, "ready_at": None, "disconnected_since": None, "reconnects": 0
+    })
+    status.update(changes)
+    return status
+
+@bot.event
+async def on_shard_ready(shard_id):
+    """Initialize only the guilds this shard owns, so shards come up independently"""
+    guilds = [guild for guild in bot.guilds if guild.shard_id == shard_id]
+    print(f"Shard {shard_id} ready with {len(guilds)} guild(s)")
+    update_shard_status(shard_id, state="loading", guilds=len(guilds), disconnected_since=None)
+    for guild in guilds:
+        quest_bot.startup_progress.setdefault(guild.id, "pending")
+    for guild in guilds:
+        await initialize_guild(guild)
+    update_shard_status(shard_id, state="ready", ready_at=time.time())
+    expected = bot.shard_ids or range(bot.shard_count or 1)
+    quest_bot.startup_complete = all(
+        quest_bot.shard_status.get(expected_id, {}).get("state") == "ready" for expected_id in expected)
+
+@bot.event
+async def on_ready():
+    """Runs once every shard has connected - process-wide startup only"""
+    print(f'{bot.user} has logged in to Discord on {len(bot.shards)} shard(s)!')
+    start_background_tasks()
+    if not RUN_MAINTENANCE:
+        return
+    # Sync slash commands (global, so only one cluster worker does it)
     try:
         synced = await bot.tree.sync()
         print(f"Synced {len(synced)} slash commands")
     except Exception as e:
         print(f"Failed to sync slash commands: {e}")
 
+@bot.event
+async def on_guild_join(guild):
+    shard = quest_bot.shard_status.get(guild.shard_id)
+    if shard:
+        shard["guilds"] += 1
+    await initialize_guild(guild)
+
+@bot.event
+async def on_guild_remove(guild):
+    shard = quest_bot.shard_status.get(guild.shard_id)
+    if shard:
+        shard["guilds"] = max(0, shard["guilds"] - 1)
+    quest_bot.startup_progress.pop(guild.id, None)
+    quest_bot.rankings.drop(guild.id)
+    quest_bot.invalidate_leaderboard(guild.id)
+
+backup_lock = asyncio.Lock()
+
+async def run_database_backup() -> dict:
+    """Snapshot the database on a worker thread and prune old snapshots"""
+    async with backup_lock:
+        if quest_bot.storage.db_path:
+            result = await asyncio.to_thread(backup.create_snapshot, quest_bot.storage.db_path, BACKUP_DIR,
+                                             BACKUP_PAGES_PER_STEP)
+        else:
+            # In-memory backend: copy the rows on the loop, write the SQLite file on a worker thread
+            os.makedirs(BACKUP_DIR, exist_ok=True)
+            result = await asyncio.to_thread(storage.write_snapshot, quest_bot.storage.export_records(),
+                                             backup.snapshot_path(BACKUP_DIR))
+        result["pruned"] = len(await asyncio.to_thread(backup.prune_snapshots, BACKUP_DIR, BACKUP_KEEP))
+    print(f"Database backup written to {result['path']} in {result['seconds']}s ({result['pruned']} old snapshot(s) pruned)")
+    return result
+
+@tasks.loop(hours=max(BACKUP_INTERVAL_HOURS, 0.01))
+async def scheduled_backup():
+    try:
+        await run_database_backup()
+    except Exception as e:
+        print(f"Scheduled database backup failed: {e}")
+
+@tasks.loop(hours=max(STREAK_COMPACTION_INTERVAL_HOURS, 0.01))
+async def scheduled_streak_compaction():
+    try:
+        result = await asyncio.to_thread(quest_bot.compact_streak_history, STREAK_HISTORY_DAYS)
+        print(f"Compacted {result['compacted_rows']} streak gain rows older than {result['cutoff']} "
+              f"({result['pages_released']} pages released)")
+    except Exception as e:
+        print(f"Scheduled streak compaction failed: {e}")
+
+reconcile_lock = asyncio.Lock()
+
+@tasks.loop(hours=max(LEVEL_RECONCILE_INTERVAL_HOURS, 0.01))
+async def scheduled_level_reconciliation():
+    for guild in list(bot.guilds):
+        # Guilds still loading their member cache would look like everyone lost their role XP
+        if quest_bot.startup_progress.get(guild.id) != "ready":
+            continue
+        try:
+            async with reconcile_lock:
+                report = await quest_bot.reconcile_levels(guild)
+            if report["level_updates"] or report["role_fixes"]:
+                print(f"Level reconciliation for {guild.name}: {report['level_updates']} stored level(s) and "
+                      f"{report['role_fixes']} Level role(s) fixed out of {report['members']} members")
+        except Exception as e:
+            print(f"Level reconciliation failed for {guild.name}: {e}")
+
+@scheduled_level_reconciliation.before_loop
+async def before_level_reconciliation():
+    # The first pass waits for every shard's guilds to finish loading
+    while not quest_bot.startup_complete:
+        await asyncio.sleep(30)
+
+@tasks.loop(hours=max(XP_SNAPSHOT_INTERVAL_HOURS, 0.01))
+async def scheduled_xp_snapshots():
+    # Only the worker owning a guild writes its ledger rows, so each worker snapshots its own guilds
+    for guild in list(bot.guilds):
+        if quest_bot.startup_progress.get(guild.id) != "ready":
+            continue
+        try:
+            ledger_id, users = quest_bot.take_xp_snapshot(guild.id)
+            print(f"XP snapshot for {guild.name} at ledger row {ledger_id} ({users} users)")
+        except Exception as e:
+            print(f"XP snapshot failed for {guild.name}: {e}")
+
+@scheduled_xp_snapshots.before_loop
+async def before_xp_snapshots():
+    # Startup already took a baseline for guilds without one; the first periodic snapshot waits a full interval
+    await asyncio.sleep(XP_SNAPSHOT_INTERVAL_HOURS * 3600)
+
+@tasks.loop(seconds=max(CACHE_POLL_SECONDS, 0.1))
+async def poll_cache_invalidations():
+    try:
+        quest_bot.poll_invalidations()
+    except Exception as e:
+        print(f"Cache invalidation poll failed: {e}")
+
+heartbeat_extra = None  # optional callable adding fields to every heartbeat (cluster.py fake workers)
+
+async def write_cluster_heartbeat(extra: dict = None):
+    """Publish this worker's health and shard state to the cluster_status table"""
+    liveness = webserver.liveness_report(bot, quest_bot)
+    readiness = await webserver.readiness_report(bot, quest_bot)
+    report = {
+        "alive": liveness["alive"],
+        "ready": readiness["ready"],
+        "checks": {**liveness["checks"], **readiness["checks"]},
+        "latency_ms": readiness["latency_ms"],
+        "shards": readiness["shards"],
+        "guilds": len(quest_bot.startup_progress),
+        "backlog": readiness["backlog"],
+        "invalidations_applied": quest_bot.invalidations_applied,
+    }
+    report.update(extra or {})
+    quest_bot.write_heartbeat(WORKER_ID, bot.shard_ids, report)
+
+@tasks.loop(seconds=max(HEARTBEAT_SECONDS, 0.1))
+async def cluster_heartbeat():
+    try:
+        await write_cluster_heartbeat(heartbeat_extra() if heartbeat_extra else None)
+        if RUN_MAINTENANCE:
+            quest_bot.prune_invalidations()
+    except Exception as e:
+        print(f"Cluster heartbeat failed: {e}")
+
+@tasks.loop(seconds=0)
+async def quest_scheduler_loop():
+    # Sleeps inside wait() until the next posting or end time, so the loop itself needs no interval
+    try:
+        await quest_bot.quest_scheduler.wait()
+        await run_due_quest_jobs()
+    except Exception as e:
+        print(f"Quest scheduler failed: {e}")
+        await asyncio.sleep(5)
+
+def start_background_tasks():
+    """Start the periodic jobs; in cluster mode maintenance runs in one worker only"""
+    if CACHE_POLL_SECONDS > 0 and not poll_cache_invalidations.is_running():
+        poll_cache_invalidations.start()
+    # Every worker runs its own scheduler - it only acts on quests in guilds it owns
+    if not quest_scheduler_loop.is_running():
+        quest_scheduler_loop.start()
+    if WORKER_ID and not cluster_heartbeat.is_running():
+        cluster_heartbeat.start()
+    # Role edits need the guild's members, so every worker reconciles the guilds it owns
+    if LEVEL_RECONCILE_INTERVAL_HOURS > 0 and not scheduled_level_reconciliation.is_running():
+        scheduled_level_reconciliation.start()
+    if XP_SNAPSHOT_INTERVAL_HOURS > 0 and not scheduled_xp_snapshots.is_running():
+        scheduled_xp_snapshots.start()
+    if not RUN_MAINTENANCE:
+        return
+    if BACKUP_INTERVAL_HOURS > 0 and not scheduled_backup.is_running():
+        scheduled_backup.start()
+    if STREAK_COMPACTION_INTERVAL_HOURS > 0 and not scheduled_streak_compaction.is_running():
+        scheduled_streak_compaction.start()
+
+@bot.event
+async def on_socket_event_type(event_type):
+    """Track gateway activity for the health endpoints"""
+    quest_bot.last_event_at = time.time()
+
+@bot.event
+async def on_shard_disconnect(shard_id):
+    status = update_shard_status(shard_id)
+    if status["disconnected_since"] is None:
+        update_shard_status(shard_id, state="disconnected", disconnected_since=time.time())
+
+def mark_shard_connected(shard_id: int):
+    status = update_shard_status(shard_id)
+    if status["disconnected_since"] is not None:
+        status["reconnects"] += 1
+    # A fresh shard stays "connecting" until on_shard_ready; a loaded one goes straight back to ready
+    update_shard_status(shard_id, state="ready" if status["ready_at"] else "connecting", disconnected_since=None)
+
+@bot.event
+async def on_shard_connect(shard_id):
+    mark_shard_connected(shard_id)
+
+@bot.event
+async def on_shard_resumed(shard_id):
+    mark_shard_connected(shard_id)
+
 async def is_channel_whitelisted_check(ctx):
     """Global check to enforce channel whitelist for commands"""
     # Always allow DMs
@@ -601,6 +1121,12 @@ async def send_whitelisted_message(channel, **kwargs):
     # Silently skip sending to non-whitelisted channels
     return None
 
+def queue_optin_notice(channel, user):
+    quest_bot.notices.add(
+        channel, "optin",
+        f"{user.mention} has opted into the QuestBot system!\nYou can now earn XP, complete quests, and appear on the leaderboard.",
+        f"{user.mention} has opted into the QuestBot system!")
+
 @bot.event
 async def on_reaction_add(reaction, user):
     """Handle quest completion reactions and opt-in reactions"""
@@ -609,8 +1135,12 @@ async def on_reaction_add(reaction, user):
     
     # Check if it's a quest completion (✅ emoji)
     if str(reaction.emoji) == '✅':
+        # With the participants-only member cache, anyone reacting becomes a participant
+        if MEMBER_CACHE_MODE == "participants" and reaction.message.guild and reaction.message.guild.get_member(user.id) is None:
+            await cache_members(reaction.message.guild, [user.id])
         # First check if this is an opt-in message (by message ID)
-        if quest_bot.optin_message_id and reaction.message.id == quest_bot.optin_message_id:
+        optin_message_id = quest_bot.get_guild_settings(reaction.message.guild.id)["optin_message_id"] if reaction.message.guild else None
+        if optin_message_id and reaction.message.id == optin_message_id:
             try:
                 # This is an opt-in reaction
                 guild = reaction.message.guild
@@ -634,26 +1164,13 @@ async def on_reaction_add(reaction, user):
                             print(f"Successfully assigned Level 1 role to {user.name}")
                             
                             # Initialize user in database
-                            if quest_bot.db_connection:
-                                db_cursor = quest_bot.db_connection.cursor()
-                                db_cursor.execute('INSERT OR IGNORE INTO users (user_id, guild_id, xp, level) VALUES (?, ?, 0, 1)', 
-                                             (user.id, guild.id))
-                                quest_bot.db_connection.commit()
-                                # Check if insert actually happened
-                                if db_cursor.rowcount > 0:
-                                    print(f"Successfully initialized {user.name} in database")
-                                else:
-                                    print(f"User {user.name} already exists in database")
+                            if quest_bot.storage.ensure_user(user.id, guild.id):
+                                print(f"Successfully initialized {user.name} in database")
                             else:
-                                print("Warning: Database connection is None - user not initialized in database")
+                                print(f"User {user.name} already exists in database")
                             
-                            # Send confirmation message
-                            confirmation_embed = discord.Embed(
-                                title="✅ Welcome to QuestBot!",
-                                description=f"{user.mention} has opted into the QuestBot system!\nYou can now earn XP, complete quests, and appear on the leaderboard.",
-                                color=0x00ff00
-                            )
-                            await send_whitelisted_message(reaction.message.channel, embed=confirmation_embed, delete_after=10)
+                            # Queue confirmation message
+                            queue_optin_notice(reaction.message.channel, user)
                             print(f"User {user.name} successfully opted into QuestBot system")
                         except discord.Forbidden:
                             print(f"Failed to assign Level 1 role to {user.name} - insufficient permissions")
@@ -668,26 +1185,13 @@ async def on_reaction_add(reaction, user):
                                 await member.add_roles(level_1_role, reason="Opted into QuestBot system")
                                 print(f"Successfully assigned newly created Level 1 role to {user.name}")
                                 
-                                if quest_bot.db_connection:
-                                    db_cursor = quest_bot.db_connection.cursor()
-                                    db_cursor.execute('INSERT OR IGNORE INTO users (user_id, guild_id, xp, level) VALUES (?, ?, 0, 1)', 
-                                                 (user.id, guild.id))
-                                    quest_bot.db_connection.commit()
-                                    # Check if insert actually happened
-                                    if db_cursor.rowcount > 0:
-                                        print(f"Successfully initialized {user.name} in database after role creation")
-                                    else:
-                                        print(f"User {user.name} already exists in database")
+                                if quest_bot.storage.ensure_user(user.id, guild.id):
+                                    print(f"Successfully initialized {user.name} in database after role creation")
                                 else:
-                                    print("Warning: Database connection is None - user not initialized in database")
+                                    print(f"User {user.name} already exists in database")
                                 
-                                # Send confirmation message
-                                confirmation_embed = discord.Embed(
-                                    title="✅ Welcome to QuestBot!",
-                                    description=f"{user.mention} has opted into the QuestBot system!\nYou can now earn XP, complete quests, and appear on the leaderboard.",
-                                    color=0x00ff00
-                                )
-                                await send_whitelisted_message(reaction.message.channel, embed=confirmation_embed, delete_after=10)
+                                # Queue confirmation message
+                                queue_optin_notice(reaction.message.channel, user)
                                 print(f"User {user.name} successfully opted into QuestBot system with new roles")
                             else:
                                 print(f"Failed to create Level 1 role for {user.name}")
@@ -702,42 +1206,39 @@ async def on_reaction_add(reaction, user):
             return
         
         # Check if it's a quest completion
-        if not quest_bot.db_connection:
-            return
-        cursor = quest_bot.db_connection.cursor()
-        cursor.execute('SELECT title, completed_users, xp_reward FROM quests WHERE message_id = ?', (reaction.message.id,))
-        quest_data = cursor.fetchone()
+        quest = quest_bot.storage.get_quest(reaction.message.id)
         
-        if quest_data:
+        if quest:
+            # Ended quests stop counting even before the scheduler gets round to closing them
+            if quest['expires_at'] is not None and quest['expires_at'] <= time.time():
+                return
             # Only allow opted-in users to complete quests
             if not quest_bot.is_user_opted_in(user.id, reaction.message.guild.id):
                 return
             
-            title, completed_users_json, xp_reward = quest_data
-            # Handle cases where xp_reward might be None for old quests
-            if xp_reward is None:
-                xp_reward = 50
-                
-            completed_users = json.loads(completed_users_json)
-            
-            if user.id not in completed_users:
-                # Award XP based on quest's stored reward amount
-                new_xp, new_level = quest_bot.update_user_xp(user.id, reaction.message.guild.id, xp_reward)
-                completed_users.append(user.id)
-                
-                # Update quest completion list
-                cursor.execute('UPDATE quests SET completed_users = ? WHERE message_id = ?', 
-                              (json.dumps(completed_users), reaction.message.id))
-                if quest_bot.db_connection:
-                    quest_bot.db_connection.commit()
-                
-                # Send confirmation message
-                embed = discord.Embed(
-                    title="Quest Completed!",
-                    description=f"{user.mention} completed: **{title}**\n+{xp_reward} XP (Total: {new_xp} XP, Level {new_level})",
-                    color=0x00ff00
-                )
-                await send_whitelisted_message(reaction.message.channel, embed=embed, delete_after=10)
+            # Cheap early exit for repeat reactions; the batch re-checks inside its transaction
+            if user.id not in quest['completed_users']:
+                quest_bot.completions.submit(reaction.message.id, user.id, (user, reaction.message.channel))
+
+async def process_completion_batch(message_id: int, batch):
+    """Award one micro-batch of completions for a quest; batch maps user_id -> (user, channel)"""
+    quest = quest_bot.storage.get_quest(message_id)
+    if not quest:
+        # Removed or ended while the reactions were queued
+        return
+    title = quest['title']
+    # Handle cases where xp_reward might be None for old quests
+    xp_reward = quest['xp_reward'] if quest['xp_reward'] is not None else 50
+    
+    # Users who already completed the quest are skipped in storage, so XP can't be awarded twice
+    results = quest_bot.award_quest_completions(message_id, quest['guild_id'], list(batch), xp_reward)
+    for user_id, (new_xp, new_level) in results.items():
+        user, channel = batch[user_id]
+        # Queue confirmation message - completions in the same channel go out together
+        quest_bot.notices.add(
+            channel, "quest",
+            f"{user.mention} completed: **{title}**\n+{xp_reward} XP (Total: {new_xp} XP, Level {new_level})",
+            f"{user.mention} completed **{title}** • +{xp_reward} XP (Total: {new_xp} XP, Level {new_level})")
 
 async def check_and_update_level_roles(user_id: int, guild_id: int, reason: str = "XP change"):
     """Comprehensive level role check and update function"""
@@ -749,15 +1250,12 @@ async def check_and_update_level_roles(user_id: int, guild_id: int, reason: str
         # Calculate actual total XP and new level
         current_total_xp = quest_bot.calculate_total_user_xp(user_id, guild_id)
         new_level = quest_bot.calculate_level(current_total_xp)
+        quest_bot.note_xp_change(guild_id, user_id, current_total_xp)
         
         # Update level in database if changed and trigger level role assignment
         if old_level != new_level:
-            if quest_bot.db_connection:
-                cursor = quest_bot.db_connection.cursor()
-                cursor.execute('UPDATE users SET level = ? WHERE user_id = ? AND guild_id = ?', 
-                              (new_level, user_id, guild_id))
-                quest_bot.db_connection.commit()
-                asyncio.create_task(quest_bot.update_user_level_role(user_id, guild_id, old_level, new_level))
+            quest_bot.storage.set_user_level(user_id, guild_id, new_level)
+            quest_bot.schedule_role_sync(user_id, guild_id, old_level, new_level)
             return old_level, new_level, current_total_xp
         
         return old_level, old_level, current_total_xp
@@ -774,6 +1272,10 @@ async def on_member_update(before, after):
     added_roles = set(after.roles) - set(before.roles)
     removed_roles = set(before.roles) - set(after.roles)
     
+    # Badge roles and Level roles (opt-in status) both feed into the leaderboard
+    if added_roles or removed_roles:
+        quest_bot.note_xp_change(guild_id, after.id)
+    
     # Handle specific role additions (only for opted-in users)
     for role in added_roles:
         # Skip XP assignment for users who haven't opted in
@@ -799,6 +1301,7 @@ async def on_member_update(before, after):
                     color=0xff6600
                 )
             else:
+                quest_bot.ledger.append(guild_id, after.id, xp_reward, "badge", role.id)
                 # Check for level changes after badge role gain
                 old_level, new_level, total_xp = await check_and_update_level_roles(after.id, guild_id, "badge role gain")
                 level_text = f" → Level {new_level}!" if old_level != new_level else ""
@@ -817,6 +1320,7 @@ async def on_member_update(before, after):
                     break
         elif "badge" in role.name.lower():
             # Handle unassigned badge roles (fallback +5 XP) - only for opted-in users
+            quest_bot.ledger.append(guild_id, after.id, xp_totals.AUTO_BADGE_XP, "badge", role.id)
             old_level, new_level, total_xp = await check_and_update_level_roles(after.id, guild_id, "badge role gain")
             level_text = f" → Level {new_level}!" if old_level != new_level else ""
             
@@ -832,6 +1336,11 @@ async def on_member_update(before, after):
                     await channel.send(embed=embed, delete_after=15)
                     break
 
+@bot.event
+async def on_member_remove(member):
+    """Drop members who leave the server from the leaderboard"""
+    quest_bot.remove_from_ranking(member.guild.id, member.id)
+
 @bot.command(name='questbotoptin')
 @commands.has_permissions(manage_roles=True)
 async def questbot_optin(ctx, channel: Optional[discord.TextChannel] = None):
@@ -860,8 +1369,9 @@ async def questbot_optin(ctx, channel: Optional[discord.TextChannel] = None):
         await optin_message.add_reaction('✅')
         
         # Store the opt-in message details
-        quest_bot.optin_message_id = optin_message.id
-        quest_bot.optin_channel_id = target_channel.id
+        settings = quest_bot.get_guild_settings(ctx.guild.id)
+        settings["optin_message_id"] = optin_message.id
+        settings["optin_channel_id"] = target_channel.id
         quest_bot.save_settings(ctx.guild.id)
         
         # Confirm to admin
@@ -1018,87 +1528,172 @@ async def whitelist_channels(ctx, action: str = None, *channels):
         await ctx.send("❌ Invalid action! Use: `add`, `remove`, `clear`, or `list`\n**Usage:** `-whitelist <action> [channels...]`", delete_after=10)
 
 
+def build_leaderboard_embed(guild, leaderboard_data, page: int = 1, total_pages: int = 1):
+    """Render one leaderboard page from precomputed (user_id, total_xp, level) rows"""
+    if not leaderboard_data and page == 1:
+        embed = discord.Embed(
+            title="📊 XP Leaderboard",
+            description="No opted-in users found yet!\nUse `-questbotoptin` to create an opt-in message, or complete some quests to get on the leaderboard!",
+            color=0xffd700
+        )
+        # Still show level requirements
+        embed.add_field(name="Level System", value=LEVEL_REQUIREMENTS_TEXT, inline=False)
+        return embed
+    
+    offset = (page - 1) * LEADERBOARD_SIZE
+    embed = discord.Embed(
+        title="🏆 XP Leaderboard",
+        description="Top 10 Opted-In Quest Completers" if page == 1 else f"Ranks {offset + 1}-{offset + LEADERBOARD_SIZE}",
+        color=0xffd700
+    )
+    
+    medals = ["🥇", "🥈", "🥉"]
+    users_added = 0
+    
+    for i, (user_id, total_xp, level) in enumerate(leaderboard_data, start=offset):
+        medal = medals[i] if i < 3 else f"#{i+1}"
+        
+        # Try multiple methods to get user info
+        user = guild.get_member(user_id)
+        if not user:
+            user = bot.get_user(user_id)
+        
+        if user:
+            # Format username without pinging - use @ but escape it
+            username = f"@{user.name}"
+            display_name = getattr(user, 'display_name', user.name)
+            if display_name != user.name:
+                username = f"@{user.name} ({display_name})"
+            
+            embed.add_field(
+                name=f"{medal} Level {level}",
+                value=f"{username}\n{total_xp:,} XP",
+                inline=True
+            )
+            users_added += 1
+        else:
+            # Last resort - show user ID
+            embed.add_field(
+                name=f"{medal} Level {level}",
+                value=f"@User{str(user_id)[-4:]}\n{total_xp:,} XP",
+                inline=True
+            )
+            users_added += 1
+    
+    if users_added == 0:
+        embed.add_field(
+            name="No Active Users", 
+            value="Opted-in users with XP may have left the server" if page == 1 else "This page is empty",
+            inline=False
+        )
+    
+    # Add level requirements info
+    embed.add_field(name="Level System", value=LEVEL_REQUIREMENTS_TEXT, inline=False)
+    embed.set_footer(text=f"Page {page}/{total_pages} • Only opted-in users appear on this leaderboard • Use -rank to find your position")
+    return embed
+
+def get_leaderboard_page(guild, page: int):
+    """Build the embed for one leaderboard page, using the cache for page 1"""
+    total_pages = max(1, -(-len(quest_bot.get_ranking(guild.id)) // LEADERBOARD_SIZE))
+    page = max(1, min(page, total_pages))
+    if page == 1:
+        # Most calls on busy servers hit an unchanged first page
+        embed = quest_bot.get_cached_leaderboard(guild.id)
+        if embed is not None:
+            return embed, page, total_pages
+    leaderboard_data = quest_bot.get_leaderboard(guild.id, LEADERBOARD_SIZE, (page - 1) * LEADERBOARD_SIZE)
+    embed = build_leaderboard_embed(guild, leaderboard_data, page, total_pages)
+    if page == 1:
+        quest_bot.cache_leaderboard(guild.id, embed, leaderboard_data)
+    return embed, page, total_pages
+
+class LeaderboardView(discord.ui.View):
+    """Previous/Next buttons for paging through the leaderboard"""
+    
+    def __init__(self, guild, page: int, total_pages: int):
+        super().__init__(timeout=120)
+        self.guild = guild
+        self.page = page
+        self.total_pages = total_pages
+        self.update_buttons()
+    
+    def update_buttons(self):
+        self.previous_page.disabled = self.page <= 1
+        self.next_page.disabled = self.page >= self.total_pages
+    
+    async def show_page(self, interaction: discord.Interaction, page: int):
+        embed, self.page, self.total_pages = get_leaderboard_page(self.guild, page)
+        self.update_buttons()
+        await interaction.response.edit_message(embed=embed, view=self)
+    
+    @discord.ui.button(label="◀ Previous", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.show_page(interaction, self.page - 1)
+    
+    @discord.ui.button(label="Next ▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.show_page(interaction, self.page + 1)
+
 @bot.command(name='leaderboard')
-async def leaderboard(ctx):
-    """Display the XP leaderboard (opted-in users only)"""
+async def leaderboard(ctx, page: int = 1):
+    """Display the XP leaderboard, one page at a time (opted-in users only)"""
+    try:
+        embed, page, total_pages = get_leaderboard_page(ctx.guild, page)
+        if total_pages > 1:
+            await ctx.send(embed=embed, view=LeaderboardView(ctx.guild, page, total_pages))
+        else:
+            await ctx.send(embed=embed)
+        
+    except Exception as e:
+        print(f"Error in leaderboard command: {e}")
+        await ctx.send("❌ Could not retrieve leaderboard data. Please try again later.", delete_after=5)
+
+@bot.command(name='rank')
+async def rank(ctx, member: Optional[discord.Member] = None):
+    """Show a member's leaderboard position and the scores around them"""
     try:
-        leaderboard_data = quest_bot.get_leaderboard(ctx.guild.id, 10)
+        target_member = member if member is not None else ctx.author
+        rank_data = quest_bot.get_user_rank(ctx.guild.id, target_member.id)
         
-        if not leaderboard_data:
+        if not rank_data:
             embed = discord.Embed(
-                title="📊 XP Leaderboard",
-                description="No opted-in users found yet!\nUse `-questbotoptin` to create an opt-in message, or complete some quests to get on the leaderboard!",
-                color=0xffd700
+                title="❌ Not Ranked",
+                description=f"{target_member.mention} isn't on the leaderboard yet.\n\n"
+                           "Only opted-in users are ranked. React with ✅ on the opt-in message to join!",
+                color=0xff0000
             )
-            # Still show level requirements
-            level_info = "**Level Requirements:**\n"
-            for level, xp in LEVEL_THRESHOLDS.items():
-                level_info += f"Level {level}: {xp:,} XP\n"
-            embed.add_field(name="Level System", value=level_info, inline=False)
-            await ctx.send(embed=embed)
+            await ctx.send(embed=embed, delete_after=15)
             return
         
+        def describe(entry, position):
+            user_id, total_xp = entry
+            user = ctx.guild.get_member(user_id) or bot.get_user(user_id)
+            name = f"@{user.name}" if user else f"@User{str(user_id)[-4:]}"
+            return f"#{position} {name} - {total_xp:,} XP"
+        
+        position = rank_data['position']
+        total_xp = rank_data['total_xp']
         embed = discord.Embed(
-            title="🏆 XP Leaderboard",
-            description="Top 10 Opted-In Quest Completers",
+            title=f"📍 {target_member.display_name}'s Rank",
+            description=f"**#{position:,}** of {rank_data['total_ranked']:,} ranked members\n"
+                       f"**Total XP:** {total_xp:,} XP (Level {quest_bot.calculate_level(total_xp)})",
             color=0xffd700
         )
+        if rank_data['above']:
+            gap = rank_data['above'][1] - total_xp
+            embed.add_field(name="⬆️ Next Up", value=f"{describe(rank_data['above'], position - 1)}\n{gap:,} XP ahead", inline=False)
+        else:
+            embed.add_field(name="👑 Top Spot", value="Nobody is ahead - you're #1!", inline=False)
+        if rank_data['below']:
+            gap = total_xp - rank_data['below'][1]
+            embed.add_field(name="⬇️ Right Behind", value=f"{describe(rank_data['below'], position + 1)}\n{gap:,} XP behind", inline=False)
         
-        medals = ["🥇", "🥈", "🥉"]
-        users_added = 0
-        
-        for i, (user_id, xp, level) in enumerate(leaderboard_data):
-            medal = medals[i] if i < 3 else f"#{i+1}"
-            
-            # Try multiple methods to get user info
-            user = ctx.guild.get_member(user_id)
-            if not user:
-                user = bot.get_user(user_id)
-            
-            # Calculate total XP including role-based XP
-            total_xp = quest_bot.calculate_total_user_xp(user_id, ctx.guild.id)
-            
-            if user:
-                # Format username without pinging - use @ but escape it
-                username = f"@{user.name}"
-                display_name = getattr(user, 'display_name', user.name)
-                if display_name != user.name:
-                    username = f"@{user.name} ({display_name})"
-                
-                embed.add_field(
-                    name=f"{medal} Level {level}",
-                    value=f"{username}\n{total_xp:,} XP",
-                    inline=True
-                )
-                users_added += 1
-            else:
-                # Last resort - show user ID
-                embed.add_field(
-                    name=f"{medal} Level {level}",
-                    value=f"@User{str(user_id)[-4:]}\n{total_xp:,} XP",
-                    inline=True
-                )
-                users_added += 1
-        
-        if users_added == 0:
-            embed.add_field(
-                name="No Active Users", 
-                value="Opted-in users with XP may have left the server", 
-                inline=False
-            )
-        
-        # Add level requirements info
-        level_info = "**Level Requirements:**\n"
-        for level, xp_req in LEVEL_THRESHOLDS.items():
-            level_info += f"Level {level}: {xp_req:,} XP\n"
-        
-        embed.add_field(name="Level System", value=level_info, inline=False)
-        embed.set_footer(text="Only opted-in users appear on this leaderboard")
+        embed.set_footer(text=f"Leaderboard page {(position - 1) // LEADERBOARD_SIZE + 1} • Use -leaderboard <page> to browse")
         await ctx.send(embed=embed)
         
     except Exception as e:
-        print(f"Error in leaderboard command: {e}")
-        await ctx.send("❌ Could not retrieve leaderboard data. Please try again later.", delete_after=5)
+        print(f"Error in rank command: {e}")
+        await ctx.send("❌ Could not retrieve rank data. Please try again later.", delete_after=5)
 
 @bot.command(name='checkXP')
 async def check_xp(ctx):
@@ -1128,56 +1723,17 @@ async def check_xp(ctx):
             return
         
         # Get XP breakdown for detailed display
-        guild = ctx.guild
-        guild_id = guild.id
-        
-        # Calculate total XP and individual components
-        current_xp = quest_bot.calculate_total_user_xp(target_member.id, guild_id)
-        current_level = quest_bot.calculate_level(current_xp)
-        
-        # Get Quest XP (base XP from database - from completing quests)
-        user_data = quest_bot.get_user_data(target_member.id, guild_id)
-        quest_xp = user_data.get('xp', 0)
-        
-        # Get Streak XP (accumulated from streak roles)
-        streak_xp = quest_bot.get_accumulated_streak_xp(target_member.id, guild_id)
-        
-        # Calculate Badge XP (from current badge roles)
-        badge_xp = 0
-        auto_badge_xp = 0
-        
-        for role in target_member.roles:
-            if role.name.startswith("Level "):
-                continue
-                
-            role_xp_data = quest_bot.get_role_xp_and_type(guild_id, str(role.id))
-            if role_xp_data:
-                xp_amount, role_type = role_xp_data
-                if role_type == "badge":
-                    badge_xp += xp_amount
-            else:
-                # Auto-detection fallback for unassigned badge roles
-                if "badge" in role.name.lower():
-                    auto_badge_xp += 5
-        
-        # Total badge XP includes both assigned and auto-detected
-        total_badge_xp = badge_xp + auto_badge_xp
-        
-        # Calculate XP needed for next level
-        next_level = min(current_level + 1, 10)  # Cap at level 10
-        next_level_xp = LEVEL_THRESHOLDS.get(next_level, LEVEL_THRESHOLDS[10])
-        xp_needed = max(0, next_level_xp - current_xp)
-        
-        # Calculate progress percentage safely
-        if current_level < 10:
-            current_level_xp = LEVEL_THRESHOLDS.get(current_level, 0)
-            xp_range = next_level_xp - current_level_xp
-            if xp_range > 0:
-                progress_percentage = min(100, max(0, ((current_xp - current_level_xp) / xp_range) * 100))
-            else:
-                progress_percentage = 100
-        else:
-            progress_percentage = 100
+        guild_id = ctx.guild.id
+        
+        # Total XP, its components, level and progress in one pass
+        breakdown = quest_bot.get_xp_breakdown(target_member.id, guild_id, target_member)
+        current_xp = breakdown.total
+        current_level = breakdown.level
+        quest_xp = breakdown.quest_xp
+        streak_xp = breakdown.streak_xp
+        total_badge_xp = breakdown.total_badge_xp
+        xp_needed = breakdown.xp_to_next
+        progress_percentage = breakdown.progress
         
         embed = discord.Embed(
             title=f"📊 {target_member.display_name}'s XP Stats",
@@ -1237,68 +1793,31 @@ async def check_member_xp(ctx, member: discord.Member):
     try:
         target_member = member
         
-        # Check if target user is opted in
-        if not quest_bot.is_user_opted_in(target_member.id, ctx.guild.id):
-            embed = discord.Embed(
-                title="❌ User Not Opted In",
-                description=f"{target_member.mention} hasn't opted into the QuestBot system yet.\n\n"
-                           "Only users who have opted in can have their XP checked.",
-                color=0xff0000
-            )
-            await ctx.send(embed=embed, delete_after=15)
-            return
-
-        # Get XP breakdown for detailed display
-        guild = ctx.guild
-        guild_id = guild.id
-        
-        # Calculate total XP and individual components
-        current_xp = quest_bot.calculate_total_user_xp(target_member.id, guild_id)
-        current_level = quest_bot.calculate_level(current_xp)
-        
-        # Get Quest XP (base XP from database - from completing quests)
-        user_data = quest_bot.get_user_data(target_member.id, guild_id)
-        quest_xp = user_data.get('xp', 0)
-        
-        # Get Streak XP (accumulated from streak roles)
-        streak_xp = quest_bot.get_accumulated_streak_xp(target_member.id, guild_id)
-        
-        # Calculate Badge XP (from current badge roles)
-        badge_xp = 0
-        auto_badge_xp = 0
-        
-        for role in target_member.roles:
-            if role.name.startswith("Level "):
-                continue
-                
-            role_xp_data = quest_bot.get_role_xp_and_type(guild_id, str(role.id))
-            if role_xp_data:
-                xp_amount, role_type = role_xp_data
-                if role_type == "badge":
-                    badge_xp += xp_amount
-            else:
-                # Auto-detection fallback for unassigned badge roles
-                if "badge" in role.name.lower():
-                    auto_badge_xp += 5
-        
-        # Total badge XP includes both assigned and auto-detected
-        total_badge_xp = badge_xp + auto_badge_xp
-        
-        # Calculate XP needed for next level
-        next_level = min(current_level + 1, 10)  # Cap at level 10
-        next_level_xp = LEVEL_THRESHOLDS.get(next_level, LEVEL_THRESHOLDS[10])
-        xp_needed = max(0, next_level_xp - current_xp)
-        
-        # Calculate progress percentage safely
-        if current_level < 10:
-            current_level_xp = LEVEL_THRESHOLDS.get(current_level, 0)
-            xp_range = next_level_xp - current_level_xp
-            if xp_range > 0:
-                progress_percentage = min(100, max(0, ((current_xp - current_level_xp) / xp_range) * 100))
-            else:
-                progress_percentage = 100
-        else:
-            progress_percentage = 100
+        # Check if target user is opted in
+        if not quest_bot.is_user_opted_in(target_member.id, ctx.guild.id):
+            embed = discord.Embed(
+                title="❌ User Not Opted In",
+                description=f"{target_member.mention} hasn't opted into the QuestBot system yet.\n\n"
+                           "Only users who have opted in can have their XP checked.",
+                color=0xff0000
+            )
+            await ctx.send(embed=embed, delete_after=15)
+            return
+
+        # Get XP breakdown for detailed display
+        guild_id = ctx.guild.id
+        
+        # Total XP, its components, level and progress in one pass
+        breakdown = quest_bot.get_xp_breakdown(target_member.id, guild_id, target_member)
+        current_xp = breakdown.total
+        current_level = breakdown.level
+        quest_xp = breakdown.quest_xp
+        streak_xp = breakdown.streak_xp
+        badge_xp = breakdown.badge_xp
+        auto_badge_xp = breakdown.auto_badge_xp
+        total_badge_xp = breakdown.total_badge_xp
+        xp_needed = breakdown.xp_to_next
+        progress_percentage = breakdown.progress
         
         embed = discord.Embed(
             title=f"📊 {target_member.display_name}'s XP Stats",
@@ -1373,7 +1892,7 @@ async def add_xp_command(ctx, amount: int, member: discord.Member):
     
     try:
         # Update user XP
-        new_total_xp, new_level = quest_bot.update_user_xp(member.id, ctx.guild.id, amount)
+        new_total_xp, new_level = quest_bot.update_user_xp(member.id, ctx.guild.id, amount, "admin_add", ctx.author.id)
         
         # Send confirmation
         embed = discord.Embed(
@@ -1404,7 +1923,7 @@ async def remove_xp_command(ctx, amount: int, member: discord.Member):
     
     try:
         # Remove user XP (negative amount)
-        new_total_xp, new_level = quest_bot.update_user_xp(member.id, ctx.guild.id, -amount)
+        new_total_xp, new_level = quest_bot.update_user_xp(member.id, ctx.guild.id, -amount, "admin_remove", ctx.author.id)
         
         # Send confirmation
         embed = discord.Embed(
@@ -1440,7 +1959,7 @@ async def set_xp_command(ctx, amount: int, member: discord.Member):
         xp_change = amount - current_base_xp
         
         # Update user XP to the target amount
-        new_total_xp, new_level = quest_bot.update_user_xp(member.id, ctx.guild.id, xp_change)
+        new_total_xp, new_level = quest_bot.update_user_xp(member.id, ctx.guild.id, xp_change, "admin_set", ctx.author.id)
         
         # Send confirmation
         embed = discord.Embed(
@@ -1454,6 +1973,348 @@ async def set_xp_command(ctx, amount: int, member: discord.Member):
     except Exception as e:
         await ctx.send(f"❌ Error setting XP: {str(e)[:100]}", delete_after=10)
 
+async def collect_bulk_xp_targets(ctx, amount: Optional[int], targets):
+    """Resolve roles, members and an optional CSV attachment into {user_id: amount}"""
+    changes = {}
+    errors = []
+    
+    if MEMBER_CACHE_MODE == "participants" and any(isinstance(target, discord.Role) for target in targets):
+        # role.members only lists cached members. Only participants can be given XP, so fetching the ones
+        # missing from the cache (e.g. after a timed-out startup fetch) resolves every member that counts
+        await cache_members(ctx.guild, quest_bot.storage.list_user_ids(ctx.guild.id))
+    
+    for target in targets:
+        if isinstance(target, discord.Role):
+            for member in target.members:
+                if not member.bot and amount is not None:
+                    changes[member.id] = amount
+        elif amount is not None:
+            changes[target.id] = amount
+    
+    # CSV rows: user_id_or_mention[,amount] - a per-row amount overrides the command amount
+    for attachment in ctx.message.attachments:
+        if not attachment.filename.lower().endswith('.csv'):
+            continue
+        text = (await attachment.read()).decode('utf-8-sig')
+        for line_number, row in enumerate(csv.reader(io.StringIO(text)), start=1):
+            if not row or not row[0].strip():
+                continue
+            raw_id = row[0].strip().strip('<@!>')
+            if not raw_id.isdigit():
+                if line_number > 1:
+                    errors.append(f"line {line_number}: invalid user `{row[0][:30]}`")
+                continue  # Header row
+            try:
+                row_amount = int(row[1]) if len(row) > 1 and row[1].strip() else amount
+            except ValueError:
+                errors.append(f"line {line_number}: invalid amount `{row[1][:20]}`")
+                continue
+            if row_amount is None:
+                errors.append(f"line {line_number}: no amount given")
+                continue
+            if row_amount < 0:
+                # The command picks the direction; a negative row would flip it
+                errors.append(f"line {line_number}: negative amount `{row_amount}`")
+                continue
+            changes[int(raw_id)] = row_amount
+    
+    return changes, errors
+
+async def run_bulk_xp_command(ctx, mode: str, amount: Optional[int], targets):
+    """Shared implementation for the bulk XP commands"""
+    if amount is not None and amount < 0:
+        await ctx.send("❌ XP amount cannot be negative!", delete_after=10)
+        return
+    
+    changes, errors = await collect_bulk_xp_targets(ctx, amount, targets)
+    if mode == "remove":
+        changes = {user_id: -value for user_id, value in changes.items()}
+    
+    # Only opted-in users can have XP modified, same as the single-member commands
+    opted_in = {user_id: value for user_id, value in changes.items()
+                if quest_bot.is_user_opted_in(user_id, ctx.guild.id)}
+    skipped = len(changes) - len(opted_in)
+    
+    if not opted_in:
+        embed = discord.Embed(
+            title="❌ No Members Updated",
+            description="No opted-in members matched.\n\n"
+                       "**Usage:** `-bulkaddXP <amount> <@role|@member>...` or attach a CSV of `user_id,amount` rows",
+            color=0xff0000
+        )
+        if errors:
+            embed.add_field(name="CSV Problems", value="\n".join(errors[:10]), inline=False)
+        await ctx.send(embed=embed, delete_after=15)
+        return
+    
+    results = quest_bot.bulk_update_user_xp(ctx.guild.id, opted_in, mode="set" if mode == "set" else "add",
+                                            source=f"bulk_{mode}", ref=ctx.author.id)
+    
+    titles = {"add": "✅ Bulk XP Added", "remove": "✅ Bulk XP Removed", "set": "✅ Bulk XP Set"}
+    description = f"**Members updated:** {len(results):,}\n"
+    if skipped:
+        description += f"**Skipped (not opted in):** {skipped:,}\n"
+    embed = discord.Embed(title=titles[mode], description=description, color=0x00ff00 if not errors else 0xffaa00)
+    if errors:
+        embed.add_field(name="CSV Problems", value="\n".join(errors[:10]) + (f"\n…and {len(errors) - 10} more" if len(errors) > 10 else ""), inline=False)
+    await ctx.send(embed=embed, delete_after=30)
+
+@bot.command(name='bulkaddXP')
+@commands.has_permissions(manage_roles=True)
+async def bulk_add_xp_command(ctx, amount: Optional[int] = None, *targets: Union[discord.Member, discord.Role]):
+    """Add XP to every opted-in member of roles/member lists/a CSV in one transaction (admin only)"""
+    try:
+        await run_bulk_xp_command(ctx, "add", amount, targets)
+    except Exception as e:
+        await ctx.send(f"❌ Error adding bulk XP: {str(e)[:100]}", delete_after=10)
+
+@bot.command(name='bulkremoveXP')
+@commands.has_permissions(manage_roles=True)
+async def bulk_remove_xp_command(ctx, amount: Optional[int] = None, *targets: Union[discord.Member, discord.Role]):
+    """Remove XP from many opted-in members in one transaction (admin only)"""
+    try:
+        await run_bulk_xp_command(ctx, "remove", amount, targets)
+    except Exception as e:
+        await ctx.send(f"❌ Error removing bulk XP: {str(e)[:100]}", delete_after=10)
+
+@bot.command(name='bulksetXP')
+@commands.has_permissions(manage_roles=True)
+async def bulk_set_xp_command(ctx, amount: Optional[int] = None, *targets: Union[discord.Member, discord.Role]):
+    """Set base XP for many opted-in members in one transaction (admin only)"""
+    try:
+        await run_bulk_xp_command(ctx, "set", amount, targets)
+    except Exception as e:
+        await ctx.send(f"❌ Error setting bulk XP: {str(e)[:100]}", delete_after=10)
+
+@bot.command(name='exportxp')
+@commands.has_permissions(manage_roles=True)
+async def export_xp_command(ctx, file_format: str = "ndjson"):
+    """Export this server's XP data as gzipped NDJSON or a CSV zip (staff only)"""
+    try:
+        file_format = file_format.lower()
+        if file_format not in ("ndjson", "csv"):
+            await ctx.send("❌ Format must be `ndjson` or `csv`", delete_after=10)
+            return
+        if not quest_bot.storage.db_path:
+            await ctx.send("❌ Export needs the SQLite storage backend", delete_after=10)
+            return
+
+        suffix = ".zip" if file_format == "csv" else ".ndjson.gz"
+        filename = f"questbot-{ctx.guild.id}-{time.strftime('%Y%m%d-%H%M%S')}{suffix}"
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, filename)
+            # Streams rows straight to disk on a worker thread so the event loop keeps running
+            counts = await asyncio.to_thread(xp_transfer.export_guild, quest_bot.storage.db_path, ctx.guild.id, path)
+
+            embed = discord.Embed(
+                title="📦 XP Data Exported",
+                description="\n".join(f"**{table}:** {count:,} rows" for table, count in counts.items()),
+                color=0x00ff00
+            )
+            await ctx.send(embed=embed, file=discord.File(path, filename=filename))
+    except discord.HTTPException as e:
+        await ctx.send(f"❌ Could not upload export (file may be too large): {str(e)[:100]}", delete_after=10)
+    except Exception as e:
+        await ctx.send(f"❌ Error exporting XP data: {str(e)[:100]}", delete_after=10)
+
+@bot.command(name='importxp')
+@commands.has_permissions(manage_roles=True)
+async def import_xp_command(ctx):
+    """Replace this server's XP data with an attached export file (staff only)"""
+    try:
+        if not quest_bot.storage.db_path:
+            await ctx.send("❌ Import needs the SQLite storage backend", delete_after=10)
+            return
+        attachments = [a for a in ctx.message.attachments
+                       if a.filename.lower().endswith(('.ndjson', '.ndjson.gz', '.zip'))]
+        if not attachments:
+            embed = discord.Embed(
+                title="❌ No Export Attached",
+                description="Attach a file made by `-exportxp` (`.ndjson.gz` or `.zip`).",
+                color=0xff0000
+            )
+            await ctx.send(embed=embed, delete_after=15)
+            return
+        attachment = attachments[0]
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, os.path.basename(attachment.filename))
+            await attachment.save(path)
+            # The file's first record says which server it came from, and so what the import overwrites
+            tables = await asyncio.to_thread(xp_transfer.replaced_tables, path, ctx.guild.id)
+            table_list = "\n".join(f"• `{table}`" for table in tables)
+            if len(tables) < len(xp_transfer.EXPORT_TABLES):
+                table_list += ("\n\nThis is another server's export, so its quests, schedules, role XP, whitelist "
+                               "and settings don't come across - this server keeps its own.")
+
+            # Safety confirmation prompt
+            embed = discord.Embed(
+                title="⚠️ Import XP Data Confirmation",
+                description=f"**WARNING:** Importing `{attachment.filename}` will **replace** this server's "
+                           f"rows in these tables:\n{table_list}\n\n"
+                           f"React with ✅ to confirm or ❌ to cancel.",
+                color=0xff6600
+            )
+            confirmation_msg = await ctx.send(embed=embed)
+            await confirmation_msg.add_reaction('✅')
+            await confirmation_msg.add_reaction('❌')
+
+            def check(reaction, user):
+                return (user == ctx.author and
+                       str(reaction.emoji) in ['✅', '❌'] and
+                       reaction.message.id == confirmation_msg.id)
+
+            try:
+                reaction, user = await bot.wait_for('reaction_add', timeout=30.0, check=check)
+            except asyncio.TimeoutError:
+                embed = discord.Embed(
+                    title="⏰ Confirmation Timeout",
+                    description="Import cancelled due to no response within 30 seconds.",
+                    color=0xff0000
+                )
+                await confirmation_msg.edit(embed=embed)
+                await confirmation_msg.clear_reactions()
+                return
+
+            if str(reaction.emoji) == '❌':
+                embed = discord.Embed(
+                    title="❌ Operation Cancelled",
+                    description="XP import has been cancelled.",
+                    color=0xff0000
+                )
+                await confirmation_msg.edit(embed=embed)
+                await confirmation_msg.clear_reactions()
+                return
+
+            # Batched inserts commit one at a time on a worker thread
+            counts = await asyncio.to_thread(xp_transfer.import_guild, quest_bot.storage.db_path, path, ctx.guild.id,
+                                             ctx.author.id)
+
+        # Refresh everything cached from the replaced tables (other workers pick up the import's own notice)
+        quest_bot.apply_invalidation(ctx.guild.id, "guild")
+
+        embed = discord.Embed(
+            title="✅ XP Data Imported",
+            description="\n".join(f"**{table}:** {count:,} rows" for table, count in counts.items()) or "The file contained no rows.",
+            color=0x00ff00
+        )
+        await confirmation_msg.edit(embed=embed)
+        await confirmation_msg.clear_reactions()
+    except Exception as e:
+        await ctx.send(f"❌ Error importing XP data: {str(e)[:100]}", delete_after=10)
+
+@bot.command(name='compactstreaks')
+@commands.has_permissions(manage_roles=True)
+async def compact_streaks_command(ctx, mode: str = None):
+    """Roll old streak history into totals now; `full` also rebuilds the file (admin only)"""
+    try:
+        result = await asyncio.to_thread(quest_bot.compact_streak_history, STREAK_HISTORY_DAYS)
+        description = (f"**Rows compacted:** {result['compacted_rows']:,} (older than {result['cutoff']} UTC)\n"
+                       f"**Pages released:** {result['pages_released']:,}\n")
+        if mode and mode.lower() == "full":
+            # One-off: converts databases created before auto_vacuum was enabled
+            await asyncio.to_thread(quest_bot.vacuum_database)
+            description += "**Full VACUUM:** done\n"
+        elif result['free_pages']:
+            description += f"**Free pages left:** {result['free_pages']:,} (run `-compactstreaks full` to reclaim)\n"
+        embed = discord.Embed(title="🗜️ Streak History Compacted", description=description, color=0x00ff00)
+        await ctx.send(embed=embed, delete_after=30)
+    except Exception as e:
+        await ctx.send(f"❌ Error compacting streak history: {str(e)[:100]}", delete_after=10)
+
+@bot.command(name='reconcilelevels')
+@commands.has_permissions(manage_roles=True)
+async def reconcile_levels_command(ctx, mode: str = None):
+    """Recompute everyone's level and fix Level roles that drifted; `dry` only reports (admin only)"""
+    try:
+        dry_run = bool(mode) and mode.lower() in ("dry", "dryrun", "dry-run")
+        if reconcile_lock.locked():
+            await ctx.send("⏳ A reconciliation is already running, this one will start when it finishes.", delete_after=10)
+        status_msg = await ctx.send("🔄 Recomputing levels...")
+        
+        def describe(report):
+            verb = "Would fix" if report["dry_run"] else "Fixed"
+            roles_done = report["role_fixes"] if report["dry_run"] else report["roles_done"]
+            description = (f"**Members checked:** {report['members']:,}\n"
+                           f"**Not cached (skipped):** {report['skipped']:,}\n"
+                           f"**{verb} stored levels:** {report['level_updates']:,}\n"
+                           f"**{verb} Level roles:** {roles_done:,} of {report['role_fixes']:,}\n")
+            if report["dry_run"] and report["sample"]:
+                description += "\n**Examples:**\n" + "\n".join(
+                    f"<@{user_id}>: Level {old_level} → Level {new_level}" for user_id, old_level, new_level in report["sample"])
+            return description
+        
+        async def show_progress(report):
+            await status_msg.edit(content=None, embed=discord.Embed(
+                title="🔄 Reconciling Levels...", description=describe(report), color=0xffaa00))
+        
+        async with reconcile_lock:
+            report = await quest_bot.reconcile_levels(ctx.guild, dry_run=dry_run, progress=show_progress)
+        embed = discord.Embed(
+            title="🔍 Level Reconciliation (Dry Run)" if dry_run else "✅ Levels Reconciled",
+            description=describe(report),
+            color=0x0099ff if dry_run else 0x00ff00
+        )
+        await status_msg.edit(content=None, embed=embed)
+    except Exception as e:
+        await ctx.send(f"❌ Error reconciling levels: {str(e)[:100]}", delete_after=10)
+
+@bot.command(name='rebuildxp')
+@commands.has_permissions(manage_roles=True)
+async def rebuild_xp_command(ctx, *args: str):
+    """Replay the XP ledger into fresh base XP, leaving out the given ledger ids; `dry` only reports (admin only)"""
+    try:
+        dry_run = bool(args) and args[0].lower() in ("dry", "dryrun", "dry-run")
+        raw_ids = args[1:] if dry_run else args
+        if not all(raw_id.isdigit() for raw_id in raw_ids):
+            embed = discord.Embed(
+                title="❌ Invalid Ledger IDs",
+                description="**Usage:** `-rebuildxp [dry] [ledger ids...]`\n\n"
+                           "Ledger ids are listed by `-xphistory <member>`.",
+                color=0xff0000
+            )
+            await ctx.send(embed=embed, delete_after=15)
+            return
+        exclude_ids = sorted({int(raw_id) for raw_id in raw_ids})
+        report = await quest_bot.rebuild_xp(ctx.guild.id, exclude_ids, dry_run=dry_run)
+        
+        verb = "Would change" if dry_run else "Changed"
+        description = (f"**Replayed from snapshot at ledger row:** {report['snapshot']:,}\n"
+                       f"**Ledger rows left out:** {report['excluded']:,}\n"
+                       f"**Users rebuilt:** {report['users']:,}\n"
+                       f"**{verb} base XP:** {report['changed']:,}\n")
+        if report["sample"]:
+            description += "\n**Examples:**\n" + "\n".join(
+                f"<@{user_id}>: {old_xp:,} → {new_xp:,} XP" for user_id, old_xp, new_xp in report["sample"])
+        embed = discord.Embed(
+            title="🔍 XP Rebuild (Dry Run)" if dry_run else "✅ XP Rebuilt From Ledger",
+            description=description,
+            color=0x0099ff if dry_run else 0x00ff00
+        )
+        await ctx.send(embed=embed, delete_after=60)
+    except Exception as e:
+        await ctx.send(f"❌ Error rebuilding XP: {str(e)[:100]}", delete_after=10)
+
+@bot.command(name='backupdb')
+@commands.has_permissions(manage_roles=True)
+async def backup_db_command(ctx):
+    """Take a database snapshot now (admin only)"""
+    try:
+        if backup_lock.locked():
+            await ctx.send("⏳ A backup is already running, this one will start when it finishes.", delete_after=10)
+        result = await run_database_backup()
+        embed = discord.Embed(
+            title="💾 Database Backup Complete",
+            description=f"**File:** `{os.path.basename(result['path'])}`\n"
+                       f"**Size:** {result['size_bytes'] / 1024 / 1024:.1f} MB\n"
+                       f"**Time:** {result['seconds']}s\n"
+                       f"**Old snapshots pruned:** {result['pruned']} (keeping {BACKUP_KEEP})",
+            color=0x00ff00
+        )
+        await ctx.send(embed=embed, delete_after=30)
+    except Exception as e:
+        await ctx.send(f"❌ Error backing up database: {str(e)[:100]}", delete_after=10)
+
 @bot.command(name='questbot')
 async def questbot_ping(ctx):
     """Ping the bot to check if it's online"""
@@ -1471,7 +2332,8 @@ async def commands_list(ctx):
     # User Commands (Anyone can use)
     user_commands = [
         "`-allquests` - List all current quests by name",
-        "`-leaderboard` - Display XP rankings", 
+        "`-leaderboard [page]` - Display XP rankings",
+        "`-rank [member]` - Show your leaderboard position",
         "`-checkXP` - Check your XP and level progress",
         "`-questbot` - Ping bot to check if online",
         "`-commands` - Display this help message"
@@ -1519,6 +2381,9 @@ async def staff_commands_list(ctx):
         "`-addXP <amount> <member>` - Add XP to user",
         "`-removeXP <amount> <member>` - Remove XP from user",
         "`-setXP <amount> <member>` - Set user's XP to specific amount",
+        "`-bulkaddXP / -bulkremoveXP / -bulksetXP <amount> <@role|@member>...` - Bulk XP changes (or attach a `user_id,amount` CSV)",
+        "`-exportxp [ndjson|csv]` - Export this server's XP data as a file",
+        "`-importxp` - Replace this server's XP data from an attached export",
         "`-checkmemberXP <member>` - Check another member's XP and level progress",
         "`-addquest <title> <content> <amount>` - Create new quest embed (defaults to 50 XP)",
         "`-removequest <message_id>` - Delete quest by message ID",
@@ -1544,6 +2409,12 @@ async def staff_commands_list(ctx):
         "**Quest Management:**",
         "`-deleteallquests` - Delete all current quests",
         "",
+        "**Maintenance:**",
+        "`-backupdb` - Take a database snapshot now",
+        "`-compactstreaks [full]` - Roll old streak history into totals",
+        "`-reconcilelevels [dry]` - Recompute levels and fix drifted Level roles",
+        "`-rebuildxp [dry] [ledger ids...]` - Replay the XP ledger into fresh totals, leaving out the given rows",
+        "",
         "**Bot Configuration:**", 
         "`-questping <role_id_or_name>` - Set quest ping role",
         "`-questchannel <channel_id_or_name>` - Set quest channel",
@@ -1556,6 +2427,21 @@ async def staff_commands_list(ctx):
         inline=False
     )
     
+    # Quest scheduling and history (Staff permissions required)
+    scheduling_commands = [
+        "`-schedulequest <start> <duration> <repeat> <title> <content> [amount]` - Post a quest later, optionally ending and repeating",
+        "`-scheduledquests` - List scheduled quests",
+        "`-unschedulequest <id>` - Cancel a scheduled quest",
+        "`-questarchive [page]` - Ended and removed quests with completion counts",
+        "`-xphistory <member> [count]` - A member's latest XP changes from the ledger"
+    ]
+    
+    embed.add_field(
+        name="🗓️ Quest Scheduling & History (Staff)",
+        value="\n".join(scheduling_commands),
+        inline=False
+    )
+    
     embed.set_footer(text="💡 All staff commands require appropriate permissions to use.")
     
     await ctx.send(embed=embed)
@@ -1595,7 +2481,7 @@ async def quest_ping(ctx, *, role_input: str):
             return
         
         # Save the quest ping role
-        quest_bot.quest_ping_role_id = role.id
+        quest_bot.get_guild_settings(ctx.guild.id)["quest_ping_role_id"] = role.id
         quest_bot.save_settings(ctx.guild.id)
         
         # Send confirmation
@@ -1668,7 +2554,7 @@ async def quest_channel(ctx, *, channel_input: str):
             return
         
         # Save the quest channel
-        quest_bot.quest_channel_id = channel.id
+        quest_bot.get_guild_settings(ctx.guild.id)["quest_channel_id"] = channel.id
         quest_bot.save_settings(ctx.guild.id)
         
         # Send confirmation
@@ -1696,6 +2582,171 @@ async def quest_channel(ctx, *, channel_input: str):
     except Exception as e:
         await ctx.send(f"❌ Error setting quest channel: {str(e)[:100]}", delete_after=10)
 
+def get_quest_channel(guild, fallback):
+    """The configured quest channel, or fallback when none is set or it was deleted"""
+    settings = quest_bot.get_guild_settings(guild.id)
+    if settings["quest_channel_id"]:
+        quest_channel = guild.get_channel(settings["quest_channel_id"])
+        if quest_channel:
+            return quest_channel
+    return fallback
+
+async def post_quest(guild, channel, title: str, content: str, xp: int, expires_at: float = None):
+    """Send a quest embed with the ping role, add the ✅ reaction and store the quest"""
+    # Create quest embed
+    embed = discord.Embed(
+        title=f"🏆 {title}",
+        description=content,
+        color=0x0099ff
+    )
+    embed.add_field(name="💰 Reward", value=f"{xp} XP", inline=True)
+    embed.add_field(name="📝 How to Complete", value="React with ✅ below", inline=True)
+    if expires_at is not None:
+        embed.add_field(name="⏰ Ends", value=f"<t:{int(expires_at)}:R>", inline=True)
+    embed.set_footer(text="React with ✅ to complete this quest • Must be opted-in to earn XP")
+    
+    # Prepare quest role ping if set
+    ping_text = ""
+    settings = quest_bot.get_guild_settings(guild.id)
+    if settings["quest_ping_role_id"]:
+        ping_role = guild.get_role(settings["quest_ping_role_id"])
+        if ping_role:
+            ping_text = f"🔔 {ping_role.mention} - New quest available!\n\n"
+    
+    # Send quest message with ping before embed
+    quest_message = await channel.send(content=ping_text, embed=embed)
+    await quest_message.add_reaction('✅')
+    
+    # Store quest in database
+    quest_bot.storage.add_quest(quest_message.id, guild.id, channel.id, title, content, xp, expires_at)
+    if expires_at is not None:
+        quest_bot.quest_scheduler.schedule(expires_at, EXPIRE, quest_message.id)
+    return quest_message
+
+def parse_duration(text: str) -> float:
+    """Seconds in a duration like 90m, 2h, 3d or 1w; raises ValueError"""
+    text = text.strip().lower().lstrip("+")
+    if len(text) < 2 or text[-1] not in DURATION_UNITS:
+        raise ValueError(f"Invalid duration `{text}` - use a number followed by s, m, h, d or w (e.g. `24h`)")
+    seconds = float(text[:-1]) * DURATION_UNITS[text[-1]]
+    # float() also takes nan and inf, which would wreck the scheduler's heap order
+    if not math.isfinite(seconds):
+        raise ValueError(f"Invalid duration `{text}` - use a number followed by s, m, h, d or w (e.g. `24h`)")
+    if seconds <= 0:
+        raise ValueError("Durations must be positive")
+    if seconds > MAX_SCHEDULE_SECONDS:
+        raise ValueError("Durations can be at most a year")
+    return seconds
+
+def parse_start_time(text: str, now: float) -> float:
+    """`now`, a delay like 2h, or a UTC date and time like 2026-11-01T18:00"""
+    if text.lower() == "now":
+        return now
+    if text[-1:].lower() in DURATION_UNITS:
+        return now + parse_duration(text)
+    try:
+        start = datetime.fromisoformat(text)
+    except ValueError:
+        raise ValueError(f"Invalid start `{text}` - use `now`, a delay like `2h`, or UTC `YYYY-MM-DDTHH:MM`")
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    if start.timestamp() > now + MAX_SCHEDULE_SECONDS:
+        raise ValueError("Quests can be scheduled at most a year ahead")
+    return start.timestamp()
+
+def next_occurrence(scheduled: dict, now: float):
+    """(start of the latest occurrence due by now, start of the one after it or None)"""
+    start, repeat_every = scheduled['next_start'], scheduled['repeat_every']
+    if not repeat_every:
+        return start, None
+    # Occurrences missed while the bot was offline collapse into the most recent one
+    missed = max(0, int((now - start) // repeat_every))
+    start += missed * repeat_every
+    return start, start + repeat_every
+
+async def publish_scheduled_quest(schedule_id: int, due: float, now: float) -> bool:
+    """Post one scheduled quest and queue its end time and next posting"""
+    scheduled = quest_bot.storage.get_scheduled_quest(schedule_id)
+    # Removed (or replaced by an import), already posted by an earlier entry, or rescheduled since this entry was queued
+    if not scheduled or scheduled['next_start'] != due:
+        return False
+    guild = bot.get_guild(scheduled['guild_id'])
+    if not guild:
+        return False  # another worker owns this guild, or we left it
+    start, following = next_occurrence(scheduled, now)
+    # Move the schedule on before posting, so a crash mid-post can't post the same occurrence twice
+    if following is None:
+        quest_bot.storage.delete_scheduled_quest(schedule_id)
+    else:
+        quest_bot.storage.set_scheduled_quest_start(schedule_id, following)
+        quest_bot.quest_scheduler.schedule(following, PUBLISH, schedule_id)
+    expires_at = start + scheduled['duration'] if scheduled['duration'] else None
+    if expires_at is not None and expires_at <= now:
+        print(f"Skipped scheduled quest {schedule_id} ({scheduled['title']}) - it ended while the bot was offline")
+        return False
+    channel = guild.get_channel(scheduled['channel_id'])
+    if not channel:
+        print(f"Skipped scheduled quest {schedule_id} ({scheduled['title']}) - channel {scheduled['channel_id']} is gone")
+        return False
+    try:
+        await post_quest(guild, channel, scheduled['title'], scheduled['content'], scheduled['xp_reward'], expires_at)
+    except Exception as e:
+        print(f"Could not post scheduled quest {schedule_id}: {e}")
+        return False
+    return True
+
+async def close_quest_message(guild, message_id: int, quest: dict):
+    """Clear a quest's reactions and mark its embed as ended"""
+    channel = guild.get_channel(quest['channel_id'])
+    if not channel:
+        return
+    try:
+        message = await channel.fetch_message(message_id)
+        await message.clear_reactions()
+        embed = discord.Embed(
+            title=f"🏁 {quest['title']}",
+            description="This quest has ended.",
+            color=0x808080
+        )
+        embed.add_field(name="💰 Reward", value=f"{quest['xp_reward']} XP", inline=True)
+        embed.add_field(name="✅ Completed By", value=f"{len(quest['completed_users'])} member(s)", inline=True)
+        await message.edit(embed=embed)
+    except discord.NotFound:
+        pass  # Message already deleted
+    except Exception as e:
+        print(f"Could not close quest message {message_id}: {e}")
+
+async def close_expired_quests(message_ids: List[int], now: float) -> int:
+    """Close ended quests QUEST_EXPIRY_BATCH at a time - one round of REST calls, then one archive transaction"""
+    due = []
+    for message_id in message_ids:
+        quest = quest_bot.storage.get_quest(message_id)
+        # Removed (or replaced by an import), closed by a duplicate entry, or its end time changed
+        if not quest or quest['expires_at'] is None or quest['expires_at'] > now:
+            continue
+        guild = bot.get_guild(quest['guild_id'])
+        if guild:
+            due.append((guild, message_id, quest))
+    closed = 0
+    for i in range(0, len(due), QUEST_EXPIRY_BATCH):
+        batch = due[i:i + QUEST_EXPIRY_BATCH]
+        await asyncio.gather(*(close_quest_message(guild, message_id, quest) for guild, message_id, quest in batch))
+        closed += quest_bot.storage.archive_quests([message_id for _, message_id, _ in batch], "expired")
+    return closed
+
+async def run_due_quest_jobs(now: float = None):
+    """Post and close every quest that is due, returns (posted, closed)"""
+    now = time.time() if now is None else now
+    due = quest_bot.quest_scheduler.pop_due(now)
+    posted = 0
+    for when, kind, key in due:
+        if kind == PUBLISH and await publish_scheduled_quest(key, when, now):
+            posted += 1
+    closed = await close_expired_quests([key for _, kind, key in due if kind == EXPIRE], now)
+    if posted or closed:
+        print(f"Quest scheduler posted {posted} and closed {closed} quest(s)")
+    return posted, closed
+
 @bot.command(name='addquest')
 @commands.has_permissions(kick_members=True)
 async def add_quest(ctx, title: str, *args):
@@ -1724,42 +2775,9 @@ async def add_quest(ctx, title: str, *args):
         if xp > 10000:
             await ctx.send("❌ XP amount cannot exceed 10,000!", delete_after=10)
             return
-        # Get quest channel if set
-        target_channel = ctx.channel
-        if quest_bot.quest_channel_id:
-            quest_channel = ctx.guild.get_channel(quest_bot.quest_channel_id)
-            if quest_channel:
-                target_channel = quest_channel
-        
-        # Create quest embed
-        embed = discord.Embed(
-            title=f"🏆 {title}",
-            description=content,
-            color=0x0099ff
-        )
-        embed.add_field(name="💰 Reward", value=f"{xp} XP", inline=True)
-        embed.add_field(name="📝 How to Complete", value="React with ✅ below", inline=True)
-        embed.set_footer(text="React with ✅ to complete this quest • Must be opted-in to earn XP")
-        
-        # Prepare quest role ping if set
-        ping_text = ""
-        if quest_bot.quest_ping_role_id:
-            ping_role = ctx.guild.get_role(quest_bot.quest_ping_role_id)
-            if ping_role:
-                ping_text = f"🔔 {ping_role.mention} - New quest available!\n\n"
-        
-        # Send quest message with ping before embed
-        quest_message = await target_channel.send(content=ping_text, embed=embed)
-        await quest_message.add_reaction('✅')
-        
-        # Store quest in database
-        if quest_bot.db_connection:
-            cursor = quest_bot.db_connection.cursor()
-            cursor.execute('''
-                INSERT INTO quests (message_id, guild_id, channel_id, title, content, completed_users, xp_reward)
-                VALUES (?, ?, ?, ?, ?, '[]', ?)
-            ''', (quest_message.id, ctx.guild.id, target_channel.id, title, content, xp))
-            quest_bot.db_connection.commit()
+        # Post in the quest channel if set
+        target_channel = get_quest_channel(ctx.guild, ctx.channel)
+        await post_quest(ctx.guild, target_channel, title, content, xp)
         
         # Confirmation message
         embed = discord.Embed(
@@ -1772,20 +2790,127 @@ async def add_quest(ctx, title: str, *args):
     except Exception as e:
         await ctx.send(f"❌ Error creating quest: {str(e)[:100]}", delete_after=10)
 
+@bot.command(name='schedulequest')
+@commands.has_permissions(kick_members=True)
+async def schedule_quest(ctx, start: str, duration: str, repeat: str, title: str, *args):
+    """Schedule a quest to post later, optionally ending after a duration and repeating (staff only)"""
+    usage = ("**Usage:** `-schedulequest <start> <duration> <repeat> <title> <content> [amount]`\n"
+             "• start: `now`, a delay like `2h`, or UTC `2026-11-01T18:00`\n"
+             "• duration: how long it stays open, e.g. `24h`, or `none`\n"
+             "• repeat: `none`, `hourly`, `daily`, `weekly` or an interval like `3d`")
+    try:
+        if not args:
+            await ctx.send(f"❌ Please provide quest content!\n{usage}", delete_after=20)
+            return
+        xp = 50  # Default XP
+        content_parts = list(args)
+        if len(args) > 1 and args[-1].isdigit():
+            xp = int(args[-1])
+            content_parts = args[:-1]
+        content = " ".join(content_parts)
+        if xp > 10000:
+            await ctx.send("❌ XP amount cannot exceed 10,000!", delete_after=10)
+            return
+        
+        now = time.time()
+        try:
+            start_at = parse_start_time(start, now)
+            open_for = None if duration.lower() == "none" else parse_duration(duration)
+            repeat_every = None if repeat.lower() == "none" else REPEAT_ALIASES.get(repeat.lower()) or parse_duration(repeat)
+        except ValueError as e:
+            await ctx.send(f"❌ {e}\n{usage}", delete_after=20)
+            return
+        if repeat_every is not None:
+            if repeat_every < MIN_QUEST_REPEAT_SECONDS:
+                await ctx.send("❌ Quests can repeat at most once an hour!", delete_after=10)
+                return
+            if open_for is None or open_for > repeat_every:
+                await ctx.send("❌ A repeating quest needs a duration no longer than its repeat interval!", delete_after=10)
+                return
+        if start_at + (open_for or 0) <= now:
+            await ctx.send("❌ That quest would already be over!", delete_after=10)
+            return
+        
+        target_channel = get_quest_channel(ctx.guild, ctx.channel)
+        schedule_id = quest_bot.storage.add_scheduled_quest(ctx.guild.id, target_channel.id, title, content, xp,
+                                                            start_at, open_for, repeat_every, ctx.author.id)
+        quest_bot.quest_scheduler.schedule(start_at, PUBLISH, schedule_id)
+        
+        embed = discord.Embed(
+            title="🗓️ Quest Scheduled",
+            description=f"Quest **{title}** will be posted in {target_channel.mention} <t:{int(start_at)}:R>",
+            color=0x00ff00
+        )
+        embed.add_field(name="🆔 Schedule ID", value=str(schedule_id), inline=True)
+        embed.add_field(name="⏰ Open For", value=duration if open_for else "Until removed", inline=True)
+        embed.add_field(name="🔁 Repeats", value=repeat if repeat_every else "No", inline=True)
+        await ctx.send(embed=embed, delete_after=30)
+        
+    except Exception as e:
+        await ctx.send(f"❌ Error scheduling quest: {str(e)[:100]}", delete_after=10)
+
+@bot.command(name='scheduledquests')
+@commands.has_permissions(kick_members=True)
+async def scheduled_quests(ctx):
+    """List quests waiting to be posted (staff only)"""
+    try:
+        schedules = quest_bot.storage.list_scheduled_quests(ctx.guild.id)
+        if not schedules:
+            embed = discord.Embed(
+                title="🗓️ Scheduled Quests",
+                description="No scheduled quests.\n\nStaff can schedule one with `-schedulequest`",
+                color=0x0099ff
+            )
+            await ctx.send(embed=embed)
+            return
+        
+        lines = []
+        for scheduled in schedules:
+            repeats = f" • every {scheduled['repeat_every'] / 3600:g}h" if scheduled['repeat_every'] else ""
+            lines.append(f"`{scheduled['id']}` **{scheduled['title']}** - <t:{int(scheduled['next_start'])}:R>{repeats}")
+        embed = discord.Embed(
+            title="🗓️ Scheduled Quests",
+            description=f"{len(schedules)} scheduled quest(s):",
+            color=0x0099ff
+        )
+        # Embeds are capped at 6000 characters - show the soonest 50
+        for i in range(0, min(len(lines), 50), 10):
+            embed.add_field(name=f"Quests {i+1}-{min(i+10, len(lines))}", value="\n".join(lines[i:i+10]), inline=False)
+        embed.set_footer(text="💡 Use -unschedulequest <id> to cancel a schedule")
+        await ctx.send(embed=embed)
+        
+    except Exception as e:
+        await ctx.send(f"❌ Error fetching scheduled quests: {str(e)[:100]}", delete_after=10)
+
+@bot.command(name='unschedulequest')
+@commands.has_permissions(kick_members=True)
+async def unschedule_quest(ctx, schedule_id: int):
+    """Cancel a scheduled quest; quests it already posted stay open until they end (staff only)"""
+    try:
+        scheduled = quest_bot.storage.get_scheduled_quest(schedule_id)
+        if not scheduled or scheduled['guild_id'] != ctx.guild.id:
+            await ctx.send(f"❌ No scheduled quest with ID `{schedule_id}`. Use `-scheduledquests` to list them.",
+                           delete_after=10)
+            return
+        quest_bot.storage.delete_scheduled_quest(schedule_id)
+        embed = discord.Embed(
+            title="✅ Schedule Cancelled",
+            description=f"**{scheduled['title']}** will no longer be posted.",
+            color=0x00ff00
+        )
+        await ctx.send(embed=embed, delete_after=10)
+        
+    except Exception as e:
+        await ctx.send(f"❌ Error cancelling scheduled quest: {str(e)[:100]}", delete_after=10)
+
 @bot.command(name='removequest')
 @commands.has_permissions(kick_members=True)
 async def remove_quest(ctx, message_id: int):
     """Delete quest by message ID (staff only)"""
     try:
-        if not quest_bot.db_connection:
-            await ctx.send("❌ Database not available", delete_after=10)
-            return
+        quest = quest_bot.storage.get_quest(message_id)
         
-        cursor = quest_bot.db_connection.cursor()
-        cursor.execute('SELECT channel_id, title FROM quests WHERE message_id = ?', (message_id,))
-        quest_data = cursor.fetchone()
-        
-        if not quest_data:
+        if not quest:
             embed = discord.Embed(
                 title="❌ Quest Not Found",
                 description=f"No quest found with message ID: `{message_id}`\n\n"
@@ -1795,7 +2920,7 @@ async def remove_quest(ctx, message_id: int):
             await ctx.send(embed=embed, delete_after=15)
             return
         
-        channel_id, title = quest_data
+        channel_id, title = quest['channel_id'], quest['title']
         
         # Try to delete the actual message
         try:
@@ -1808,13 +2933,12 @@ async def remove_quest(ctx, message_id: int):
         except Exception as e:
             print(f"Could not delete quest message: {e}")
         
-        # Remove from database
-        cursor.execute('DELETE FROM quests WHERE message_id = ?', (message_id,))
-        quest_bot.db_connection.commit()
+        # Move to the archive, completions included
+        quest_bot.storage.archive_quests([message_id], "removed")
         
         embed = discord.Embed(
             title="✅ Quest Removed",
-            description=f"Quest **{title}** has been removed from the database and deleted from the channel.",
+            description=f"Quest **{title}** has been archived and deleted from the channel.",
             color=0x00ff00
         )
         await ctx.send(embed=embed, delete_after=10)
@@ -1827,13 +2951,7 @@ async def remove_quest(ctx, message_id: int):
 async def delete_all_quests(ctx):
     """Delete all current quests (admin only)"""
     try:
-        if not quest_bot.db_connection:
-            await ctx.send("❌ Database not available", delete_after=10)
-            return
-        
-        cursor = quest_bot.db_connection.cursor()
-        cursor.execute('SELECT message_id, channel_id, title FROM quests WHERE guild_id = ?', (ctx.guild.id,))
-        quests = cursor.fetchall()
+        quests = quest_bot.storage.list_quests(ctx.guild.id)
         
         if not quests:
             embed = discord.Embed(
@@ -1850,7 +2968,7 @@ async def delete_all_quests(ctx):
             description=f"**WARNING:** You are about to delete **{len(quests)} quest(s)** from this server.\n\n"
                        f"**This action will:**\n"
                        f"• Delete all quest messages from channels\n"
-                       f"• Remove all quest records from the database\n"
+                       f"• Move all quest records to the archive (`-questarchive`)\n"
                        f"• **Cannot be undone**\n\n"
                        f"React with ✅ to confirm or ❌ to cancel.",
             color=0xff6600
@@ -1897,17 +3015,16 @@ async def delete_all_quests(ctx):
                     failed_deletes.append(f"{title} (ID: {message_id})")
                     print(f"Could not delete quest message {message_id}: {e}")
             
-            # Delete all quest records from database
-            cursor.execute('DELETE FROM quests WHERE guild_id = ?', (ctx.guild.id,))
-            quest_bot.db_connection.commit()
+            # Move the listed quest records to the archive
+            quest_bot.storage.archive_quests([message_id for message_id, _, _ in quests], "deleted")
             
             # Success message
             embed = discord.Embed(
                 title="✅ All Quests Deleted",
                 description=f"**Successfully deleted {len(quests)} quest(s)**\n"
                            f"• Discord messages deleted: {deleted_count}/{len(quests)}\n"
-                           f"• Database records removed: {len(quests)}\n\n"
-                           f"{'**Note:** Some Discord messages could not be deleted (likely already removed)' if failed_deletes else 'All quest data has been completely removed.'}",
+                           f"• Quest records archived: {len(quests)}\n\n"
+                           f"{'**Note:** Some Discord messages could not be deleted (likely already removed)' if failed_deletes else 'All quests have been moved to the archive.'}",
                 color=0x00ff00
             )
             
@@ -1930,13 +3047,7 @@ async def delete_all_quests(ctx):
 async def all_quests(ctx):
     """List all current quests by name with clickable links"""
     try:
-        if not quest_bot.db_connection:
-            await ctx.send("❌ Database not available", delete_after=10)
-            return
-        
-        cursor = quest_bot.db_connection.cursor()
-        cursor.execute('SELECT message_id, channel_id, title FROM quests WHERE guild_id = ?', (ctx.guild.id,))
-        quests = cursor.fetchall()
+        quests = quest_bot.storage.list_quests(ctx.guild.id)
         
         if not quests:
             embed = discord.Embed(
@@ -1975,6 +3086,74 @@ async def all_quests(ctx):
     except Exception as e:
         await ctx.send(f"❌ Error fetching quests: {str(e)[:100]}", delete_after=10)
 
+@bot.command(name='questarchive')
+@commands.has_permissions(kick_members=True)
+async def quest_archive(ctx, page: int = 1):
+    """List ended and removed quests with their completion counts, newest first (staff only)"""
+    try:
+        per_page = 10
+        total = quest_bot.storage.count_archived_quests(ctx.guild.id)
+        if not total:
+            embed = discord.Embed(
+                title="🗄️ Quest Archive",
+                description="No archived quests yet. Quests are archived when they end or are removed.",
+                color=0x808080
+            )
+            await ctx.send(embed=embed)
+            return
+        
+        pages = (total + per_page - 1) // per_page
+        page = min(max(page, 1), pages)
+        rows = quest_bot.storage.list_archived_quests(ctx.guild.id, per_page, (page - 1) * per_page)
+        reasons = {"expired": "ended", "removed": "removed", "deleted": "deleted"}
+        lines = []
+        for message_id, channel_id, title, completions, xp_reward, archived_at, reason in rows:
+            quest_url = f"https://discord.com/channels/{ctx.guild.id}/{channel_id}/{message_id}"
+            lines.append(f"🏁 [{title}]({quest_url}) • {completions} completion(s) • {xp_reward} XP • "
+                         f"{reasons.get(reason, reason)} <t:{int(archived_at)}:d>")
+        embed = discord.Embed(
+            title="🗄️ Quest Archive",
+            description="\n".join(lines),
+            color=0x808080
+        )
+        embed.set_footer(text=f"Page {page}/{pages} • {total} archived quest(s) • -questarchive <page>")
+        await ctx.send(embed=embed)
+        
+    except Exception as e:
+        await ctx.send(f"❌ Error fetching the quest archive: {str(e)[:100]}", delete_after=10)
+
+@bot.command(name='xphistory')
+@commands.has_permissions(kick_members=True)
+async def xp_history(ctx, member: discord.Member, count: int = 10):
+    """List a member's latest XP changes from the ledger, newest first (staff only)"""
+    try:
+        # Changes still buffered in the ledger writer would be missing otherwise
+        quest_bot.ledger.flush()
+        rows = quest_bot.storage.list_xp_ledger(ctx.guild.id, member.id, min(max(count, 1), 25))
+        if not rows:
+            embed = discord.Embed(
+                title="📜 XP History",
+                description=f"No XP changes recorded for {member.mention} yet.",
+                color=0x808080
+            )
+            await ctx.send(embed=embed)
+            return
+        
+        lines = []
+        for ledger_id, delta, source, ref, created_at in rows:
+            ref_text = f" ({ref})" if ref else ""
+            lines.append(f"`#{ledger_id}` **{delta:+,} XP** • {source}{ref_text} • <t:{int(created_at)}:R>")
+        embed = discord.Embed(
+            title=f"📜 XP History for {member.display_name}",
+            description="\n".join(lines),
+            color=0x808080
+        )
+        embed.set_footer(text="Streak and badge rows are for reference • -rebuildxp [dry] <ids> leaves rows out")
+        await ctx.send(embed=embed)
+        
+    except Exception as e:
+        await ctx.send(f"❌ Error fetching XP history: {str(e)[:100]}", delete_after=10)
+
 @bot.command(name='assignroleXP')
 @commands.has_permissions(kick_members=True)
 async def assign_role_xp(ctx, xp_amount: int, role: discord.Role, role_type: str = "badge"):
@@ -1994,7 +3173,8 @@ async def assign_role_xp(ctx, xp_amount: int, role: discord.Role, role_type: str
         
         # Assign XP to role
         quest_bot.assign_role_xp(ctx.guild.id, str(role.id), xp_amount, role_type.lower())
-        quest_bot.save_settings(ctx.guild.id)
+        # Already saved - other worker processes reload their copy
+        quest_bot.publish_invalidation(ctx.guild.id, "settings")
         
         embed = discord.Embed(
             title="✅ Role XP Assigned",
@@ -2039,7 +3219,7 @@ async def assign_streak_xp_multi(ctx, xp_amount: int, *roles: discord.Role):
             quest_bot.assign_role_xp(ctx.guild.id, str(role.id), xp_amount, "streak")
             assigned_roles.append(role.mention)
         
-        quest_bot.save_settings(ctx.guild.id)
+        quest_bot.publish_invalidation(ctx.guild.id, "settings")
         
         embed = discord.Embed(
             title="✅ Streak XP Assigned",
@@ -2083,7 +3263,7 @@ async def assign_badge_xp_multi(ctx, xp_amount: int, *roles: discord.Role):
             quest_bot.assign_role_xp(ctx.guild.id, str(role.id), xp_amount, "badge")
             assigned_roles.append(role.mention)
         
-        quest_bot.save_settings(ctx.guild.id)
+        quest_bot.publish_invalidation(ctx.guild.id, "settings")
         
         embed = discord.Embed(
             title="✅ Badge XP Assigned",
@@ -2118,7 +3298,7 @@ async def unassign_role_xp(ctx, *roles: discord.Role):
             quest_bot.unassign_role_xp(ctx.guild.id, str(role.id))
             removed_roles.append(role.mention)
         
-        quest_bot.save_settings(ctx.guild.id)
+        quest_bot.publish_invalidation(ctx.guild.id, "settings")
         
         embed = discord.Embed(
             title="✅ Role XP Assignments Removed",
@@ -2225,7 +3405,24 @@ if __name__ == "__main__":
         print("Please set your Discord bot token as an environment variable.")
         exit(1)
 
-    webserver.keep_alive()
+    async def main():
+        # The web server shares the bot's event loop and shuts down with it
+        async with bot:
+            await webserver.start(bot, quest_bot)
+            try:
+                await bot.start(TOKEN)
+            finally:
+                await webserver.stop()
+                # Queued reactions are awarded before storage closes; their notices are dropped with the rest
+                await quest_bot.completions.flush()
+                quest_bot.notices.close()
+                quest_bot.ledger.close()
+                # Flushes the in-memory backend's snapshot, if one is configured
+                quest_bot.storage.close()
     
     # Run the bot
-    bot.run(TOKEN)
+    discord.utils.setup_logging()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,431 @@
+"""Run QuestBot as several worker processes, each owning a range of shards.
+
+Every worker is an ordinary `python bot.py` with QUEST_BOT_SHARD_IDS set, so a
+guild is only ever handled by one process. The workers share the SQLite
+database (WAL mode, one writer at a time), tell each other about role XP and
+whitelist changes through the cache_invalidations table, and write
+heartbeats to cluster_status. The launcher supervises the processes,
+restarts crashed ones and serves one aggregated health view.
+
+    python cluster.py --workers 4 --shards 16
+    python cluster.py --fake-gateway --workers 2 --shards 4   # local test, no Discord connection
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sqlite3
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from aiohttp import web
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.getenv('QUEST_BOT_DB', os.path.join(HERE, 'quest_bot.db'))
+
+# A heartbeat older than this many intervals means the worker is stuck
+STALE_HEARTBEATS = 3
+STARTUP_GRACE_SECONDS = 120
+
+
+def recommended_shard_count(token: str) -> int:
+    """Ask Discord how many shards this bot should run"""
+    response = requests.get("https://discord.com/api/v10/gateway/bot",
+                            headers={"Authorization": f"Bot {token}"}, timeout=10)
+    response.raise_for_status()
+    return response.json()["shards"]
+
+
+def shard_ranges(shard_count: int, workers: int) -> List[List[int]]:
+    """Split shards into contiguous, near-equal ranges - one per worker"""
+    workers = max(1, min(workers, shard_count))
+    base, extra = divmod(shard_count, workers)
+    ranges, start = [], 0
+    for index in range(workers):
+        size = base + (1 if index < extra else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+    return ranges
+
+
+class Worker:
+    def __init__(self, index: int, shard_ids: List[int], command: List[str], env: Dict[str, str]):
+        self.index = index
+        self.worker_id = f"worker-{index}"
+        self.shard_ids = shard_ids
+        self.command = command
+        self.env = env
+        self.process = None
+        self.started_at = None
+        self.restarts = 0
+
+    @property
+    def running(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def start(self):
+        self.process = await asyncio.create_subprocess_exec(*self.command, env=self.env, cwd=HERE)
+        self.started_at = time.time()
+        print(f"[cluster] {self.worker_id} started (pid {self.process.pid}, shards {self.shard_ids})")
+
+    async def supervise(self, stopping: asyncio.Event, restart: bool):
+        """Keep the worker running, restarting with backoff when it exits unexpectedly"""
+        while not stopping.is_set():
+            await self.start()
+            code = await self.process.wait()
+            if stopping.is_set() or not restart:
+                return code
+            self.restarts += 1
+            delay = min(60, 2 ** min(self.restarts, 6))
+            print(f"[cluster] {self.worker_id} exited with {code}, restarting in {delay}s")
+            try:
+                await asyncio.wait_for(stopping.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop(self, timeout: float = 15):
+        if not self.running:
+            return
+        self.process.send_signal(signal.SIGINT)
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout)
+        except asyncio.TimeoutError:
+            self.process.kill()
+            await self.process.wait()
+
+
+def read_heartbeats(db_path: str) -> Dict[str, dict]:
+    connection = sqlite3.connect(db_path, timeout=5)
+    try:
+        rows = connection.execute('SELECT worker_id, pid, shard_ids, updated_at, report FROM cluster_status').fetchall()
+    except sqlite3.OperationalError:
+        return {}  # workers haven't created the schema yet
+    finally:
+        connection.close()
+    return {worker_id: {"pid": pid, "shard_ids": json.loads(shard_ids), "updated_at": updated_at,
+                        "report": json.loads(report)}
+            for worker_id, pid, shard_ids, updated_at, report in rows}
+
+
+def cluster_report(db_path: str, workers: List[Worker], heartbeat_seconds: float) -> dict:
+    """One health/metrics view over every worker"""
+    heartbeats = read_heartbeats(db_path)
+    now = time.time()
+    stale_after = heartbeat_seconds * STALE_HEARTBEATS
+    report = {"workers": {}, "shards_total": 0, "shards_ready": 0, "guilds": 0, "backlog": 0}
+    for worker in workers:
+        beat = heartbeats.get(worker.worker_id)
+        # Ignore rows a previous process with the same worker ID left behind
+        if beat and worker.process and beat["pid"] != worker.process.pid:
+            beat = None
+        age = round(now - beat["updated_at"], 1) if beat else None
+        data = beat["report"] if beat else {}
+        starting = beat is None and worker.started_at and now - worker.started_at < STARTUP_GRACE_SECONDS
+        alive = worker.running and (starting or (age is not None and age < stale_after and data.get("alive", False)))
+        shards = data.get("shards", {})
+        report["workers"][worker.worker_id] = {
+            "pid": worker.process.pid if worker.process else None,
+            "running": worker.running,
+            "restarts": worker.restarts,
+            "shard_ids": worker.shard_ids,
+            "heartbeat_age_seconds": age,
+            "alive": bool(alive),
+            "ready": bool(alive and not starting and data.get("ready", False)),
+            "guilds": data.get("guilds", 0),
+            "latency_ms": data.get("latency_ms"),
+            "shards": shards,
+            "backlog": data.get("backlog", {}),
+            "invalidations_applied": data.get("invalidations_applied", 0),
+        }
+        report["shards_total"] += len(worker.shard_ids)
+        report["shards_ready"] += sum(1 for shard in shards.values() if shard.get("state") == "ready")
+        report["guilds"] += data.get("guilds", 0)
+        report["backlog"] += sum(data.get("backlog", {}).values())
+    report["alive"] = all(w["alive"] for w in report["workers"].values())
+    report["ready"] = all(w["ready"] for w in report["workers"].values())
+    return report
+
+
+async def start_status_server(db_path: str, workers: List[Worker], heartbeat_seconds: float, port: int):
+    async def build():
+        return await asyncio.to_thread(cluster_report, db_path, workers, heartbeat_seconds)
+
+    async def liveness(request):
+        report = await build()
+        return web.json_response({"alive": report["alive"]}, status=200 if report["alive"] else 503)
+
+    async def readiness(request):
+        report = await build()
+        return web.json_response({"ready": report["ready"], "shards_ready": report["shards_ready"],
+                                  "shards_total": report["shards_total"]},
+                                 status=200 if report["ready"] else 503)
+
+    async def status(request):
+        return web.json_response(await build())
+
+    app = web.Application()
+    app.router.add_get('/healthz', liveness)
+    app.router.add_get('/readyz', readiness)
+    app.router.add_get('/status', status)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", port).start()
+    print(f"[cluster] Status server listening on port {port}")
+    return runner
+
+
+def build_workers(args, shard_count: int) -> List[Worker]:
+    workers = []
+    for index, shard_ids in enumerate(shard_ranges(shard_count, args.workers)):
+        env = dict(os.environ)
+        env.update({
+            "QUEST_BOT_DB": args.db,
+            "QUEST_BOT_WORKER_ID": f"worker-{index}",
+            "QUEST_BOT_SHARD_COUNT": str(shard_count),
+            "QUEST_BOT_SHARD_IDS": ",".join(map(str, shard_ids)),
+            "QUEST_BOT_MAINTENANCE": "1" if index == 0 else "0",
+            "QUEST_BOT_HEARTBEAT_SECONDS": str(args.heartbeat),
+            "PORT": str(args.port + 1 + index),
+        })
+        if args.fake_gateway:
+            command = [sys.executable, os.path.abspath(__file__), "--fake-worker",
+                       "--members", str(args.members), "--roles", str(args.roles), "--reactors", str(args.reactors),
+                       "--role-updates", str(args.role_updates), "--duplicate-ratio", str(args.duplicate_ratio),
+                       "--rate", str(args.rate), "--seed", str(args.seed)]
+            env["QUEST_BOT_CACHE_POLL_SECONDS"] = "0.2"
+        else:
+            command = [sys.executable, os.path.join(HERE, "bot.py")]
+        workers.append(Worker(index, shard_ids, command, env))
+    return workers
+
+
+def clear_heartbeats(db_path: str):
+    connection = sqlite3.connect(db_path, timeout=5)
+    try:
+        with connection:
+            connection.execute('DELETE FROM cluster_status')
+    except sqlite3.OperationalError:
+        pass
+    finally:
+        connection.close()
+
+
+async def run_cluster(args) -> int:
+    if args.shards:
+        shard_count = args.shards
+    elif args.fake_gateway:
+        shard_count = args.workers
+    else:
+        token = os.getenv('DISCORD_BOT_TOKEN')
+        if not token:
+            print("Error: DISCORD_BOT_TOKEN environment variable not set!")
+            return 1
+        shard_count = recommended_shard_count(token)
+    clear_heartbeats(args.db)
+    workers = build_workers(args, shard_count)
+    print(f"[cluster] {shard_count} shard(s) across {len(workers)} worker(s), database {args.db}")
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    runner = await start_status_server(args.db, workers, args.heartbeat, args.port)
+    supervisors = [asyncio.create_task(worker.supervise(stopping, restart=not args.fake_gateway))
+                   for worker in workers]
+    try:
+        if args.fake_gateway:
+            return await run_fake_checks(args, workers, supervisors)
+        await stopping.wait()
+        return 0
+    finally:
+        stopping.set()
+        await asyncio.gather(*(worker.stop() for worker in workers))
+        await asyncio.gather(*supervisors, return_exceptions=True)
+        await runner.cleanup()
+
+
+# --- Fake gateway mode -------------------------------------------------------
+
+async def _wait_for(db_path: str, condition, supervisors, timeout: float, what: str):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        heartbeats = await asyncio.to_thread(read_heartbeats, db_path)
+        if condition(heartbeats):
+            return heartbeats
+        if any(task.done() for task in supervisors):
+            raise RuntimeError(f"a worker exited while waiting for {what}")
+        await asyncio.sleep(0.2)
+    raise TimeoutError(f"timed out waiting for {what}")
+
+
+async def run_fake_checks(args, workers: List[Worker], supervisors) -> int:
+    """Replay events in every worker, then verify cross-process cache invalidation"""
+    ids = [worker.worker_id for worker in workers]
+
+    def phase_reached(phase):
+        return lambda beats: all(beats.get(i, {}).get("report", {}).get("phase") == phase for i in ids)
+
+    beats = await _wait_for(args.db, phase_reached("replayed"), supervisors, args.timeout, "replays to finish")
+
+    # Change each worker's role XP and whitelist from "outside" and publish the invalidations
+    expected = {}
+    connection = sqlite3.connect(args.db, timeout=10)
+    try:
+        with connection:
+            for worker_id in ids:
+                for guild_id in beats[worker_id]["report"]["guild_ids"]:
+                    connection.execute('UPDATE role_xp SET xp = xp + 1 WHERE guild_id = ?', (guild_id,))
+                    role_xp_total = connection.execute('SELECT COALESCE(SUM(xp), 0) FROM role_xp WHERE guild_id = ?',
+                                                       (guild_id,)).fetchone()[0]
+                    connection.execute('INSERT OR REPLACE INTO whitelisted_channels (guild_id, channel_id, channel_name) '
+                                       'VALUES (?, 1, ?)', (guild_id, "cluster-check"))
+                    connection.executemany(
+                        'INSERT INTO cache_invalidations (guild_id, kind, source, created_at) VALUES (?, ?, ?, ?)',
+                        [(guild_id, "settings", "cluster", time.time()), (guild_id, "whitelist", "cluster", time.time())])
+                    expected[str(guild_id)] = {"role_xp_total": role_xp_total, "whitelisted": 1}
+    finally:
+        connection.close()
+
+    def caches_match(beats):
+        for worker_id in ids:
+            caches = beats.get(worker_id, {}).get("report", {}).get("caches", {})
+            if any(caches.get(guild_id) != want for guild_id, want in expected.items()
+                   if int(guild_id) in beats[worker_id]["report"]["guild_ids"]):
+                return False
+        return True
+
+    invalidation_ok = True
+    try:
+        beats = await _wait_for(args.db, caches_match, supervisors, 10, "workers to apply cache invalidations")
+    except TimeoutError:
+        invalidation_ok = False
+        beats = await asyncio.to_thread(read_heartbeats, args.db)
+
+    report = await asyncio.to_thread(cluster_report, args.db, workers, args.heartbeat)
+    print(f"{'worker':<10}{'shards':<12}{'guilds':>7}{'events':>9}{'events/s':>11}{'p99 ms':>9}{'consistent':>12}{'invalidations':>15}")
+    all_consistent = True
+    for worker_id in ids:
+        data = beats[worker_id]["report"]
+        replay_stats = data.get("replay", {})
+        all_consistent &= replay_stats.get("consistent", False)
+        print(f"{worker_id:<10}{','.join(map(str, beats[worker_id]['shard_ids'])):<12}{data.get('guilds', 0):>7}"
+              f"{replay_stats.get('events', 0):>9,}{replay_stats.get('events_per_sec', 0):>11,.1f}"
+              f"{replay_stats.get('p99_ms', 0):>9.2f}{'yes' if replay_stats.get('consistent') else 'NO':>12}"
+              f"{data.get('invalidations_applied', 0):>15}")
+    print(f"Cluster: {report['shards_ready']}/{report['shards_total']} shards ready, {report['guilds']} guilds, "
+          f"alive={report['alive']} ready={report['ready']}")
+    print("Cache invalidation: " + ("✅ applied in every worker" if invalidation_ok else "❌ NOT applied"))
+    ok = all_consistent and invalidation_ok and report["ready"]
+    print("Result: " + ("✅ consistent" if ok else "❌ FAILED"))
+    return 0 if ok else 1
+
+
+async def run_fake_worker(args):
+    """A worker that takes its events from replay.py instead of the Discord gateway"""
+    import bot as questbot
+    import fakes
+    import replay
+
+    worker_index = int(os.environ["QUEST_BOT_WORKER_ID"].rsplit("-", 1)[1])
+    # Separate ID ranges so workers sharing the database never create clashing rows
+    fakes.reset_ids(100_000_000_000_000_000 + worker_index * 10 ** 15)
+    quest_bot = questbot.quest_bot
+    client = fakes.FakeClient()
+    client.install(questbot.bot)
+    questbot.start_background_tasks()
+
+    states, streams = [], []
+    progress = {"phase": "loading", "summaries": []}
+    for shard_id in questbot.SHARD_IDS:
+        questbot.update_shard_status(shard_id, state="loading")
+        guild, extra = fakes.build_guild(quest_bot, args.members, role_count=args.roles, seed=args.seed + shard_id)
+        guild.shard_id = shard_id
+        client.add_guild(guild)
+        await questbot.initialize_guild(guild)
+        quest_bot.save_settings(guild.id)
+        quest_bot.get_whitelisted_channels(guild.id)  # warm the whitelist cache
+        states.append(replay.ReplayState(quest_bot, guild, extra, replay.create_quest(quest_bot, guild)))
+        stream_args = argparse.Namespace(**{**vars(args), "seed": args.seed + shard_id, "duration": 10.0})
+        streams.append(replay.synthesize_events(stream_args)["events"])
+        questbot.update_shard_status(shard_id, state="ready", guilds=1, ready_at=time.time())
+    quest_bot.startup_complete = True
+
+    def caches():
+        return {str(state.guild.id): {
+            "role_xp_total": sum(d["xp"] for d in quest_bot.role_xp_assignments.get(state.guild.id, {}).values()),
+            "whitelisted": len(quest_bot.get_whitelisted_channels(state.guild.id)),
+        } for state in states}
+
+    def extra():
+        summaries = progress["summaries"]
+        data = {"phase": progress["phase"], "gateway": "fake", "guild_ids": [s.guild.id for s in states], "caches": caches()}
+        # No gateway connection here, so readiness comes from the shard states alone
+        data["ready"] = all(status["state"] == "ready" for status in quest_bot.shard_status.values())
+        data["alive"] = True
+        if summaries:
+            data["replay"] = {
+                "events": sum(s["count"] for s in summaries),
+                "events_per_sec": sum(s["ops_per_sec"] for s in summaries),
+                "p99_ms": max(s["p99_ms"] for s in summaries),
+                "consistent": all(replay.is_consistent(s["consistency"]) for s in summaries),
+            }
+        return data
+
+    # The regular heartbeat loop carries the replay progress from here on
+    questbot.heartbeat_extra = extra
+    progress["phase"] = "replaying"
+    progress["summaries"] = await asyncio.gather(
+        *(replay.play(state, events, args.rate) for state, events in zip(states, streams)))
+    progress["phase"] = "replayed"
+    await questbot.write_cluster_heartbeat(extra())
+    # Keep running until the launcher stops us so it can check cache invalidation
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run QuestBot as a cluster of shard worker processes")
+    parser.add_argument("--workers", type=int, default=int(os.getenv('QUEST_BOT_WORKERS', 2)))
+    parser.add_argument("--shards", type=int, default=int(os.getenv('QUEST_BOT_SHARD_COUNT', 0)),
+                        help="Total shard count (default: Discord's recommendation)")
+    parser.add_argument("--db", help="Shared database (default: quest_bot.db, or a scratch file with --fake-gateway)")
+    parser.add_argument("--port", type=int, default=int(os.getenv('PORT', 3000)),
+                        help="Aggregated status port; workers use the following ports")
+    parser.add_argument("--heartbeat", type=float, default=float(os.getenv('QUEST_BOT_HEARTBEAT_SECONDS', 10)))
+    parser.add_argument("--fake-gateway", action="store_true",
+                        help="Feed every worker synthesized events instead of connecting to Discord")
+    parser.add_argument("--timeout", type=float, default=300, help="Fake gateway mode: give up after this long")
+    parser.add_argument("--members", type=int, default=2000, help="Fake gateway mode: members per guild")
+    parser.add_argument("--roles", type=int, default=100, help="Fake gateway mode: roles per guild")
+    parser.add_argument("--reactors", type=int, default=1000, help="Fake gateway mode: quest reactions per guild")
+    parser.add_argument("--role-updates", type=int, default=200, help="Fake gateway mode: role changes per guild")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.05, help=argparse.SUPPRESS)
+    parser.add_argument("--rate", type=float, default=0, help="Fake gateway mode: events/s per guild (0 = max)")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--fake-worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.fake_worker:
+        import contextlib
+        import io
+        # The handlers log every event; keep worker output readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            try:
+                asyncio.run(run_fake_worker(args))
+            except KeyboardInterrupt:
+                pass
+        return 0
+    if args.fake_gateway:
+        if not args.db:
+            args.db = os.path.join(tempfile.mkdtemp(prefix="questbot-cluster-"), "quest_bot.db")
+        args.heartbeat = min(args.heartbeat, 0.5)
+    args.db = args.db or DB_PATH
+    return asyncio.run(run_cluster(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""Per-quest queue for quest completion reactions.
+
+A reaction only queues the user under the quest's message id. One worker per
+quest takes the queue in micro-batches: a user reacting twice counts once, and
+the batch goes to process(message_id, batch), which records the completions
+and awards XP for the whole batch in one transaction. Batches for the same
+quest never run concurrently, and storage skips users who already completed
+the quest, so a batch retried after an error can't award anyone twice.
+"""
+import asyncio
+from collections import deque
+
+
+class CompletionPipeline:
+    """Per-quest queues of reactions, handed to process(message_id, {user_id: item}) in batches"""
+
+    def __init__(self, process, window: float = 0.05, max_batch: int = 500, max_attempts: int = 3,
+                 retry_delay: float = 1.0):
+        self.process = process
+        self.window = window  # how long a worker collects reactions before processing them
+        self.max_batch = max_batch  # users per transaction
+        self.max_attempts = max_attempts  # a failing batch is retried, then dropped with a log line
+        self.retry_delay = retry_delay
+        self.queues = {}  # message_id -> deque of (user_id, item)
+        self.workers = {}  # message_id -> task draining that quest's queue
+        self.batches = 0
+        self.processed = 0  # users handed to process, including ones who had already completed the quest
+        self.failed = 0
+        self._flushing = asyncio.Event()
+
+    def submit(self, message_id: int, user_id: int, item):
+        queue = self.queues.get(message_id)
+        if queue is None:
+            queue = self.queues[message_id] = deque()
+        queue.append((user_id, item))
+        if message_id not in self.workers:
+            self.workers[message_id] = asyncio.create_task(self._drain(message_id, queue))
+
+    def pending_count(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    @property
+    def tasks(self):
+        return set(self.workers.values())
+
+    async def flush(self):
+        """Process everything queued now, skipping the collection window"""
+        self._flushing.set()
+        try:
+            while self.tasks:
+                await asyncio.gather(*self.tasks, return_exceptions=True)
+        finally:
+            self._flushing.clear()
+
+    async def _drain(self, message_id: int, queue: deque):
+        failures = 0
+        try:
+            while queue:
+                try:
+                    await asyncio.wait_for(self._flushing.wait(), self.window)
+                except asyncio.TimeoutError:
+                    pass
+                batch = {}
+                while queue and len(batch) < self.max_batch:
+                    user_id, item = queue.popleft()
+                    batch.setdefault(user_id, item)
+                try:
+                    await self.process(message_id, batch)
+                except Exception as e:
+                    failures += 1
+                    if failures < self.max_attempts:
+                        print(f"Error processing {len(batch)} completion(s) for quest {message_id}, retrying: {e}")
+                        queue.extendleft(reversed(list(batch.items())))
+                        await asyncio.sleep(self.retry_delay * failures)
+                        continue
+                    print(f"Dropped {len(batch)} completion(s) for quest {message_id} after {failures} attempts: {e}")
+                    self.failed += len(batch)
+                else:
+                    self.batches += 1
+                    self.processed += len(batch)
+                failures = 0
+        finally:
+            del self.workers[message_id]
+            if not queue:
+                del self.queues[message_id]
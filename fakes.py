@@ -0,0 +1,349 @@
+"""Lightweight stand-ins for the discord.py models QuestBot touches.
+
+These let the benchmark and replay scripts drive QuestBot and the event
+handlers in bot.py without a gateway connection or a Discord token.
+"""
+import asyncio
+import itertools
+import random
+import time
+from collections import Counter
+
+# Snowflake-sized IDs so anything that formats or slices IDs behaves normally
+_next_id = itertools.count(100_000_000_000_000_000)
+
+
+def new_id() -> int:
+    return next(_next_id)
+
+
+def reset_ids(start: int):
+    """Restart ID allocation - separate processes sharing one database need disjoint ranges"""
+    global _next_id
+    _next_id = itertools.count(start)
+
+
+class RestSink:
+    """Stub REST layer - records every outbound call instead of hitting Discord"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.sent_embeds = []
+
+    async def call(self, route: str, **payload):
+        self.calls[route] += 1
+        if route == "send" and payload.get("embed") is not None:
+            self.sent_embeds.append(payload["embed"])
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+
+class FakeRole:
+    def __init__(self, name: str, role_id: int = None, guild=None):
+        self.id = role_id or new_id()
+        self.name = name
+        self.guild = guild
+
+    @property
+    def mention(self):
+        return f"<@&{self.id}>"
+
+    def __eq__(self, other):
+        return isinstance(other, FakeRole) and other.id == self.id
+
+    def __hash__(self):
+        return self.id >> 22
+
+    def __repr__(self):
+        return f"<FakeRole {self.name!r}>"
+
+
+class FakePermissions:
+    def __init__(self, **perms):
+        self.send_messages = perms.get("send_messages", True)
+        self.manage_guild = perms.get("manage_guild", False)
+        self.manage_roles = perms.get("manage_roles", False)
+        self.kick_members = perms.get("kick_members", False)
+
+
+class FakeAsset:
+    url = "https://cdn.discordapp.com/embed/avatars/0.png"
+
+
+class FakeMessage:
+    def __init__(self, channel, message_id: int = None, content: str = "", embed=None):
+        self.id = message_id or new_id()
+        self.channel = channel
+        self.guild = channel.guild
+        self.content = content
+        self.embed = embed
+
+    async def add_reaction(self, emoji):
+        await self.guild.sink.call("add_reaction", emoji=emoji)
+
+    async def clear_reactions(self):
+        await self.guild.sink.call("clear_reactions")
+
+    async def delete(self):
+        await self.guild.sink.call("delete_message")
+
+    async def edit(self, **kwargs):
+        await self.guild.sink.call("edit_message", **kwargs)
+
+
+class FakeChannel:
+    def __init__(self, guild, name: str = "general", channel_id: int = None):
+        self.id = channel_id or new_id()
+        self.name = name
+        self.guild = guild
+
+    @property
+    def mention(self):
+        return f"<#{self.id}>"
+
+    def permissions_for(self, member):
+        return FakePermissions(send_messages=True)
+
+    async def send(self, content=None, **kwargs):
+        await self.guild.sink.call("send", content=content, **kwargs)
+        return FakeMessage(self, content=content or "", embed=kwargs.get("embed"))
+
+    async def fetch_message(self, message_id: int):
+        return FakeMessage(self, message_id=message_id)
+
+
+class FakeMember:
+    def __init__(self, guild, name: str, member_id: int = None, roles=None, bot: bool = False):
+        self.id = member_id or new_id()
+        self.name = name
+        self.display_name = name
+        self.guild = guild
+        self.bot = bot
+        self.roles = list(roles or [])
+        self.avatar = None
+        self.default_avatar = FakeAsset()
+        self.guild_permissions = FakePermissions()
+
+    @property
+    def mention(self):
+        return f"<@{self.id}>"
+
+    def copy(self):
+        """Snapshot used as the `before` side of a member update"""
+        clone = FakeMember(self.guild, self.name, member_id=self.id, roles=self.roles, bot=self.bot)
+        clone.display_name = self.display_name
+        return clone
+
+    async def add_roles(self, *roles, reason=None):
+        for role in roles:
+            if role not in self.roles:
+                self.roles.append(role)
+        await self.guild.sink.call("add_roles", count=len(roles))
+
+    async def remove_roles(self, *roles, reason=None):
+        for role in roles:
+            if role in self.roles:
+                self.roles.remove(role)
+        await self.guild.sink.call("remove_roles", count=len(roles))
+
+    def __eq__(self, other):
+        return isinstance(other, FakeMember) and other.id == self.id
+
+    def __hash__(self):
+        return self.id >> 22
+
+
+class FakeGuild:
+    def __init__(self, name: str = "Bench Guild", guild_id: int = None, sink: RestSink = None):
+        self.id = guild_id or new_id()
+        self.name = name
+        self.sink = sink or RestSink()
+        self.shard_id = 0
+        self.roles = []
+        self._roles_by_id = {}
+        self._members = {}
+        self.text_channels = [FakeChannel(self, "general")]
+        self.me = FakeMember(self, "QuestBot", bot=True)
+
+    @property
+    def members(self):
+        return list(self._members.values())
+
+    @property
+    def member_count(self):
+        return len(self._members)
+
+    @property
+    def channels(self):
+        return self.text_channels
+
+    def add_role(self, name: str) -> FakeRole:
+        role = FakeRole(name, guild=self)
+        self.roles.append(role)
+        self._roles_by_id[role.id] = role
+        return role
+
+    def add_member(self, member: FakeMember):
+        self._members[member.id] = member
+
+    def get_member(self, user_id: int):
+        return self._members.get(user_id)
+
+    def get_role(self, role_id: int):
+        return self._roles_by_id.get(role_id)
+
+    def get_channel(self, channel_id: int):
+        for channel in self.text_channels:
+            if channel.id == channel_id:
+                return channel
+        return None
+
+    async def create_role(self, name: str, **kwargs):
+        await self.sink.call("create_role")
+        return self.add_role(name)
+
+    async def chunk(self):
+        return self.members
+
+    async def query_members(self, user_ids=None, limit: int = 5, cache: bool = True, **kwargs):
+        await self.sink.call("query_members")
+        return [self._members[user_id] for user_id in (user_ids or [])[:limit] if user_id in self._members]
+
+
+class FakeReaction:
+    def __init__(self, message: FakeMessage, emoji: str = '✅'):
+        self.message = message
+        self.emoji = emoji
+
+
+class FakeContext:
+    """Minimal commands.Context for calling command callbacks directly"""
+
+    def __init__(self, guild: FakeGuild, author: FakeMember, channel: FakeChannel = None):
+        self.guild = guild
+        self.author = author
+        self.channel = channel or guild.text_channels[0]
+        self.command = None
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+
+class FakeClient:
+    """Replaces the lookups QuestBot makes on the global `bot` object"""
+
+    def __init__(self):
+        self.guilds = {}
+
+    def add_guild(self, guild: FakeGuild):
+        self.guilds[guild.id] = guild
+
+    def get_guild(self, guild_id: int):
+        return self.guilds.get(guild_id)
+
+    def get_user(self, user_id: int):
+        for guild in self.guilds.values():
+            member = guild.get_member(user_id)
+            if member:
+                return member
+        return None
+
+    def install(self, bot):
+        """Point the real bot's cache lookups at the fake guilds"""
+        bot.get_guild = self.get_guild
+        bot.get_user = self.get_user
+
+
+def build_guild(quest_bot, member_count: int, role_count: int = 300, opt_in_ratio: float = 0.8,
+                roles_per_member: int = 4, seed: int = 1234, sink: RestSink = None):
+    """Create a populated fake guild and register its role XP and users with quest_bot
+
+    Returns (guild, extra) where extra holds the role groups the callers use to
+    generate role-change events.
+    """
+    rng = random.Random(seed)
+    guild = FakeGuild(f"Bench Guild {member_count}", sink=sink)
+
+    level_roles = [guild.add_role(f"Level {level}") for level in range(1, 11)]
+    streak_roles, badge_roles, auto_badge_roles, plain_roles = [], [], [], []
+    for i in range(role_count):
+        bucket = i % 4
+        if bucket == 0:
+            role = guild.add_role(f"Streak {i}")
+            quest_bot.assign_role_xp(guild.id, str(role.id), 10, "streak")
+            streak_roles.append(role)
+        elif bucket == 1:
+            role = guild.add_role(f"Assigned Badge {i}")
+            quest_bot.assign_role_xp(guild.id, str(role.id), 25, "badge")
+            badge_roles.append(role)
+        elif bucket == 2:
+            auto_badge_roles.append(guild.add_role(f"Event Badge {i}"))
+        else:
+            plain_roles.append(guild.add_role(f"Role {i}"))
+    extra_roles = streak_roles + badge_roles + auto_badge_roles + plain_roles
+
+    user_rows = []
+    for i in range(member_count):
+        roles = rng.sample(extra_roles, min(roles_per_member, len(extra_roles)))
+        opted_in = rng.random() < opt_in_ratio
+        # Skewed XP so the leaderboard has a realistic long tail
+        xp = int(rng.paretovariate(1.3) * 40) if opted_in else 0
+        level = quest_bot.calculate_level(xp)
+        if opted_in:
+            roles.append(level_roles[level - 1])
+        member = FakeMember(guild, f"member{i}", roles=roles)
+        guild.add_member(member)
+        if opted_in:
+            user_rows.append((member.id, guild.id, xp, level))
+
+    quest_bot.storage.add_users(user_rows)
+
+    extra = {
+        "level_roles": level_roles,
+        "streak_roles": streak_roles,
+        "badge_roles": badge_roles,
+        "auto_badge_roles": auto_badge_roles,
+        "plain_roles": plain_roles,
+    }
+    return guild, extra
+
+
+def percentile(samples, pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class LatencyRecorder:
+    """Collects per-operation latencies and reports throughput and percentiles"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.samples = []
+        self.started = None
+        self.finished = None
+
+    def start(self):
+        self.started = time.perf_counter()
+
+    def stop(self):
+        self.finished = time.perf_counter()
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+
+    def summary(self) -> dict:
+        elapsed = (self.finished or time.perf_counter()) - (self.started or time.perf_counter())
+        count = len(self.samples)
+        return {
+            "op": self.name,
+            "count": count,
+            "ops_per_sec": count / elapsed if elapsed > 0 else 0.0,
+            "p50_ms": percentile(self.samples, 50) * 1000,
+            "p95_ms": percentile(self.samples, 95) * 1000,
+            "p99_ms": percentile(self.samples, 99) * 1000,
+            "max_ms": max(self.samples, default=0.0) * 1000,
+        }
@@ -0,0 +1,213 @@
+"""Synthetic quest_bot.db generator for scale testing.
+
+Fills users, quests, streak_role_gains, settings, role_xp and whitelisted_channels
+with skewed, realistic-looking data. The schema comes from QuestBot itself
+so generated files always match what the bot expects. Output is fully
+determined by --seed.
+
+    python generate_db.py --output scale.db --guilds 20 --users 500000 --streak-gains 5000000
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def batched(iterable, size: int):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class SnowflakeFactory:
+    """Deterministic, increasing Discord-style IDs"""
+
+    def __init__(self, rng: random.Random):
+        self.current = 900_000_000_000_000_000 + rng.randrange(10**12)
+
+    def __call__(self) -> int:
+        self.current += 1 + (self.current % 7)
+        return self.current
+
+
+def split_skewed(total: int, parts: int, rng: random.Random, alpha: float = 1.1) -> list:
+    """Split total into parts with a heavy-tailed distribution (a few huge guilds, many small)"""
+    weights = [rng.paretovariate(alpha) for _ in range(parts)]
+    scale = total / sum(weights)
+    sizes = [max(1, int(w * scale)) for w in weights]
+    sizes[0] += total - sum(sizes)
+    return [max(1, s) for s in sizes]
+
+
+class Generator:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.next_id = SnowflakeFactory(self.rng)
+        self.guilds = []
+
+    def plan_guilds(self, calculate_level):
+        args = self.args
+        sizes = split_skewed(args.users, args.guilds, self.rng)
+        for size in sizes:
+            guild = {
+                "id": self.next_id(),
+                "users": [self.next_id() for _ in range(size)],
+                "channels": [self.next_id() for _ in range(self.rng.randint(3, 12))],
+                "streak_roles": [self.next_id() for _ in range(args.streak_roles)],
+                "badge_roles": [self.next_id() for _ in range(args.badge_roles)],
+            }
+            guild["role_xp"] = {}
+            for role_id in guild["streak_roles"]:
+                guild["role_xp"][str(role_id)] = {"xp": self.rng.choice([5, 10, 15, 25]), "type": "streak"}
+            for role_id in guild["badge_roles"]:
+                guild["role_xp"][str(role_id)] = {"xp": self.rng.choice([5, 10, 20, 50, 100]), "type": "badge"}
+            self.guilds.append(guild)
+        self.calculate_level = calculate_level
+
+    def user_rows(self):
+        for guild in self.guilds:
+            for user_id in guild["users"]:
+                # Most members barely play, a few grind a lot
+                xp = min(int(self.rng.paretovariate(1.16) * 25) - 25, 50_000)
+                yield (user_id, guild["id"], xp, self.calculate_level(xp))
+
+    def settings_rows(self):
+        for guild in self.guilds:
+            yield (guild["id"], self.next_id(), self.rng.choice(guild["channels"]),
+                   self.next_id(), self.rng.choice(guild["channels"]))
+
+    def role_xp_rows(self):
+        for guild in self.guilds:
+            for role_id, data in guild["role_xp"].items():
+                yield (guild["id"], int(role_id), data["xp"], data["type"])
+
+    def whitelist_rows(self):
+        for guild in self.guilds:
+            count = self.rng.randint(0, min(self.args.max_whitelisted, len(guild["channels"])))
+            for index, channel_id in enumerate(self.rng.sample(guild["channels"], count)):
+                yield (guild["id"], channel_id, f"channel-{index}")
+
+    def quest_rows(self):
+        args = self.args
+        for guild in self.guilds:
+            users = guild["users"]
+            for number in range(args.quests):
+                # Newer quests are more popular; completion counts are heavy tailed
+                popularity = self.rng.paretovariate(1.3) * (1 + number / max(1, args.quests))
+                completions = min(len(users), args.max_completions, int(popularity * len(users) * 0.02))
+                completed = self.rng.sample(users, completions) if completions else []
+                yield (self.next_id(), guild["id"], self.rng.choice(guild["channels"]),
+                       f"Quest #{number + 1}", f"Synthetic quest {number + 1} for load testing",
+                       json.dumps(completed), self.rng.choice([25, 50, 50, 50, 100, 250]))
+
+    def streak_rows(self):
+        args = self.args
+        now = datetime(2026, 1, 1)
+        # Guilds get gains in proportion to their size; inside a guild a few users dominate
+        weights = list(itertools.accumulate(len(g["users"]) for g in self.guilds))
+        for _ in range(args.streak_gains):
+            guild = self.rng.choices(self.guilds, cum_weights=weights)[0]
+            if not guild["streak_roles"]:
+                continue
+            users = guild["users"]
+            user_id = users[min(len(users) - 1, int(self.rng.paretovariate(1.5)) - 1)
+                            if self.rng.random() < 0.6 else self.rng.randrange(len(users))]
+            role_id = self.rng.choice(guild["streak_roles"])
+            xp = guild["role_xp"][str(role_id)]["xp"]
+            timestamp = now - timedelta(seconds=self.rng.randrange(args.days * 86400))
+            yield (user_id, guild["id"], role_id, f"Streak Role {role_id % 1000}", xp,
+                   timestamp.strftime("%Y-%m-%d %H:%M:%S"))
+
+
+def stream_insert(connection, label: str, sql: str, rows, batch_size: int) -> int:
+    """Insert rows in large transactions without materializing the whole set"""
+    total = 0
+    started = time.perf_counter()
+    for batch in batched(rows, batch_size):
+        connection.execute('BEGIN')
+        connection.executemany(sql, batch)
+        connection.execute('COMMIT')
+        total += len(batch)
+        print(f"\r  {label}: {total:,} rows", end="", flush=True)
+    print(f"\r  {label}: {total:,} rows in {time.perf_counter() - started:.1f}s")
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic quest_bot.db for scale testing")
+    parser.add_argument("--output", default="quest_bot_synthetic.db")
+    parser.add_argument("--guilds", type=int, default=10)
+    parser.add_argument("--users", type=int, default=100_000, help="Total users across all guilds")
+    parser.add_argument("--quests", type=int, default=200, help="Quests per guild")
+    parser.add_argument("--max-completions", type=int, default=50_000,
+                        help="Upper bound on completed_users entries per quest")
+    parser.add_argument("--streak-gains", type=int, default=1_000_000, help="Total streak_role_gains rows")
+    parser.add_argument("--streak-roles", type=int, default=20, help="Streak roles with XP per guild")
+    parser.add_argument("--badge-roles", type=int, default=100, help="Badge roles with XP per guild")
+    parser.add_argument("--max-whitelisted", type=int, default=4)
+    parser.add_argument("--days", type=int, default=365, help="Spread streak gains over this many days")
+    parser.add_argument("--batch-size", type=int, default=50_000, help="Rows per transaction")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--force", action="store_true", help="Overwrite the output file if it exists")
+    args = parser.parse_args()
+
+    if os.path.exists(args.output):
+        if not args.force:
+            print(f"Error: {args.output} already exists (use --force to overwrite)")
+            sys.exit(1)
+        os.remove(args.output)
+
+    # Let QuestBot create the schema (and run its migrations) on the new file
+    os.environ['QUEST_BOT_DB'] = args.output
+    import bot as questbot
+    questbot.quest_bot.storage.close()
+
+    connection = sqlite3.connect(args.output, isolation_level=None)
+    connection.execute('PRAGMA journal_mode = OFF')
+    connection.execute('PRAGMA synchronous = OFF')
+
+    generator = Generator(args)
+    generator.plan_guilds(questbot.quest_bot.calculate_level)
+    print(f"Generating {args.output} (seed {args.seed})...")
+
+    stream_insert(connection, "users",
+                  'INSERT INTO users (user_id, guild_id, xp, level) VALUES (?, ?, ?, ?)',
+                  generator.user_rows(), args.batch_size)
+    stream_insert(connection, "settings",
+                  '''INSERT INTO settings (guild_id, quest_ping_role_id, quest_channel_id, optin_message_id,
+                     optin_channel_id) VALUES (?, ?, ?, ?, ?)''',
+                  generator.settings_rows(), args.batch_size)
+    stream_insert(connection, "role_xp",
+                  'INSERT INTO role_xp (guild_id, role_id, xp, type) VALUES (?, ?, ?, ?)',
+                  generator.role_xp_rows(), args.batch_size)
+    stream_insert(connection, "whitelisted_channels",
+                  'INSERT INTO whitelisted_channels (guild_id, channel_id, channel_name) VALUES (?, ?, ?)',
+                  generator.whitelist_rows(), args.batch_size)
+    # Quests carry big JSON arrays, so use smaller transactions for them
+    stream_insert(connection, "quests",
+                  '''INSERT INTO quests (message_id, guild_id, channel_id, title, content, completed_users, xp_reward)
+                     VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                  generator.quest_rows(), max(1, args.batch_size // 100))
+    stream_insert(connection, "streak_role_gains",
+                  '''INSERT INTO streak_role_gains (user_id, guild_id, role_id, role_name, xp_awarded, timestamp)
+                     VALUES (?, ?, ?, ?, ?, ?)''',
+                  generator.streak_rows(), args.batch_size)
+
+    connection.close()
+    size_mb = os.path.getsize(args.output) / (1024 * 1024)
+    print(f"Done: {args.output} is {size_mb:,.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
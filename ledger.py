@@ -0,0 +1,81 @@
+"""Batched writer for the append-only XP ledger.
+
+Every XP change is recorded as one (guild_id, user_id, delta, source, ref,
+created_at) row, where delta is the change actually applied to the stored XP
+(after clamping at 0), so a user's XP is their latest snapshot plus the sum of
+later deltas. Base XP changes write their rows in the same transaction as the
+change itself (see storage.py), so a crash can't leave XP without its row.
+
+Streak and badge gains are only recorded for reference - replays skip them -
+so losing a few in a crash costs nothing. Those rows are buffered here and
+appended in one transaction per batch, at most max_batch rows or whatever
+arrived within interval seconds, instead of one commit per gain.
+"""
+import asyncio
+import time
+
+
+class LedgerWriter:
+    """Buffers ledger rows and hands them to write(rows) in batches"""
+
+    def __init__(self, write, max_batch: int = 500, interval: float = 1.0):
+        self.write = write
+        self.max_batch = max_batch
+        self.interval = interval  # longest a row waits in memory before it is written
+        self.pending = []
+        self.written = 0
+        self.task = None
+
+    def append(self, guild_id: int, user_id: int, delta: int, source: str, ref: int = None):
+        if not delta:
+            return
+        self.pending.append((guild_id, user_id, delta, source, ref, time.time()))
+        if len(self.pending) >= self.max_batch:
+            self._try_flush()
+        elif self.task is None:
+            try:
+                self.task = asyncio.get_running_loop().create_task(self._flush_later())
+            except RuntimeError:
+                # No event loop (scripts, tests) - nothing would flush later, so write now
+                self._try_flush()
+
+    def pending_count(self) -> int:
+        return len(self.pending)
+
+    @property
+    def tasks(self):
+        return {self.task} if self.task else set()
+
+    def flush(self) -> int:
+        """Write everything buffered now; on failure the rows stay buffered for the next flush"""
+        rows, self.pending = self.pending, []
+        if not rows:
+            return 0
+        try:
+            self.write(rows)
+        except Exception:
+            self.pending[:0] = rows
+            raise
+        self.written += len(rows)
+        return len(rows)
+
+    def close(self):
+        """Stop the timer and write what is left, e.g. on shutdown"""
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        self.flush()
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self.interval)
+        finally:
+            self.task = None
+        self._try_flush()
+
+    def _try_flush(self):
+        # Callers already made the change being recorded, so a failed write must not fail them too
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Could not write {len(self.pending)} XP ledger row(s), retrying with the next batch: {e}")
@@ -0,0 +1,155 @@
+"""Per-channel coalescing of quest completion and opt-in notices.
+
+Instead of one embed per reaction, notices for a channel are collected for a
+short window and sent as one embed listing everyone. Each channel has a token
+bucket kept under Discord's per-channel message limit, and a cap on pending
+notices - past it, new notices are only counted and shown as "...and N more"
+so a reaction storm can't build an ever-growing queue of stale messages.
+"""
+import asyncio
+import time
+from collections import Counter, deque
+
+import discord
+
+# kind -> (title for a single notice, title for several, heading when kinds are mixed, overflow summary)
+NOTICE_KINDS = {
+    "quest": ("Quest Completed!", "Quests Completed!", "🏆 Quests Completed", "...and {} more quest completion(s)"),
+    "optin": ("✅ Welcome to QuestBot!", "✅ Welcome to QuestBot!", "✅ New Members", "...and {} more member(s) opted in"),
+}
+MAX_DESCRIPTION = 3800  # below Discord's 4096, leaving room for the overflow lines
+
+
+class TokenBucket:
+    """rate tokens per second, up to burst saved up"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def delay(self) -> float:
+        """Seconds until a token is available"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class ChannelQueue:
+    def __init__(self, channel, bucket: TokenBucket):
+        self.channel = channel
+        self.bucket = bucket
+        self.pending = deque()  # (kind, text, line)
+        self.dropped = Counter()  # kind -> notices past max_pending, summarized in the next embed
+        self.task = None
+
+
+class NoticeCoalescer:
+    """Collects notices per channel and sends them as combined embeds through send(channel, embed)"""
+
+    def __init__(self, send, window: float = 2.0, rate: float = 1.0, burst: int = 3, max_lines: int = 20,
+                 max_pending: int = 200):
+        self.send = send
+        self.window = window  # how long to collect after the first notice
+        self.rate = rate  # messages per second per channel
+        self.burst = burst
+        self.max_lines = max_lines  # notices listed in one embed
+        self.max_pending = max_pending  # per channel, beyond this notices are only counted
+        self.channels = {}  # channel_id -> ChannelQueue with notices waiting
+        self.sent = 0  # embeds sent
+        self.notices = 0  # notices accepted, including summarized ones
+        self.summarized = 0
+        self._flushing = asyncio.Event()
+
+    def add(self, channel, kind: str, text: str, line: str):
+        """Queue a notice; text is used when it goes out alone, line when it is listed with others"""
+        queue = self.channels.get(channel.id)
+        if queue is None:
+            queue = self.channels[channel.id] = ChannelQueue(channel, TokenBucket(self.rate, self.burst))
+        self.notices += 1
+        if len(queue.pending) >= self.max_pending:
+            queue.dropped[kind] += 1
+            self.summarized += 1
+        else:
+            queue.pending.append((kind, text, line))
+        if queue.task is None:
+            queue.task = asyncio.create_task(self._drain(channel.id, queue))
+
+    def pending_count(self) -> int:
+        return sum(len(queue.pending) for queue in self.channels.values())
+
+    @property
+    def tasks(self):
+        return {queue.task for queue in self.channels.values() if queue.task}
+
+    async def flush(self):
+        """Send everything queued now, skipping the collection window but not the rate limit"""
+        self._flushing.set()
+        try:
+            while self.tasks:
+                await asyncio.gather(*self.tasks, return_exceptions=True)
+        finally:
+            self._flushing.clear()
+
+    def close(self):
+        """Drop queued notices, e.g. on shutdown - they are short-lived messages anyway"""
+        for queue in self.channels.values():
+            if queue.task:
+                queue.task.cancel()
+        self.channels.clear()
+
+    async def _drain(self, channel_id: int, queue: ChannelQueue):
+        try:
+            while queue.pending or queue.dropped:
+                # Collect for a window, then wait for the channel's bucket; notices keep arriving meanwhile
+                try:
+                    await asyncio.wait_for(self._flushing.wait(), self.window)
+                except asyncio.TimeoutError:
+                    pass
+                delay = queue.bucket.delay()
+                if delay:
+                    await asyncio.sleep(delay)
+                queue.bucket.take()
+                embed = self._render(queue)
+                try:
+                    await self.send(queue.channel, embed)
+                    self.sent += 1
+                except Exception as e:
+                    print(f"Could not send notices to channel {channel_id}: {e}")
+        finally:
+            queue.task = None
+            if not queue.pending and not queue.dropped and self.channels.get(channel_id) is queue:
+                del self.channels[channel_id]
+
+    def _render(self, queue: ChannelQueue) -> discord.Embed:
+        """Build one embed from the front of the queue plus the overflow counts, consuming them"""
+        batch = []
+        length = 0
+        while queue.pending and len(batch) < self.max_lines:
+            notice = queue.pending[0]
+            if batch and length + len(notice[2]) + 1 > MAX_DESCRIPTION:
+                break
+            batch.append(queue.pending.popleft())
+            length += len(notice[2]) + 1
+        dropped = queue.dropped
+        queue.dropped = Counter()
+
+        kinds = list(dict.fromkeys([kind for kind, _, _ in batch] + list(dropped)))
+        if len(batch) == 1 and not dropped:
+            kind, text, _ = batch[0]
+            return discord.Embed(title=NOTICE_KINDS[kind][0], description=text, color=0x00ff00)
+        sections = []
+        for kind in kinds:
+            _, _, heading, overflow = NOTICE_KINDS[kind]
+            lines = [line for notice_kind, _, line in batch if notice_kind == kind]
+            if dropped[kind]:
+                lines.append(overflow.format(dropped[kind]))
+            sections.append(lines if len(kinds) == 1 else [f"**{heading}**"] + lines)
+        title = NOTICE_KINDS[kinds[0]][1] if len(kinds) == 1 else "📣 QuestBot Updates"
+        return discord.Embed(title=title, description="\n\n".join("\n".join(lines) for lines in sections),
+                             color=0x00ff00)
@@ -0,0 +1,78 @@
+"""In-memory ranking index backing the leaderboard and -rank.
+
+Each guild keeps its opted-in users in a list sorted by (-total_xp, user_id),
+so page slices and rank lookups are binary searches instead of a full scan
+and sort of the users table.
+"""
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional, Tuple
+
+
+class GuildRanking:
+    """Sorted index of (user_id, total_xp) for one guild"""
+
+    def __init__(self):
+        self._keys: List[Tuple[int, int]] = []  # (-total_xp, user_id), ascending
+        self._totals: Dict[int, int] = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, user_id: int):
+        return user_id in self._totals
+
+    def load(self, rows):
+        """Bulk-load (user_id, total_xp) rows, replacing the current contents"""
+        self._totals = {user_id: total_xp for user_id, total_xp in rows}
+        self._keys = sorted((-total_xp, user_id) for user_id, total_xp in self._totals.items())
+
+    def update(self, user_id: int, total_xp: int):
+        """Insert a user or move them to their new position"""
+        old_total = self._totals.get(user_id)
+        if old_total == total_xp:
+            return
+        if old_total is not None:
+            index = bisect_left(self._keys, (-old_total, user_id))
+            del self._keys[index]
+        insort(self._keys, (-total_xp, user_id))
+        self._totals[user_id] = total_xp
+
+    def remove(self, user_id: int):
+        old_total = self._totals.pop(user_id, None)
+        if old_total is not None:
+            index = bisect_left(self._keys, (-old_total, user_id))
+            del self._keys[index]
+
+    def total(self, user_id: int) -> Optional[int]:
+        return self._totals.get(user_id)
+
+    def page(self, offset: int, limit: int) -> List[Tuple[int, int]]:
+        """Return (user_id, total_xp) rows for positions offset+1 .. offset+limit"""
+        return [(user_id, -neg_total) for neg_total, user_id in self._keys[offset:offset + limit]]
+
+    def rank(self, user_id: int) -> Optional[int]:
+        """1-based leaderboard position, or None if the user is not ranked"""
+        total_xp = self._totals.get(user_id)
+        if total_xp is None:
+            return None
+        return bisect_left(self._keys, (-total_xp, user_id)) + 1
+
+
+class RankingStore:
+    """Per-guild GuildRanking instances, built lazily by QuestBot"""
+
+    def __init__(self):
+        self._guilds: Dict[int, GuildRanking] = {}
+
+    def get(self, guild_id: int) -> Optional[GuildRanking]:
+        return self._guilds.get(guild_id)
+
+    def build(self, guild_id: int, rows) -> GuildRanking:
+        ranking = GuildRanking()
+        ranking.load(rows)
+        self._guilds[guild_id] = ranking
+        return ranking
+
+    def drop(self, guild_id: int):
+        """Forget a guild's index so it is rebuilt on next use"""
+        self._guilds.pop(guild_id, None)
@@ -0,0 +1,275 @@
+"""Gateway event replay harness for load testing the bot.py handlers.
+
+Synthesizes (or loads a recorded) stream of reaction-add and member-update
+events and replays it into `on_reaction_add` and `on_member_update` at a
+configurable rate against a scratch database. Discord models are replaced by
+the stand-ins in fakes.py and every REST call goes to a stub sink.
+
+    # 5,000 people react to one quest within a minute
+    python replay.py --members 6500 --reactors 5000 --duration 60
+
+    # Save a stream and replay it later as fast as possible
+    python replay.py --record storm.ndjson
+    python replay.py --input storm.ndjson --rate 0
+
+    # Same storm entirely in RAM
+    python replay.py --storage memory --rate 0
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+_scratch_dir = tempfile.mkdtemp(prefix="questbot-replay-")
+os.environ.setdefault('QUEST_BOT_DB', os.path.join(_scratch_dir, 'quest_bot.db'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bot as questbot  # noqa: E402
+import storage  # noqa: E402
+from fakes import FakeClient, FakeMessage, FakeReaction, LatencyRecorder, RestSink, build_guild, percentile  # noqa: E402
+
+QUEST_REWARD = 50
+
+
+def synthesize_events(args) -> dict:
+    """Build a reproducible event stream; members and roles are referenced by index"""
+    rng = random.Random(args.seed)
+    events = []
+    for _ in range(args.reactors):
+        events.append({"t": rng.uniform(0, args.duration), "type": "reaction_add",
+                       "member": rng.randrange(args.members), "emoji": "✅"})
+    for _ in range(int(args.reactors * args.duplicate_ratio)):
+        # Re-reacts from people who already reacted must not award XP twice
+        events.append({"t": rng.uniform(0, args.duration), "type": "reaction_add",
+                       "member": events[rng.randrange(args.reactors)]["member"], "emoji": "✅"})
+    for _ in range(args.role_updates):
+        events.append({"t": rng.uniform(0, args.duration), "type": "member_update",
+                       "member": rng.randrange(args.members), "role": rng.randrange(args.roles)})
+    events.sort(key=lambda e: e["t"])
+    return {
+        "header": {"members": args.members, "roles": args.roles, "seed": args.seed, "duration": args.duration},
+        "events": events,
+    }
+
+
+def save_stream(path: str, stream: dict):
+    with open(path, "w", encoding="utf-8") as fh:
+        fh.write(json.dumps(stream["header"]) + "\n")
+        for event in stream["events"]:
+            fh.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+
+def load_stream(path: str) -> dict:
+    with open(path, encoding="utf-8") as fh:
+        header = json.loads(fh.readline())
+        events = [json.loads(line) for line in fh if line.strip()]
+    return {"header": header, "events": events}
+
+
+class ReplayState:
+    def __init__(self, quest_bot, guild, extra, quest_message):
+        self.quest_bot = quest_bot
+        self.guild = guild
+        self.members = guild.members
+        self.gainable_roles = extra["streak_roles"] + extra["badge_roles"] + extra["auto_badge_roles"]
+        self.streak_role_ids = {r.id for r in extra["streak_roles"]}
+        self.quest_message = quest_message
+        self.initial_xp = quest_bot.storage.list_user_xp(guild.id)
+        self.snapshot_id, _ = quest_bot.take_xp_snapshot(guild.id)
+        self.expected_completers = set()
+        self.expected_streak_gains = 0
+
+    def is_opted_in(self, member) -> bool:
+        return any(r.name.startswith("Level ") for r in member.roles)
+
+    def dispatch(self, event: dict):
+        """Turn one recorded event into a handler coroutine, mirroring Client.dispatch"""
+        member = self.members[event["member"] % len(self.members)]
+        if event["type"] == "reaction_add":
+            return self._reaction_add(member, event.get("emoji", "✅"))
+        if event["type"] == "member_update":
+            return self._member_update(member, self.gainable_roles[event["role"] % len(self.gainable_roles)])
+        raise ValueError(f"Unknown event type: {event['type']}")
+
+    # Opt-in status is sampled when the handler starts, the same point the bot checks it
+    async def _reaction_add(self, member, emoji: str):
+        if emoji == "✅" and self.is_opted_in(member):
+            self.expected_completers.add(member.id)
+        await questbot.on_reaction_add(FakeReaction(self.quest_message, emoji), member)
+
+    async def _member_update(self, member, role):
+        before = member.copy()
+        if role not in member.roles:
+            member.roles.append(role)
+            if role.id in self.streak_role_ids and self.is_opted_in(member):
+                self.expected_streak_gains += 1
+        await questbot.on_member_update(before, member)
+
+    def check_consistency(self) -> dict:
+        storage = self.quest_bot.storage
+        completed = storage.get_quest(self.quest_message.id)['completed_users']
+        completed_set = set(completed)
+
+        wrong_xp = 0
+        for user_id, xp in storage.list_user_xp(self.guild.id).items():
+            expected = self.initial_xp.get(user_id, 0) + (QUEST_REWARD if user_id in completed_set else 0)
+            if xp != expected:
+                wrong_xp += 1
+
+        streak_gains = storage.count_streak_gains(self.guild.id)
+        # The ledger replayed from the starting snapshot must land on the same base XP
+        self.quest_bot.ledger.flush()
+        replayed = storage.replay_xp_ledger(self.guild.id, self.snapshot_id)
+        ledger_mismatches = sum(1 for user_id, xp in storage.list_user_xp(self.guild.id).items()
+                                if replayed.get(user_id, 0) != xp)
+
+        return {
+            "completions": len(completed),
+            "expected_completions": len(self.expected_completers),
+            "duplicate_completions": len(completed) - len(completed_set),
+            "missing_completions": len(self.expected_completers - completed_set),
+            "users_with_wrong_xp": wrong_xp,
+            "ledger_mismatches": ledger_mismatches,
+            "streak_gains": streak_gains,
+            "expected_streak_gains": self.expected_streak_gains,
+        }
+
+
+def create_quest(quest_bot, guild) -> FakeMessage:
+    """Post the quest every synthesized reaction targets"""
+    channel = guild.text_channels[0]
+    quest_message = FakeMessage(channel)
+    quest_bot.storage.add_quest(quest_message.id, guild.id, channel.id, "Replay Quest", "React to complete", QUEST_REWARD)
+    return quest_message
+
+
+async def play(state: ReplayState, events: list, rate: float, speed: float = 1.0) -> dict:
+    """Dispatch events into the handlers on schedule and report latency and consistency"""
+    recorder = LatencyRecorder("events")
+    lag = []
+    tasks = []
+
+    async def run_handler(coro, scheduled_at):
+        started = time.perf_counter()
+        lag.append(max(0.0, started - scheduled_at))
+        await coro
+        # Latency is measured from the moment the event was due, like a gateway client sees it
+        recorder.add(time.perf_counter() - scheduled_at)
+
+    recorder.start()
+    loop_start = time.perf_counter()
+    for index, event in enumerate(events):
+        if rate > 0:
+            due = loop_start + index / rate
+        elif rate == 0:
+            due = time.perf_counter()
+        else:
+            due = loop_start + event["t"] / speed
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(run_handler(state.dispatch(event), due)))
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    # Award the queued completion batches, then let spawned role-sync tasks finish before checking the database
+    await state.quest_bot.completions.flush()
+    while state.quest_bot.pending_role_syncs:
+        await asyncio.gather(*list(state.quest_bot.pending_role_syncs), return_exceptions=True)
+    recorder.stop()
+    # Send the coalesced completion notices (outside the measurement) so rest_calls counts them
+    await state.quest_bot.notices.flush()
+
+    summary = recorder.summary()
+    summary["scheduling_lag_p99_ms"] = percentile(lag, 99) * 1000
+    summary["rest_calls"] = dict(state.guild.sink.calls)
+    summary["consistency"] = state.check_consistency()
+    return summary
+
+
+async def replay(stream: dict, args) -> dict:
+    header = stream["header"]
+    db_path = args.db or os.path.join(_scratch_dir, "replay.db")
+    quest_bot = questbot.QuestBot(db_path=db_path, backend=args.storage)
+    if args.storage == "memory" and args.db:
+        # Keep a SQLite copy of the final state for inspection
+        quest_bot.storage.snapshot_path = args.db
+    questbot.quest_bot = quest_bot
+
+    client = FakeClient()
+    client.install(questbot.bot)
+    sink = RestSink(latency=args.rest_latency)
+    guild, extra = build_guild(quest_bot, header["members"], role_count=header["roles"],
+                               seed=header["seed"], sink=sink)
+    client.add_guild(guild)
+
+    state = ReplayState(quest_bot, guild, extra, create_quest(quest_bot, guild))
+    summary = await play(state, stream["events"], args.rate, args.speed)
+    quest_bot.ledger.close()
+    quest_bot.storage.close()
+    return summary
+
+
+def is_consistent(consistency: dict) -> bool:
+    return (consistency["duplicate_completions"] == 0 and consistency["missing_completions"] == 0
+            and consistency["users_with_wrong_xp"] == 0 and consistency["ledger_mismatches"] == 0
+            and consistency["streak_gains"] == consistency["expected_streak_gains"])
+
+
+def print_report(summary: dict):
+    print(f"Events replayed:      {summary['count']:,}")
+    print(f"Sustained rate:       {summary['ops_per_sec']:,.1f} events/s")
+    print(f"Latency p50/p95/p99:  {summary['p50_ms']:.2f} / {summary['p95_ms']:.2f} / {summary['p99_ms']:.2f} ms "
+          f"(max {summary['max_ms']:.2f} ms)")
+    print(f"Scheduling lag p99:   {summary['scheduling_lag_p99_ms']:.2f} ms")
+    print(f"REST calls:           {summary['rest_calls']}")
+    consistency = summary["consistency"]
+    print("DB consistency:")
+    for key, value in consistency.items():
+        print(f"  {key}: {value}")
+    ok = is_consistent(consistency)
+    print("Result: " + ("✅ consistent" if ok else "❌ INCONSISTENT"))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay synthetic gateway events into the bot handlers")
+    parser.add_argument("--input", help="Replay a recorded NDJSON stream instead of synthesizing one")
+    parser.add_argument("--record", help="Write the synthesized stream to this NDJSON file and exit")
+    parser.add_argument("--members", type=int, default=6500)
+    parser.add_argument("--roles", type=int, default=200)
+    parser.add_argument("--reactors", type=int, default=5000, help="Quest reactions to synthesize")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.05,
+                        help="Fraction of extra reactions from people who already reacted")
+    parser.add_argument("--role-updates", type=int, default=500, help="Member-update events to synthesize")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds the synthesized stream spans")
+    parser.add_argument("--rate", type=float, default=-1,
+                        help="Fixed events/s (0 = as fast as possible, negative = follow event timestamps)")
+    parser.add_argument("--speed", type=float, default=1.0, help="Time compression when following timestamps")
+    parser.add_argument("--rest-latency", type=float, default=0.0, help="Simulated REST latency in seconds")
+    parser.add_argument("--db", help="Scratch database path (defaults to a temp file); with --storage memory, "
+                                     "where to write a snapshot of the final state")
+    parser.add_argument("--storage", choices=storage.BACKENDS, default="sqlite", help="Storage backend to replay against")
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+
+    stream = load_stream(args.input) if args.input else synthesize_events(args)
+    if args.record:
+        save_stream(args.record, stream)
+        print(f"Recorded {len(stream['events']):,} events to {args.record}")
+        return
+
+    print(f"Replaying {len(stream['events']):,} events...", file=sys.stderr)
+    with contextlib.redirect_stdout(io.StringIO()):
+        summary = asyncio.run(replay(stream, args))
+    ok = print_report(summary)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Single timer for scheduled quest publishing and expiry.
+
+Every pending job is one (due_time, kind, key) entry in a heap, and one
+background task sleeps until the earliest entry is due - thousands of
+scheduled quests cost a heap entry each instead of an asyncio.sleep task.
+
+Entries are only hints. The handlers re-read the schedule or quest from
+storage before acting, so entries left behind by a removed quest or a
+cancelled schedule are skipped instead of acting on stale data.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from typing import List, Optional, Tuple
+
+PUBLISH = "publish"  # key is a scheduled_quests id
+EXPIRE = "expire"  # key is a quest message id
+
+
+class QuestScheduler:
+    """Heap of due times with a wakeup for entries added ahead of the current earliest one"""
+
+    def __init__(self, max_sleep: float = 60.0):
+        self._heap: List[Tuple[float, int, str, int]] = []
+        self._queued = set()  # (due, kind, key) already in the heap, so reloading a guild adds nothing
+        self._order = itertools.count()  # tie-breaker, keeps equal due times in insertion order
+        self._wakeup = asyncio.Event()
+        self.max_sleep = max_sleep  # re-check at least this often, a backstop against clock jumps
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, due: float, kind: str, key: int):
+        if (due, kind, key) in self._queued:
+            return
+        self._queued.add((due, kind, key))
+        heapq.heappush(self._heap, (due, next(self._order), kind, key))
+        if self._heap[0][2:] == (kind, key):
+            # New earliest entry - the sleeping task has to recompute its timeout
+            self._wakeup.set()
+
+    def next_due(self) -> Optional[float]:
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float = None, limit: int = None) -> List[Tuple[float, str, int]]:
+        """Remove and return (due, kind, key) for entries due by now, earliest first"""
+        now = time.time() if now is None else now
+        due = []
+        while self._heap and self._heap[0][0] <= now and (limit is None or len(due) < limit):
+            when, _, kind, key = heapq.heappop(self._heap)
+            self._queued.discard((when, kind, key))
+            due.append((when, kind, key))
+        return due
+
+    async def wait(self):
+        """Sleep until the earliest entry is due, something earlier is scheduled, or max_sleep passes"""
+        next_due = self.next_due()
+        timeout = self.max_sleep if next_due is None else min(self.max_sleep, next_due - time.time())
+        if timeout <= 0:
+            return
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
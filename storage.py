@@ -0,0 +1,1411 @@
+"""Persistence layer for QuestBot.
+
+QuestBot and the command handlers talk to a Storage object instead of
+running SQL themselves, so the backend can be swapped or tuned without
+touching command code, and the data layer can be profiled on its own.
+
+SQLiteStorage keeps every statement as a module-level constant. sqlite3
+caches prepared statements by their SQL text, so reusing the same strings
+means each statement is compiled once per connection. Lists of IDs are
+passed as one JSON array parameter (json_each) rather than a variable
+number of placeholders, which keeps those statements cacheable too.
+
+InMemoryStorage implements the same operations on dicts and arrays, for
+tests, the replay harness and benchmarks that should not touch disk. It can
+write its contents out as an ordinary SQLite database.
+"""
+import bisect
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import xp_transfer
+
+BACKENDS = ("sqlite", "memory")
+
+# Comfortably above the number of distinct statements below
+STATEMENT_CACHE_SIZE = 256
+
+SCHEMA = [
+    # Users table for XP tracking
+    '''CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        guild_id INTEGER NOT NULL,
+        xp INTEGER DEFAULT 0,
+        level INTEGER DEFAULT 1,
+        UNIQUE(user_id, guild_id)
+    )''',
+    # Active quests
+    '''CREATE TABLE IF NOT EXISTS quests (
+        message_id INTEGER PRIMARY KEY,
+        guild_id INTEGER,
+        channel_id INTEGER,
+        title TEXT,
+        content TEXT,
+        completed_users TEXT DEFAULT '[]',
+        xp_reward INTEGER DEFAULT 50,
+        expires_at REAL
+    )''',
+    'CREATE INDEX IF NOT EXISTS idx_quests_guild ON quests (guild_id)',
+    # Ended and removed quests with their completions, kept out of the hot table for history and audits
+    '''CREATE TABLE IF NOT EXISTS quests_archive (
+        message_id INTEGER PRIMARY KEY,
+        guild_id INTEGER,
+        channel_id INTEGER,
+        title TEXT,
+        content TEXT,
+        completed_users TEXT DEFAULT '[]',
+        xp_reward INTEGER,
+        expires_at REAL,
+        archived_at REAL NOT NULL,
+        archive_reason TEXT
+    )''',
+    'CREATE INDEX IF NOT EXISTS idx_quests_archive_guild ON quests_archive (guild_id, archived_at)',
+    # Quests waiting to be posted; recurring ones move next_start forward after each posting
+    '''CREATE TABLE IF NOT EXISTS scheduled_quests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        guild_id INTEGER NOT NULL,
+        channel_id INTEGER NOT NULL,
+        title TEXT,
+        content TEXT,
+        xp_reward INTEGER DEFAULT 50,
+        next_start REAL NOT NULL,
+        duration REAL,
+        repeat_every REAL,
+        created_by INTEGER,
+        created_at REAL
+    )''',
+    'CREATE INDEX IF NOT EXISTS idx_scheduled_quests_guild ON scheduled_quests (guild_id)',
+    # XP per role, one row per assignment (older databases kept these as JSON on the settings row)
+    '''CREATE TABLE IF NOT EXISTS role_xp (
+        guild_id INTEGER NOT NULL,
+        role_id INTEGER NOT NULL,
+        xp INTEGER NOT NULL,
+        type TEXT NOT NULL DEFAULT 'badge',
+        PRIMARY KEY (guild_id, role_id)
+    ) WITHOUT ROWID''',
+    # Channel restrictions
+    '''CREATE TABLE IF NOT EXISTS whitelisted_channels (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        guild_id INTEGER NOT NULL,
+        channel_id INTEGER NOT NULL,
+        channel_name TEXT,
+        UNIQUE(guild_id, channel_id)
+    )''',
+    # Bot configuration
+    '''CREATE TABLE IF NOT EXISTS settings (
+        guild_id INTEGER PRIMARY KEY,
+        quest_ping_role_id INTEGER,
+        quest_channel_id INTEGER,
+        role_xp_assignments TEXT DEFAULT '{}'
+    )''',
+    # Streak role accumulation
+    '''CREATE TABLE IF NOT EXISTS streak_role_gains (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        guild_id INTEGER,
+        role_id INTEGER,
+        role_name TEXT,
+        xp_awarded INTEGER,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''',
+    'CREATE INDEX IF NOT EXISTS idx_streak_role_gains_guild_user ON streak_role_gains (guild_id, user_id)',
+    # Streak role names, stored once instead of on every gain row
+    '''CREATE TABLE IF NOT EXISTS streak_roles (
+        guild_id INTEGER NOT NULL,
+        role_id INTEGER NOT NULL,
+        role_name TEXT,
+        PRIMARY KEY (guild_id, role_id)
+    )''',
+    # Compacted streak history - old gain rows rolled up per user and role
+    '''CREATE TABLE IF NOT EXISTS streak_role_totals (
+        guild_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        role_id INTEGER NOT NULL,
+        gains INTEGER NOT NULL DEFAULT 0,
+        xp_total INTEGER NOT NULL DEFAULT 0,
+        last_gain DATETIME,
+        PRIMARY KEY (guild_id, user_id, role_id)
+    ) WITHOUT ROWID''',
+    # Append-only record of every XP change; delta is the change actually applied to users.xp
+    '''CREATE TABLE IF NOT EXISTS xp_ledger (
+        id INTEGER PRIMARY KEY,
+        guild_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        delta INTEGER NOT NULL,
+        source TEXT NOT NULL,
+        ref INTEGER,
+        created_at REAL NOT NULL
+    )''',
+    'CREATE INDEX IF NOT EXISTS idx_xp_ledger_guild ON xp_ledger (guild_id, id)',
+    'CREATE INDEX IF NOT EXISTS idx_xp_ledger_user ON xp_ledger (guild_id, user_id, id)',
+    # Base XP materialized as of a ledger row, so a rebuild only replays the rows after it
+    '''CREATE TABLE IF NOT EXISTS xp_snapshots (
+        guild_id INTEGER NOT NULL,
+        ledger_id INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        users INTEGER NOT NULL,
+        PRIMARY KEY (guild_id, ledger_id)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS xp_snapshot_users (
+        guild_id INTEGER NOT NULL,
+        ledger_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        xp INTEGER NOT NULL,
+        PRIMARY KEY (guild_id, ledger_id, user_id)
+    ) WITHOUT ROWID''',
+    # Cross-process cache invalidation - workers poll for rows newer than the last one they saw
+    '''CREATE TABLE IF NOT EXISTS cache_invalidations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        guild_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        source TEXT,
+        created_at REAL NOT NULL
+    )''',
+    # Worker heartbeats, aggregated into one health view by cluster.py
+    '''CREATE TABLE IF NOT EXISTS cluster_status (
+        worker_id TEXT PRIMARY KEY,
+        pid INTEGER,
+        shard_ids TEXT,
+        updated_at REAL,
+        report TEXT
+    )''',
+]
+
+# Users
+SELECT_USER = 'SELECT xp, level FROM users WHERE user_id = ? AND guild_id = ?'
+INSERT_USER = 'INSERT OR IGNORE INTO users (user_id, guild_id, xp, level) VALUES (?, ?, ?, ?)'
+UPDATE_USER_XP = 'UPDATE users SET xp = ? WHERE user_id = ? AND guild_id = ?'
+ADD_USER_XP = 'UPDATE users SET xp = MAX(0, xp + ?) WHERE user_id = ? AND guild_id = ?'
+SET_USER_XP = 'UPDATE users SET xp = MAX(0, ?) WHERE user_id = ? AND guild_id = ?'
+UPDATE_USER_LEVEL = 'UPDATE users SET level = ? WHERE user_id = ? AND guild_id = ?'
+SELECT_USER_IDS = 'SELECT user_id FROM users WHERE guild_id = ?'
+SELECT_GUILD_XP = 'SELECT user_id, xp FROM users WHERE guild_id = ?'
+SELECT_GUILD_LEVELS = 'SELECT user_id, level FROM users WHERE guild_id = ?'
+SELECT_USERS_XP = 'SELECT user_id, xp FROM users WHERE guild_id = ? AND user_id IN (SELECT value FROM json_each(?))'
+SELECT_USERS_LEVEL = 'SELECT user_id, level FROM users WHERE guild_id = ? AND user_id IN (SELECT value FROM json_each(?))'
+
+# Quests and completions
+INSERT_QUEST = '''INSERT INTO quests (message_id, guild_id, channel_id, title, content, completed_users, xp_reward, expires_at)
+                  VALUES (?, ?, ?, ?, ?, '[]', ?, ?)'''
+SELECT_QUEST = 'SELECT guild_id, channel_id, title, completed_users, xp_reward, expires_at FROM quests WHERE message_id = ?'
+SELECT_EXPIRING_QUESTS = 'SELECT message_id, expires_at FROM quests WHERE guild_id = ? AND expires_at IS NOT NULL'
+SELECT_GUILD_QUESTS = 'SELECT message_id, channel_id, title FROM quests WHERE guild_id = ?'
+# Archiving copies rows into quests_archive and deletes them from quests in one transaction
+QUEST_COLUMNS = 'message_id, guild_id, channel_id, title, content, completed_users, xp_reward, expires_at'
+ARCHIVE_QUESTS = f'''INSERT OR REPLACE INTO quests_archive ({QUEST_COLUMNS}, archived_at, archive_reason)
+                     SELECT {QUEST_COLUMNS}, ?2, ?3 FROM quests WHERE message_id IN (SELECT value FROM json_each(?1))'''
+DELETE_QUESTS = 'DELETE FROM quests WHERE message_id IN (SELECT value FROM json_each(?))'
+SELECT_ARCHIVED_QUESTS = '''SELECT message_id, channel_id, title, COALESCE(json_array_length(completed_users), 0), xp_reward,
+                                 archived_at, archive_reason
+                          FROM quests_archive WHERE guild_id = ?
+                          ORDER BY archived_at DESC, message_id DESC LIMIT ? OFFSET ?'''
+COUNT_ARCHIVED_QUESTS = 'SELECT COUNT(*) FROM quests_archive WHERE guild_id = ?'
+# Read and rewritten under one write lock by complete_quest
+SELECT_COMPLETED_USERS = 'SELECT guild_id, completed_users FROM quests WHERE message_id = ?'
+UPDATE_COMPLETED_USERS = 'UPDATE quests SET completed_users = ? WHERE message_id = ?'
+
+# Scheduled quests
+INSERT_SCHEDULED_QUEST = '''INSERT INTO scheduled_quests
+                            (guild_id, channel_id, title, content, xp_reward, next_start, duration, repeat_every,
+                             created_by, created_at)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+SCHEDULED_QUEST_COLUMNS = '''id, guild_id, channel_id, title, content, xp_reward, next_start, duration, repeat_every,
+                             created_by, created_at'''
+SCHEDULED_QUEST_FIELDS = [column.strip() for column in SCHEDULED_QUEST_COLUMNS.split(',')]
+SELECT_SCHEDULED_QUEST = f'SELECT {SCHEDULED_QUEST_COLUMNS} FROM scheduled_quests WHERE id = ?'
+SELECT_GUILD_SCHEDULED_QUESTS = f'SELECT {SCHEDULED_QUEST_COLUMNS} FROM scheduled_quests WHERE guild_id = ? ORDER BY next_start'
+UPDATE_SCHEDULED_QUEST_START = 'UPDATE scheduled_quests SET next_start = ? WHERE id = ?'
+DELETE_SCHEDULED_QUEST = 'DELETE FROM scheduled_quests WHERE id = ?'
+
+# Streak gains
+UPSERT_STREAK_ROLE = '''INSERT INTO streak_roles (guild_id, role_id, role_name) VALUES (?, ?, ?)
+                        ON CONFLICT(guild_id, role_id) DO UPDATE SET role_name = excluded.role_name
+                        WHERE role_name IS NOT excluded.role_name'''
+INSERT_STREAK_GAIN = 'INSERT INTO streak_role_gains (user_id, guild_id, role_id, xp_awarded) VALUES (?, ?, ?, ?)'
+SELECT_STREAK_XP = '''SELECT (SELECT COALESCE(SUM(xp_awarded), 0) FROM streak_role_gains WHERE guild_id = ?1 AND user_id = ?2)
+                           + (SELECT COALESCE(SUM(xp_total), 0) FROM streak_role_totals WHERE guild_id = ?1 AND user_id = ?2)'''
+SELECT_STREAK_XP_BULK = '''SELECT user_id, SUM(xp) FROM (
+                               SELECT user_id, xp_awarded AS xp FROM streak_role_gains
+                               WHERE guild_id = ?1 AND user_id IN (SELECT value FROM json_each(?2))
+                               UNION ALL
+                               SELECT user_id, xp_total FROM streak_role_totals
+                               WHERE guild_id = ?1 AND user_id IN (SELECT value FROM json_each(?2))
+                           ) GROUP BY user_id'''
+COUNT_STREAK_GAINS = 'SELECT COUNT(*) FROM streak_role_gains WHERE guild_id = ?'
+SELECT_XP_SOURCES = '''SELECT (SELECT COALESCE(MAX(xp), 0) FROM users WHERE user_id = ?2 AND guild_id = ?1),
+                              (SELECT COALESCE(SUM(xp_awarded), 0) FROM streak_role_gains WHERE guild_id = ?1 AND user_id = ?2)
+                              + (SELECT COALESCE(SUM(xp_total), 0) FROM streak_role_totals WHERE guild_id = ?1 AND user_id = ?2)'''
+
+# Settings
+SELECT_SETTINGS = '''SELECT quest_ping_role_id, quest_channel_id, optin_message_id, optin_channel_id
+                     FROM settings WHERE guild_id = ?'''
+REPLACE_SETTINGS = '''INSERT OR REPLACE INTO settings
+                      (guild_id, quest_ping_role_id, quest_channel_id, optin_message_id, optin_channel_id)
+                      VALUES (?, ?, ?, ?, ?)'''
+
+# Role XP assignments
+SELECT_ROLE_XP = 'SELECT role_id, xp, type FROM role_xp WHERE guild_id = ?'
+UPSERT_ROLE_XP = '''INSERT INTO role_xp (guild_id, role_id, xp, type) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(guild_id, role_id) DO UPDATE SET xp = excluded.xp, type = excluded.type'''
+DELETE_ROLE_XP = 'DELETE FROM role_xp WHERE guild_id = ? AND role_id = ?'
+
+# Whitelisted channels
+REPLACE_WHITELISTED = 'INSERT OR REPLACE INTO whitelisted_channels (guild_id, channel_id, channel_name) VALUES (?, ?, ?)'
+DELETE_WHITELISTED = 'DELETE FROM whitelisted_channels WHERE guild_id = ? AND channel_id = ?'
+SELECT_WHITELISTED = 'SELECT channel_id, channel_name FROM whitelisted_channels WHERE guild_id = ?'
+CLEAR_WHITELISTED = 'DELETE FROM whitelisted_channels WHERE guild_id = ?'
+
+# XP ledger and snapshots
+INSERT_LEDGER = 'INSERT INTO xp_ledger (guild_id, user_id, delta, source, ref, created_at) VALUES (?, ?, ?, ?, ?, ?)'
+SELECT_USER_LEDGER = '''SELECT id, delta, source, ref, created_at FROM xp_ledger
+                        WHERE guild_id = ? AND user_id = ? ORDER BY id DESC LIMIT ?'''
+SELECT_LAST_LEDGER_ID = 'SELECT COALESCE(MAX(id), 0) FROM xp_ledger'
+SELECT_SNAPSHOTS = 'SELECT ledger_id FROM xp_snapshots WHERE guild_id = ? ORDER BY ledger_id DESC'
+INSERT_SNAPSHOT = 'INSERT OR REPLACE INTO xp_snapshots (guild_id, ledger_id, created_at, users) VALUES (?, ?, ?, ?)'
+INSERT_SNAPSHOT_USERS = '''INSERT OR REPLACE INTO xp_snapshot_users (guild_id, ledger_id, user_id, xp)
+                           SELECT guild_id, ?2, user_id, xp FROM users WHERE guild_id = ?1'''
+DELETE_OLD_SNAPSHOTS = 'DELETE FROM xp_snapshots WHERE guild_id = ? AND ledger_id < ?'
+DELETE_OLD_SNAPSHOT_USERS = 'DELETE FROM xp_snapshot_users WHERE guild_id = ? AND ledger_id < ?'
+
+# Streak and badge rows are a record only - streak XP lives in streak_role_gains, badge XP comes from roles
+LEDGER_RECORD_ONLY_SOURCES = ("streak", "badge")
+REPLAY_XP_LEDGER = f'''SELECT user_id, SUM(xp) FROM (
+                           SELECT user_id, xp FROM xp_snapshot_users WHERE guild_id = ?1 AND ledger_id = ?2
+                           UNION ALL
+                           SELECT user_id, delta FROM xp_ledger
+                           WHERE guild_id = ?1 AND id > ?2 AND source NOT IN {LEDGER_RECORD_ONLY_SOURCES}
+                           AND id NOT IN (SELECT value FROM json_each(?3))
+                       ) GROUP BY user_id'''
+
+# Cache invalidations and heartbeats
+INSERT_INVALIDATION = 'INSERT INTO cache_invalidations (guild_id, kind, source, created_at) VALUES (?, ?, ?, ?)'
+SELECT_LAST_INVALIDATION = 'SELECT COALESCE(MAX(id), 0) FROM cache_invalidations'
+SELECT_INVALIDATIONS = 'SELECT id, guild_id, kind, source FROM cache_invalidations WHERE id > ? ORDER BY id'
+DELETE_OLD_INVALIDATIONS = 'DELETE FROM cache_invalidations WHERE created_at < ?'
+REPLACE_HEARTBEAT = '''INSERT OR REPLACE INTO cluster_status (worker_id, pid, shard_ids, updated_at, report)
+                       VALUES (?, ?, ?, ?, ?)'''
+
+# Streak compaction, one id window per transaction
+SELECT_BATCH_END = 'SELECT MAX(id) FROM (SELECT id FROM streak_role_gains WHERE id > ? ORDER BY id LIMIT ?)'
+# Keep the names carried by legacy rows before they are deleted
+COMPACT_ROLE_NAMES = '''INSERT OR IGNORE INTO streak_roles (guild_id, role_id, role_name)
+                        SELECT guild_id, role_id, MAX(role_name) FROM streak_role_gains
+                        WHERE id > ? AND id <= ? AND timestamp < ? AND role_name IS NOT NULL
+                        GROUP BY guild_id, role_id'''
+COMPACT_TOTALS = '''INSERT INTO streak_role_totals (guild_id, user_id, role_id, gains, xp_total, last_gain)
+                    SELECT guild_id, user_id, role_id, COUNT(*), COALESCE(SUM(xp_awarded), 0), MAX(timestamp)
+                    FROM streak_role_gains
+                    WHERE id > ? AND id <= ? AND timestamp < ?
+                    GROUP BY guild_id, user_id, role_id
+                    ON CONFLICT(guild_id, user_id, role_id) DO UPDATE SET
+                        gains = gains + excluded.gains,
+                        xp_total = xp_total + excluded.xp_total,
+                        last_gain = MAX(COALESCE(last_gain, ''), excluded.last_gain)'''
+COMPACT_DELETE = 'DELETE FROM streak_role_gains WHERE id > ? AND id <= ? AND timestamp < ?'
+
+
+def _ledger_rows(guild_id: int, old_xp: Dict[int, int], changes: Dict[int, int], mode: str, source: str, ref: int):
+    """xp_ledger rows for the base XP changes apply_xp_changes makes, skipping ones that change nothing"""
+    now = time.time()
+    rows = []
+    for user_id, amount in changes.items():
+        old = old_xp.get(user_id, 0)
+        delta = max(0, amount if mode == "set" else old + amount) - old
+        if delta:
+            rows.append((guild_id, user_id, delta, source, ref, now))
+    return rows
+
+
+class Storage(ABC):
+    """Operations QuestBot needs from a backend; all IDs are ints"""
+
+    # Database file for tools that work on it directly (backups, export/import), None if there is none
+    db_path = None
+
+    # Users
+    @abstractmethod
+    def get_user(self, user_id: int, guild_id: int) -> Optional[Tuple[int, int]]:
+        """(xp, level) for a user, or None if they have no row"""
+
+    @abstractmethod
+    def ensure_user(self, user_id: int, guild_id: int) -> bool:
+        """Create a user at 0 XP / level 1 if missing, returns True if a row was created"""
+
+    @abstractmethod
+    def add_users(self, rows: Iterable[Tuple[int, int, int, int]]):
+        """Insert (user_id, guild_id, xp, level) rows, skipping users that already exist"""
+
+    @abstractmethod
+    def set_user_xp(self, user_id: int, guild_id: int, xp: int, source: str = None, ref: int = None):
+        """Store a user's base XP; with a source, the change is appended to the XP ledger in the same transaction"""
+
+    @abstractmethod
+    def set_user_level(self, user_id: int, guild_id: int, level: int):
+        """Store a user's level"""
+
+    @abstractmethod
+    def set_user_levels(self, guild_id: int, levels: Iterable[Tuple[int, int]]):
+        """Store many (user_id, level) pairs in one transaction"""
+
+    @abstractmethod
+    def apply_xp_changes(self, guild_id: int, changes: Dict[int, int], mode: str = "add", source: str = None,
+                         ref: int = None) -> Dict[int, int]:
+        """Add ("add") or set ("set") base XP for many users in one transaction, never below 0
+
+        Missing users are created first. With a source, the changes actually applied are appended
+        to the XP ledger in the same transaction. Returns the levels stored before the change.
+        """
+
+    @abstractmethod
+    def get_users_xp(self, guild_id: int, user_ids: List[int]) -> Dict[int, int]:
+        """Base XP for the given users that have a row"""
+
+    @abstractmethod
+    def list_user_ids(self, guild_id: int) -> List[int]:
+        """IDs of every user with a row in the guild"""
+
+    @abstractmethod
+    def list_user_xp(self, guild_id: int) -> Dict[int, int]:
+        """Base XP for every user in a guild"""
+
+    @abstractmethod
+    def list_user_levels(self, guild_id: int) -> Dict[int, int]:
+        """Stored level for every user in a guild"""
+
+    # Quests and completions
+    @abstractmethod
+    def add_quest(self, message_id: int, guild_id: int, channel_id: int, title: str, content: str, xp_reward: int,
+                  expires_at: float = None):
+        """Store a newly posted quest with no completions"""
+
+    @abstractmethod
+    def get_quest(self, message_id: int) -> Optional[dict]:
+        """guild_id, channel_id, title, completed_users, xp_reward and expires_at for a quest message, or None"""
+
+    @abstractmethod
+    def list_quests(self, guild_id: int) -> List[Tuple[int, int, str]]:
+        """(message_id, channel_id, title) for every active quest in a guild"""
+
+    @abstractmethod
+    def archive_quests(self, message_ids: List[int], reason: str) -> int:
+        """Move quests and their completions to the archive, returns how many were active"""
+
+    @abstractmethod
+    def list_archived_quests(self, guild_id: int, limit: int, offset: int = 0) -> List[tuple]:
+        """(message_id, channel_id, title, completions, xp_reward, archived_at, reason), newest first"""
+
+    @abstractmethod
+    def count_archived_quests(self, guild_id: int) -> int:
+        """Number of the guild's archived quests"""
+
+    @abstractmethod
+    def complete_quest(self, message_id: int, user_ids: List[int], xp_reward: int) -> Dict[int, int]:
+        """Record completions for a batch of users and add xp_reward to the base XP of those completing it for the first
+        time, with their "quest" ledger rows, in one transaction; returns {user_id: level before the award} for those
+        users only"""
+
+    @abstractmethod
+    def list_expiring_quests(self, guild_id: int) -> List[Tuple[int, float]]:
+        """(message_id, expires_at) for a guild's quests that have an end time"""
+
+    # Scheduled quests
+    @abstractmethod
+    def add_scheduled_quest(self, guild_id: int, channel_id: int, title: str, content: str, xp_reward: int,
+                            next_start: float, duration: float = None, repeat_every: float = None,
+                            created_by: int = None) -> int:
+        """Store a quest to post at next_start, returns its schedule ID"""
+
+    @abstractmethod
+    def get_scheduled_quest(self, schedule_id: int) -> Optional[dict]:
+        """A scheduled quest as a dict of SCHEDULED_QUEST_FIELDS, or None"""
+
+    @abstractmethod
+    def list_scheduled_quests(self, guild_id: int) -> List[dict]:
+        """A guild's scheduled quests, soonest first"""
+
+    @abstractmethod
+    def set_scheduled_quest_start(self, schedule_id: int, next_start: float):
+        """Move a scheduled quest's next posting to next_start"""
+
+    @abstractmethod
+    def delete_scheduled_quest(self, schedule_id: int) -> bool:
+        """Remove a scheduled quest, returns True if it existed"""
+
+    # Streak gains
+    @abstractmethod
+    def record_streak_gain(self, user_id: int, guild_id: int, role_id: int, role_name: str, xp_awarded: int):
+        """Record one streak role gain and the XP it awarded"""
+
+    @abstractmethod
+    def get_streak_xp(self, user_id: int, guild_id: int) -> int:
+        """Streak XP from recent gains plus compacted history"""
+
+    @abstractmethod
+    def get_streak_xp_bulk(self, guild_id: int, user_ids: List[int]) -> Dict[int, int]:
+        """Accumulated streak XP for many users, recent gains plus compacted totals"""
+
+    @abstractmethod
+    def count_streak_gains(self, guild_id: int) -> int:
+        """Uncompacted gain rows for a guild"""
+
+    @abstractmethod
+    def get_xp_sources(self, user_id: int, guild_id: int) -> Tuple[int, int]:
+        """(base XP, streak XP) for one user in a single lookup, 0 for users with no record"""
+
+    # Settings
+    @abstractmethod
+    def load_settings(self, guild_id: int) -> Optional[dict]:
+        """Stored settings for a guild, or None"""
+
+    @abstractmethod
+    def save_settings(self, guild_id: int, settings: dict):
+        """Store the guild's quest ping role, quest channel and opt-in message IDs"""
+
+    # Role XP assignments
+    @abstractmethod
+    def list_role_xp(self, guild_id: int) -> Dict[str, dict]:
+        """{role_id as a string: {"xp": amount, "type": "badge"|"streak"}} for a guild"""
+
+    @abstractmethod
+    def set_role_xp(self, guild_id: int, role_id: int, xp: int, role_type: str):
+        """Assign XP and a type (badge or streak) to one role"""
+
+    @abstractmethod
+    def delete_role_xp(self, guild_id: int, role_id: int) -> bool:
+        """Remove a role's XP assignment, returns True if it had one"""
+
+    # Whitelisted channels
+    @abstractmethod
+    def add_whitelisted_channel(self, guild_id: int, channel_id: int, channel_name: str):
+        """Allow the bot to post in a channel"""
+
+    @abstractmethod
+    def remove_whitelisted_channel(self, guild_id: int, channel_id: int) -> bool:
+        """Remove a channel from the whitelist, returns True if it was on it"""
+
+    @abstractmethod
+    def list_whitelisted_channels(self, guild_id: int) -> List[Tuple[int, str]]:
+        """(channel_id, channel_name) for the guild's whitelisted channels"""
+
+    @abstractmethod
+    def clear_whitelisted_channels(self, guild_id: int) -> int:
+        """Remove every whitelisted channel, returns how many there were"""
+
+    # XP ledger
+    @abstractmethod
+    def append_xp_ledger(self, rows: List[tuple]):
+        """Append (guild_id, user_id, delta, source, ref, created_at) rows in one transaction"""
+
+    @abstractmethod
+    def list_xp_ledger(self, guild_id: int, user_id: int, limit: int) -> List[tuple]:
+        """A user's newest ledger rows as (id, delta, source, ref, created_at)"""
+
+    @abstractmethod
+    def take_xp_snapshot(self, guild_id: int, keep: int) -> Tuple[int, int]:
+        """Copy every user's base XP as of the newest ledger row and keep the newest `keep` (at least 1)
+        snapshots, returns (ledger_id, users)"""
+
+    @abstractmethod
+    def list_xp_snapshots(self, guild_id: int) -> List[int]:
+        """Ledger ids a guild has snapshots at, newest first"""
+
+    @abstractmethod
+    def replay_xp_ledger(self, guild_id: int, snapshot_id: int, exclude_ids: Iterable[int] = ()) -> Dict[int, int]:
+        """Base XP per user rebuilt from a snapshot plus the ledger rows after it, skipping exclude_ids"""
+
+    @abstractmethod
+    def compare_xp_ledger(self, guild_id: int, snapshot_id: int,
+                          exclude_ids: Iterable[int] = ()) -> Tuple[Dict[int, int], Dict[int, int]]:
+        """(replayed, stored) base XP per user read at one point in time; safe on a worker thread"""
+
+    # Cross-process coordination
+    @abstractmethod
+    def publish_invalidation(self, guild_id: int, kind: str, source: str):
+        """Tell other processes to drop or reload what they cache for a guild"""
+
+    @abstractmethod
+    def last_invalidation_id(self) -> int:
+        """Newest cache_invalidations row id, 0 if there is none"""
+
+    @abstractmethod
+    def invalidations_since(self, last_id: int) -> List[Tuple[int, int, str, str]]:
+        """(id, guild_id, kind, source) rows newer than last_id, oldest first"""
+
+    @abstractmethod
+    def prune_invalidations(self, older_than: float):
+        """Delete invalidations created before older_than"""
+
+    @abstractmethod
+    def write_heartbeat(self, worker_id: str, shard_ids, report: dict):
+        """Record a cluster worker's shards and health report"""
+
+    # Maintenance
+    @abstractmethod
+    def probe(self, timeout: float = 1.0) -> float:
+        """Round-trip time in ms of a minimal write transaction"""
+
+    @abstractmethod
+    def compact_streak_history(self, max_age_days: float, batch_size: int = 5000, vacuum_pages: int = 2000) -> dict:
+        """Roll streak gains older than max_age_days into per-role totals, returns a summary"""
+
+    @abstractmethod
+    def vacuum(self):
+        """Rebuild the database file to release free pages"""
+
+    @abstractmethod
+    def close(self):
+        """Release the backend; the in-memory backend writes its snapshot here if one is configured"""
+
+
+class SQLiteStorage(Storage):
+    def __init__(self, db_path: str, busy_timeout: float = 5.0):
+        self.db_path = db_path
+        # The timeout is SQLite's busy_timeout - wait for another process's write instead of failing
+        self.connection = sqlite3.connect(db_path, timeout=busy_timeout, cached_statements=STATEMENT_CACHE_SIZE)
+        self.create_schema()
+
+    def create_schema(self):
+        """Create tables and run migrations on older databases"""
+        cursor = self.connection.cursor()
+        # Lets streak compaction hand freed pages back to the OS; only takes effect on a new
+        # database (existing files are converted by -compactstreaks full)
+        cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        # WAL lets readers in every worker process run alongside the single writer
+        cursor.execute('PRAGMA journal_mode = WAL')
+        cursor.execute('PRAGMA synchronous = NORMAL')
+        for statement in SCHEMA:
+            cursor.execute(statement)
+
+        # Add xp_reward column to existing tables if it doesn't exist
+        try:
+            cursor.execute('ALTER TABLE quests ADD COLUMN xp_reward INTEGER DEFAULT 50')
+        except sqlite3.OperationalError:
+            # Column already exists, ignore error
+            pass
+        # Backfill old quests without xp_reward to use default 50 XP
+        cursor.execute('UPDATE quests SET xp_reward = 50 WHERE xp_reward IS NULL')
+        # End time for quests posted with a schedule; NULL means the quest stays open
+        try:
+            cursor.execute('ALTER TABLE quests ADD COLUMN expires_at REAL')
+        except sqlite3.OperationalError:
+            pass
+
+        # Migrate settings table to add new columns if they don't exist
+        try:
+            cursor.execute("PRAGMA table_info(settings)")
+            columns = [row[1] for row in cursor.fetchall()]
+            if 'optin_message_id' not in columns:
+                cursor.execute('ALTER TABLE settings ADD COLUMN optin_message_id INTEGER')
+                print("Added optin_message_id column to settings table")
+            if 'optin_channel_id' not in columns:
+                cursor.execute('ALTER TABLE settings ADD COLUMN optin_channel_id INTEGER')
+                print("Added optin_channel_id column to settings table")
+        except Exception as e:
+            print(f"Database migration warning: {e}")
+        self.connection.commit()
+        # Role XP assignments used to be one JSON object on the settings row
+        moved = xp_transfer.migrate_role_xp_assignments(self.connection)
+        if moved:
+            print(f"Moved {moved} role XP assignment(s) from settings to the role_xp table")
+
+    # Users
+    def get_user(self, user_id, guild_id):
+        return self.connection.execute(SELECT_USER, (user_id, guild_id)).fetchone()
+
+    def ensure_user(self, user_id, guild_id):
+        with self.connection:
+            return self.connection.execute(INSERT_USER, (user_id, guild_id, 0, 1)).rowcount > 0
+
+    def add_users(self, rows):
+        with self.connection:
+            self.connection.executemany(INSERT_USER, rows)
+
+    def set_user_xp(self, user_id, guild_id, xp, source=None, ref=None):
+        with self.connection:
+            if source:
+                self.connection.execute('BEGIN IMMEDIATE')
+                row = self.connection.execute(SELECT_USER, (user_id, guild_id)).fetchone()
+                if row:
+                    self.connection.executemany(INSERT_LEDGER, _ledger_rows(guild_id, {user_id: row[0]}, {user_id: xp},
+                                                                            "set", source, ref))
+            self.connection.execute(UPDATE_USER_XP, (xp, user_id, guild_id))
+
+    def set_user_level(self, user_id, guild_id, level):
+        with self.connection:
+            self.connection.execute(UPDATE_USER_LEVEL, (level, user_id, guild_id))
+
+    def set_user_levels(self, guild_id, levels):
+        with self.connection:
+            self.connection.executemany(UPDATE_USER_LEVEL, [(level, user_id, guild_id) for user_id, level in levels])
+
+    def apply_xp_changes(self, guild_id, changes, mode="add", source=None, ref=None):
+        user_ids = json.dumps(list(changes))
+        with self.connection:
+            if source:
+                # Old XP and the update have to see the same rows for the ledger deltas to add up
+                self.connection.execute('BEGIN IMMEDIATE')
+            self.connection.executemany(INSERT_USER, [(user_id, guild_id, 0, 1) for user_id in changes])
+            old_levels = dict(self.connection.execute(SELECT_USERS_LEVEL, (guild_id, user_ids)).fetchall())
+            if source:
+                old_xp = dict(self.connection.execute(SELECT_USERS_XP, (guild_id, user_ids)).fetchall())
+                self.connection.executemany(INSERT_LEDGER, _ledger_rows(guild_id, old_xp, changes, mode, source, ref))
+            self.connection.executemany(SET_USER_XP if mode == "set" else ADD_USER_XP,
+                                        [(amount, user_id, guild_id) for user_id, amount in changes.items()])
+        return old_levels
+
+    def get_users_xp(self, guild_id, user_ids):
+        if not user_ids:
+            return {}
+        return dict(self.connection.execute(SELECT_USERS_XP, (guild_id, json.dumps(list(user_ids)))).fetchall())
+
+    def list_user_ids(self, guild_id):
+        return [user_id for (user_id,) in self.connection.execute(SELECT_USER_IDS, (guild_id,))]
+
+    def list_user_xp(self, guild_id):
+        return dict(self.connection.execute(SELECT_GUILD_XP, (guild_id,)).fetchall())
+
+    def list_user_levels(self, guild_id):
+        return dict(self.connection.execute(SELECT_GUILD_LEVELS, (guild_id,)).fetchall())
+
+    # Quests and completions
+    def add_quest(self, message_id, guild_id, channel_id, title, content, xp_reward, expires_at=None):
+        with self.connection:
+            self.connection.execute(INSERT_QUEST, (message_id, guild_id, channel_id, title, content, xp_reward,
+                                                   expires_at))
+
+    def get_quest(self, message_id):
+        row = self.connection.execute(SELECT_QUEST, (message_id,)).fetchone()
+        if not row:
+            return None
+        guild_id, channel_id, title, completed_users, xp_reward, expires_at = row
+        return {
+            'guild_id': guild_id,
+            'channel_id': channel_id,
+            'title': title,
+            'completed_users': json.loads(completed_users or '[]'),
+            'xp_reward': xp_reward,
+            'expires_at': expires_at,
+        }
+
+    def list_quests(self, guild_id):
+        return self.connection.execute(SELECT_GUILD_QUESTS, (guild_id,)).fetchall()
+
+    def archive_quests(self, message_ids, reason):
+        if not message_ids:
+            return 0
+        message_ids = json.dumps(list(message_ids))
+        with self.connection:
+            self.connection.execute(ARCHIVE_QUESTS, (message_ids, time.time(), reason))
+            return self.connection.execute(DELETE_QUESTS, (message_ids,)).rowcount
+
+    def list_archived_quests(self, guild_id, limit, offset=0):
+        return self.connection.execute(SELECT_ARCHIVED_QUESTS, (guild_id, limit, offset)).fetchall()
+
+    def count_archived_quests(self, guild_id):
+        return self.connection.execute(COUNT_ARCHIVED_QUESTS, (guild_id,)).fetchone()[0]
+
+    def complete_quest(self, message_id, user_ids, xp_reward):
+        with self.connection:
+            # Take the write lock before reading, so another worker process can't award the same users meanwhile
+            self.connection.execute('BEGIN IMMEDIATE')
+            row = self.connection.execute(SELECT_COMPLETED_USERS, (message_id,)).fetchone()
+            if not row:
+                return {}
+            guild_id, completed_users = row
+            completed_users = json.loads(completed_users or '[]')
+            already_completed = set(completed_users)
+            new_users = [user_id for user_id in dict.fromkeys(user_ids) if user_id not in already_completed]
+            if not new_users:
+                return {}
+            self.connection.execute(UPDATE_COMPLETED_USERS, (json.dumps(completed_users + new_users), message_id))
+            self.connection.executemany(INSERT_USER, [(user_id, guild_id, 0, 1) for user_id in new_users])
+            old_levels = dict(self.connection.execute(SELECT_USERS_LEVEL, (guild_id, json.dumps(new_users))).fetchall())
+            old_xp = dict(self.connection.execute(SELECT_USERS_XP, (guild_id, json.dumps(new_users))).fetchall())
+            self.connection.executemany(INSERT_LEDGER, _ledger_rows(guild_id, old_xp, dict.fromkeys(new_users, xp_reward),
+                                                                   "add", "quest", message_id))
+            self.connection.executemany(ADD_USER_XP, [(xp_reward, user_id, guild_id) for user_id in new_users])
+        return old_levels
+
+    def list_expiring_quests(self, guild_id):
+        return self.connection.execute(SELECT_EXPIRING_QUESTS, (guild_id,)).fetchall()
+
+    # Scheduled quests
+    def add_scheduled_quest(self, guild_id, channel_id, title, content, xp_reward, next_start, duration=None,
+                            repeat_every=None, created_by=None):
+        with self.connection:
+            return self.connection.execute(INSERT_SCHEDULED_QUEST, (
+                guild_id, channel_id, title, content, xp_reward, next_start, duration, repeat_every, created_by,
+                time.time())).lastrowid
+
+    @staticmethod
+    def _scheduled_quest(row) -> dict:
+        return dict(zip(SCHEDULED_QUEST_FIELDS, row))
+
+    def get_scheduled_quest(self, schedule_id):
+        row = self.connection.execute(SELECT_SCHEDULED_QUEST, (schedule_id,)).fetchone()
+        return self._scheduled_quest(row) if row else None
+
+    def list_scheduled_quests(self, guild_id):
+        return [self._scheduled_quest(row) for row in self.connection.execute(SELECT_GUILD_SCHEDULED_QUESTS, (guild_id,))]
+
+    def set_scheduled_quest_start(self, schedule_id, next_start):
+        with self.connection:
+            self.connection.execute(UPDATE_SCHEDULED_QUEST_START, (next_start, schedule_id))
+
+    def delete_scheduled_quest(self, schedule_id):
+        with self.connection:
+            return self.connection.execute(DELETE_SCHEDULED_QUEST, (schedule_id,)).rowcount > 0
+
+    # Streak gains
+    def record_streak_gain(self, user_id, guild_id, role_id, role_name, xp_awarded):
+        with self.connection:
+            self.connection.execute(UPSERT_STREAK_ROLE, (guild_id, role_id, role_name))
+            self.connection.execute(INSERT_STREAK_GAIN, (user_id, guild_id, role_id, xp_awarded))
+
+    def get_streak_xp(self, user_id, guild_id):
+        return self.connection.execute(SELECT_STREAK_XP, (guild_id, user_id)).fetchone()[0]
+
+    def get_streak_xp_bulk(self, guild_id, user_ids):
+        if not user_ids:
+            return {}
+        return dict(self.connection.execute(SELECT_STREAK_XP_BULK, (guild_id, json.dumps(list(user_ids)))).fetchall())
+
+    def count_streak_gains(self, guild_id):
+        return self.connection.execute(COUNT_STREAK_GAINS, (guild_id,)).fetchone()[0]
+
+    def get_xp_sources(self, user_id, guild_id):
+        return self.connection.execute(SELECT_XP_SOURCES, (guild_id, user_id)).fetchone()
+
+    # Settings
+    def load_settings(self, guild_id):
+        row = self.connection.execute(SELECT_SETTINGS, (guild_id,)).fetchone()
+        if not row:
+            return None
+        return {
+            "quest_ping_role_id": row[0],
+            "quest_channel_id": row[1],
+            "optin_message_id": row[2],
+            "optin_channel_id": row[3],
+        }
+
+    def save_settings(self, guild_id, settings):
+        with self.connection:
+            self.connection.execute(REPLACE_SETTINGS, (
+                guild_id, settings["quest_ping_role_id"], settings["quest_channel_id"],
+                settings["optin_message_id"], settings["optin_channel_id"]))
+
+    # Role XP assignments
+    def list_role_xp(self, guild_id):
+        return {str(role_id): {"xp": xp, "type": role_type}
+                for role_id, xp, role_type in self.connection.execute(SELECT_ROLE_XP, (guild_id,))}
+
+    def set_role_xp(self, guild_id, role_id, xp, role_type):
+        with self.connection:
+            self.connection.execute(UPSERT_ROLE_XP, (guild_id, role_id, xp, role_type))
+
+    def delete_role_xp(self, guild_id, role_id):
+        with self.connection:
+            return self.connection.execute(DELETE_ROLE_XP, (guild_id, role_id)).rowcount > 0
+
+    # Whitelisted channels
+    def add_whitelisted_channel(self, guild_id, channel_id, channel_name):
+        with self.connection:
+            self.connection.execute(REPLACE_WHITELISTED, (guild_id, channel_id, channel_name))
+
+    def remove_whitelisted_channel(self, guild_id, channel_id):
+        with self.connection:
+            return self.connection.execute(DELETE_WHITELISTED, (guild_id, channel_id)).rowcount > 0
+
+    def list_whitelisted_channels(self, guild_id):
+        return self.connection.execute(SELECT_WHITELISTED, (guild_id,)).fetchall()
+
+    def clear_whitelisted_channels(self, guild_id):
+        with self.connection:
+            return self.connection.execute(CLEAR_WHITELISTED, (guild_id,)).rowcount
+
+    # XP ledger
+    def append_xp_ledger(self, rows):
+        with self.connection:
+            self.connection.executemany(INSERT_LEDGER, rows)
+
+    def list_xp_ledger(self, guild_id, user_id, limit):
+        return self.connection.execute(SELECT_USER_LEDGER, (guild_id, user_id, limit)).fetchall()
+
+    def take_xp_snapshot(self, guild_id, keep):
+        with self.connection:
+            # The write lock keeps other processes from appending between reading the id and copying users
+            self.connection.execute('BEGIN IMMEDIATE')
+            ledger_id = self.connection.execute(SELECT_LAST_LEDGER_ID).fetchone()[0]
+            users = self.connection.execute(INSERT_SNAPSHOT_USERS, (guild_id, ledger_id)).rowcount
+            self.connection.execute(INSERT_SNAPSHOT, (guild_id, ledger_id, time.time(), users))
+            kept = [row[0] for row in self.connection.execute(SELECT_SNAPSHOTS, (guild_id,)).fetchmany(keep)]
+            if len(kept) == keep:
+                self.connection.execute(DELETE_OLD_SNAPSHOTS, (guild_id, kept[-1]))
+                self.connection.execute(DELETE_OLD_SNAPSHOT_USERS, (guild_id, kept[-1]))
+        return ledger_id, users
+
+    def list_xp_snapshots(self, guild_id):
+        return [ledger_id for (ledger_id,) in self.connection.execute(SELECT_SNAPSHOTS, (guild_id,))]
+
+    def replay_xp_ledger(self, guild_id, snapshot_id, exclude_ids=()):
+        return dict(self.connection.execute(REPLAY_XP_LEDGER, (guild_id, snapshot_id,
+                                                               json.dumps(list(exclude_ids)))).fetchall())
+
+    def compare_xp_ledger(self, guild_id, snapshot_id, exclude_ids=()):
+        """Blocking - uses its own connection so it can run on a worker thread. Both reads share one
+        transaction, so a write landing in between can't show up as a difference."""
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with connection:
+                connection.execute('BEGIN')
+                replayed = dict(connection.execute(REPLAY_XP_LEDGER, (guild_id, snapshot_id,
+                                                                      json.dumps(list(exclude_ids)))).fetchall())
+                stored = dict(connection.execute(SELECT_GUILD_XP, (guild_id,)).fetchall())
+            return replayed, stored
+        finally:
+            connection.close()
+
+    # Cross-process coordination
+    def publish_invalidation(self, guild_id, kind, source):
+        with self.connection:
+            self.connection.execute(INSERT_INVALIDATION, (guild_id, kind, source, time.time()))
+
+    def last_invalidation_id(self):
+        return self.connection.execute(SELECT_LAST_INVALIDATION).fetchone()[0]
+
+    def invalidations_since(self, last_id):
+        return self.connection.execute(SELECT_INVALIDATIONS, (last_id,)).fetchall()
+
+    def prune_invalidations(self, older_than):
+        with self.connection:
+            self.connection.execute(DELETE_OLD_INVALIDATIONS, (older_than,))
+
+    def write_heartbeat(self, worker_id, shard_ids, report):
+        with self.connection:
+            self.connection.execute(REPLACE_HEARTBEAT, (worker_id, os.getpid(), json.dumps(list(shard_ids or [])),
+                                                        time.time(), json.dumps(report)))
+
+    # Maintenance
+    def probe(self, timeout=1.0):
+        """Take and release the write lock on a separate connection"""
+        started = time.perf_counter()
+        probe = sqlite3.connect(self.db_path, timeout=timeout)
+        try:
+            probe.execute('BEGIN IMMEDIATE')
+            probe.execute('SELECT 1 FROM users LIMIT 1').fetchone()
+            probe.execute('ROLLBACK')
+        finally:
+            probe.close()
+        return (time.perf_counter() - started) * 1000
+
+    def compact_streak_history(self, max_age_days, batch_size=5000, vacuum_pages=2000):
+        """Roll streak gains older than max_age_days into streak_role_totals, keeping totals exact
+
+        Blocking - uses its own connection so it can run on a worker thread. Walks the table in
+        id-ordered batches, each committed as its own short transaction.
+        """
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            cutoff = connection.execute("SELECT datetime('now', ?)", (f'-{max_age_days} days',)).fetchone()[0]
+            compacted = 0
+            last_id = 0
+            while True:
+                batch_end = connection.execute(SELECT_BATCH_END, (last_id, batch_size)).fetchone()[0]
+                if batch_end is None:
+                    break
+                window = (last_id, batch_end, cutoff)
+                with connection:
+                    connection.execute(COMPACT_ROLE_NAMES, window)
+                    connection.execute(COMPACT_TOTALS, window)
+                    compacted += connection.execute(COMPACT_DELETE, window).rowcount
+                last_id = batch_end
+
+            free_pages = connection.execute('PRAGMA freelist_count').fetchone()[0]
+            if free_pages and connection.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+                # Release a bounded number of pages per run so the write lock is short
+                connection.execute(f'PRAGMA incremental_vacuum({int(vacuum_pages)})').fetchall()
+            remaining_free = connection.execute('PRAGMA freelist_count').fetchone()[0]
+            return {
+                "cutoff": cutoff,
+                "compacted_rows": compacted,
+                "pages_released": free_pages - remaining_free,
+                "free_pages": remaining_free,
+            }
+        finally:
+            connection.close()
+
+    def vacuum(self):
+        """Rebuild the whole file with auto_vacuum=INCREMENTAL - blocks writers while it runs"""
+        connection = sqlite3.connect(self.db_path, timeout=60)
+        try:
+            connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            connection.execute('VACUUM')
+        finally:
+            connection.close()
+
+    def close(self):
+        self.connection.close()
+
+
+def _sql_timestamp(timestamp: float = None) -> str:
+    """UTC time in the format SQLite's CURRENT_TIMESTAMP uses"""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(timestamp))
+
+
+class InMemoryStorage(Storage):
+    """Dict-backed storage; nothing touches disk unless a snapshot is written"""
+
+    def __init__(self, snapshot_path: str = None):
+        self.snapshot_path = snapshot_path  # written on close() when set
+        self.users = {}  # guild_id -> {user_id: [xp, level]}
+        self.quests = {}  # message_id -> quest dict, with a set mirroring completed_users
+        self.guild_quests = {}  # guild_id -> {message_id: None}, insertion ordered
+        self.archived_quests = {}  # guild_id -> {message_id: quest dict with archived_at and reason}, oldest first
+        self.scheduled_quests = {}  # schedule id -> scheduled quest dict
+        self.next_schedule_id = 1
+        self.streak_gains = {}  # guild_id -> [[id, user_id, role_id, xp_awarded, timestamp]], oldest first
+        self.streak_totals = {}  # (guild_id, user_id, role_id) -> [gains, xp_total, last_gain]
+        self.streak_xp = {}  # (guild_id, user_id) -> gains plus totals, kept current on every write
+        self.streak_roles = {}  # (guild_id, role_id) -> role_name
+        self.settings = {}  # guild_id -> settings dict
+        self.role_xp = {}  # guild_id -> {role_id: (xp, type)}
+        self.xp_ledger = {}  # guild_id -> [(id, user_id, delta, source, ref, created_at)], ids ascending
+        self.next_ledger_id = 1
+        self.xp_snapshots = {}  # guild_id -> {ledger_id: {user_id: xp}}, oldest first
+        self.whitelists = {}  # guild_id -> {channel_id: channel_name}
+        self.invalidation_ids = array('q')  # sorted, for bisect in invalidations_since
+        self.invalidations = []  # (id, guild_id, kind, source, created_at), parallel to invalidation_ids
+        self.heartbeats = {}
+        self.next_gain_id = 1
+        # Compaction may run on a worker thread; streak state is only changed under this lock
+        self.streak_lock = threading.Lock()
+
+    # Users
+    def get_user(self, user_id, guild_id):
+        row = self.users.get(guild_id, {}).get(user_id)
+        return (row[0], row[1]) if row else None
+
+    def ensure_user(self, user_id, guild_id):
+        guild_users = self.users.setdefault(guild_id, {})
+        if user_id in guild_users:
+            return False
+        guild_users[user_id] = [0, 1]
+        return True
+
+    def add_users(self, rows):
+        for user_id, guild_id, xp, level in rows:
+            self.users.setdefault(guild_id, {}).setdefault(user_id, [xp, level])
+
+    def set_user_xp(self, user_id, guild_id, xp, source=None, ref=None):
+        row = self.users.get(guild_id, {}).get(user_id)
+        if row:
+            if source:
+                self.append_xp_ledger(_ledger_rows(guild_id, {user_id: row[0]}, {user_id: xp}, "set", source, ref))
+            row[0] = xp
+
+    def set_user_level(self, user_id, guild_id, level):
+        row = self.users.get(guild_id, {}).get(user_id)
+        if row:
+            row[1] = level
+
+    def set_user_levels(self, guild_id, levels):
+        for user_id, level in levels:
+            self.set_user_level(user_id, guild_id, level)
+
+    def apply_xp_changes(self, guild_id, changes, mode="add", source=None, ref=None):
+        guild_users = self.users.setdefault(guild_id, {})
+        if source:
+            self.append_xp_ledger(_ledger_rows(guild_id, self.get_users_xp(guild_id, changes), changes, mode, source, ref))
+        old_levels = {}
+        for user_id, amount in changes.items():
+            row = guild_users.setdefault(user_id, [0, 1])
+            old_levels[user_id] = row[1]
+            row[0] = max(0, amount if mode == "set" else row[0] + amount)
+        return old_levels
+
+    def get_users_xp(self, guild_id, user_ids):
+        guild_users = self.users.get(guild_id, {})
+        return {user_id: guild_users[user_id][0] for user_id in user_ids if user_id in guild_users}
+
+    def list_user_ids(self, guild_id):
+        return list(self.users.get(guild_id, {}))
+
+    def list_user_xp(self, guild_id):
+        return {user_id: row[0] for user_id, row in self.users.get(guild_id, {}).items()}
+
+    def list_user_levels(self, guild_id):
+        return {user_id: row[1] for user_id, row in self.users.get(guild_id, {}).items()}
+
+    # Quests and completions
+    def add_quest(self, message_id, guild_id, channel_id, title, content, xp_reward, expires_at=None):
+        if message_id in self.quests:
+            raise ValueError(f"Quest {message_id} already exists")
+        self.quests[message_id] = {
+            'guild_id': guild_id,
+            'channel_id': channel_id,
+            'title': title,
+            'content': content,
+            'completed_users': [],
+            'completed_set': set(),
+            'xp_reward': xp_reward,
+            'expires_at': expires_at,
+        }
+        self.guild_quests.setdefault(guild_id, {})[message_id] = None
+
+    def get_quest(self, message_id):
+        quest = self.quests.get(message_id)
+        if not quest:
+            return None
+        return {
+            'guild_id': quest['guild_id'],
+            'channel_id': quest['channel_id'],
+            'title': quest['title'],
+            'completed_users': list(quest['completed_users']),
+            'xp_reward': quest['xp_reward'],
+            'expires_at': quest['expires_at'],
+        }
+
+    def list_quests(self, guild_id):
+        return [(message_id, self.quests[message_id]['channel_id'], self.quests[message_id]['title'])
+                for message_id in self.guild_quests.get(guild_id, {})]
+
+    def archive_quests(self, message_ids, reason):
+        archived_at = time.time()
+        archived = 0
+        for message_id in message_ids:
+            quest = self.quests.pop(message_id, None)
+            if not quest:
+                continue
+            self.guild_quests.get(quest['guild_id'], {}).pop(message_id, None)
+            del quest['completed_set']
+            quest.update(archived_at=archived_at, archive_reason=reason)
+            guild_archive = self.archived_quests.setdefault(quest['guild_id'], {})
+            guild_archive.pop(message_id, None)  # replaced rows move to the newest end, like INSERT OR REPLACE
+            guild_archive[message_id] = quest
+            archived += 1
+        return archived
+
+    def list_archived_quests(self, guild_id, limit, offset=0):
+        rows = []
+        for message_id in reversed(self.archived_quests.get(guild_id, {})):
+            quest = self.archived_quests[guild_id][message_id]
+            rows.append((message_id, quest['channel_id'], quest['title'], len(quest['completed_users']),
+                         quest['xp_reward'], quest['archived_at'], quest['archive_reason']))
+            if len(rows) == offset + limit:
+                break
+        return rows[offset:]
+
+    def count_archived_quests(self, guild_id):
+        return len(self.archived_quests.get(guild_id, {}))
+
+    def complete_quest(self, message_id, user_ids, xp_reward):
+        quest = self.quests.get(message_id)
+        if not quest:
+            return {}
+        guild_users = self.users.setdefault(quest['guild_id'], {})
+        old_levels = {}
+        for user_id in user_ids:
+            if user_id in quest['completed_set']:
+                continue
+            quest['completed_set'].add(user_id)
+            quest['completed_users'].append(user_id)
+            row = guild_users.setdefault(user_id, [0, 1])
+            old_levels[user_id] = row[1]
+            self.append_xp_ledger(_ledger_rows(quest['guild_id'], {user_id: row[0]}, {user_id: xp_reward}, "add", "quest",
+                                              message_id))
+            row[0] = max(0, row[0] + xp_reward)
+        return old_levels
+
+    def list_expiring_quests(self, guild_id):
+        return [(message_id, self.quests[message_id]['expires_at']) for message_id in self.guild_quests.get(guild_id, {})
+                if self.quests[message_id]['expires_at'] is not None]
+
+    # Scheduled quests
+    def add_scheduled_quest(self, guild_id, channel_id, title, content, xp_reward, next_start, duration=None,
+                            repeat_every=None, created_by=None):
+        schedule_id = self.next_schedule_id
+        self.next_schedule_id += 1
+        self.scheduled_quests[schedule_id] = {
+            'id': schedule_id, 'guild_id': guild_id, 'channel_id': channel_id, 'title': title, 'content': content,
+            'xp_reward': xp_reward, 'next_start': next_start, 'duration': duration, 'repeat_every': repeat_every,
+            'created_by': created_by, 'created_at': time.time()}
+        return schedule_id
+
+    def get_scheduled_quest(self, schedule_id):
+        scheduled = self.scheduled_quests.get(schedule_id)
+        return dict(scheduled) if scheduled else None
+
+    def list_scheduled_quests(self, guild_id):
+        return sorted((dict(scheduled) for scheduled in self.scheduled_quests.values() if scheduled['guild_id'] == guild_id),
+                      key=lambda scheduled: scheduled['next_start'])
+
+    def set_scheduled_quest_start(self, schedule_id, next_start):
+        if schedule_id in self.scheduled_quests:
+            self.scheduled_quests[schedule_id]['next_start'] = next_start
+
+    def delete_scheduled_quest(self, schedule_id):
+        return self.scheduled_quests.pop(schedule_id, None) is not None
+
+    # Streak gains
+    def record_streak_gain(self, user_id, guild_id, role_id, role_name, xp_awarded):
+        with self.streak_lock:
+            self.streak_roles[(guild_id, role_id)] = role_name
+            self.streak_gains.setdefault(guild_id, []).append(
+                [self.next_gain_id, user_id, role_id, xp_awarded, _sql_timestamp()])
+            self.next_gain_id += 1
+            key = (guild_id, user_id)
+            self.streak_xp[key] = self.streak_xp.get(key, 0) + (xp_awarded or 0)
+
+    def get_streak_xp(self, user_id, guild_id):
+        return self.streak_xp.get((guild_id, user_id), 0)
+
+    def get_streak_xp_bulk(self, guild_id, user_ids):
+        return {user_id: self.streak_xp[(guild_id, user_id)] for user_id in user_ids
+                if (guild_id, user_id) in self.streak_xp}
+
+    def count_streak_gains(self, guild_id):
+        return len(self.streak_gains.get(guild_id, []))
+
+    def get_xp_sources(self, user_id, guild_id):
+        record = self.users.get(guild_id, {}).get(user_id)
+        return (record[0] if record else 0), self.streak_xp.get((guild_id, user_id), 0)
+
+    # Settings
+    def load_settings(self, guild_id):
+        stored = self.settings.get(guild_id)
+        if not stored:
+            return None
+        return dict(stored)
+
+    def save_settings(self, guild_id, settings):
+        self.settings[guild_id] = {
+            "quest_ping_role_id": settings["quest_ping_role_id"],
+            "quest_channel_id": settings["quest_channel_id"],
+            "optin_message_id": settings["optin_message_id"],
+            "optin_channel_id": settings["optin_channel_id"],
+        }
+
+    # Role XP assignments
+    def list_role_xp(self, guild_id):
+        return {str(role_id): {"xp": xp, "type": role_type}
+                for role_id, (xp, role_type) in self.role_xp.get(guild_id, {}).items()}
+
+    def set_role_xp(self, guild_id, role_id, xp, role_type):
+        self.role_xp.setdefault(guild_id, {})[role_id] = (xp, role_type)
+
+    def delete_role_xp(self, guild_id, role_id):
+        return self.role_xp.get(guild_id, {}).pop(role_id, None) is not None
+
+    # Whitelisted channels
+    def add_whitelisted_channel(self, guild_id, channel_id, channel_name):
+        channels = self.whitelists.setdefault(guild_id, {})
+        channels.pop(channel_id, None)  # INSERT OR REPLACE moves the row to the end
+        channels[channel_id] = channel_name
+
+    def remove_whitelisted_channel(self, guild_id, channel_id):
+        return self.whitelists.get(guild_id, {}).pop(channel_id, False) is not False
+
+    def list_whitelisted_channels(self, guild_id):
+        return list(self.whitelists.get(guild_id, {}).items())
+
+    def clear_whitelisted_channels(self, guild_id):
+        return len(self.whitelists.pop(guild_id, {}))
+
+    # XP ledger - RAM only, not part of export_records or the SQLite snapshot
+    def append_xp_ledger(self, rows):
+        for guild_id, user_id, delta, source, ref, created_at in rows:
+            self.xp_ledger.setdefault(guild_id, []).append((self.next_ledger_id, user_id, delta, source, ref, created_at))
+            self.next_ledger_id += 1
+
+    def list_xp_ledger(self, guild_id, user_id, limit):
+        rows = []
+        for ledger_id, row_user_id, delta, source, ref, created_at in reversed(self.xp_ledger.get(guild_id, [])):
+            if row_user_id == user_id:
+                rows.append((ledger_id, delta, source, ref, created_at))
+                if len(rows) == limit:
+                    break
+        return rows
+
+    def take_xp_snapshot(self, guild_id, keep):
+        ledger_id = self.next_ledger_id - 1
+        snapshots = self.xp_snapshots.setdefault(guild_id, {})
+        snapshots.pop(ledger_id, None)  # replaced, like INSERT OR REPLACE
+        snapshots[ledger_id] = {user_id: row[0] for user_id, row in self.users.get(guild_id, {}).items()}
+        for old_id in list(snapshots)[:-keep]:
+            del snapshots[old_id]
+        return ledger_id, len(snapshots[ledger_id])
+
+    def list_xp_snapshots(self, guild_id):
+        return sorted(self.xp_snapshots.get(guild_id, {}), reverse=True)
+
+    def replay_xp_ledger(self, guild_id, snapshot_id, exclude_ids=()):
+        return self._replay_rows(guild_id, snapshot_id, exclude_ids, self.xp_ledger.get(guild_id, []))
+
+    def _replay_rows(self, guild_id, snapshot_id, exclude_ids, rows):
+        totals = dict(self.xp_snapshots.get(guild_id, {}).get(snapshot_id, {}))
+        exclude_ids = set(exclude_ids)
+        for ledger_id, user_id, delta, source, _, _ in rows[bisect.bisect_right(rows, (snapshot_id, float("inf"))):]:
+            if source not in LEDGER_RECORD_ONLY_SOURCES and ledger_id not in exclude_ids:
+                totals[user_id] = totals.get(user_id, 0) + delta
+        return totals
+
+    def compare_xp_ledger(self, guild_id, snapshot_id, exclude_ids=()):
+        # Copying a dict or list is a single step under the GIL, so the event loop can't change
+        # either one halfway through; the replay then works on the copies
+        rows = list(self.xp_ledger.get(guild_id, []))
+        stored = {user_id: row[0] for user_id, row in dict(self.users.get(guild_id, {})).items()}
+        return self._replay_rows(guild_id, snapshot_id, exclude_ids, rows), stored
+
+    # Cross-process coordination
+    def publish_invalidation(self, guild_id, kind, source):
+        row_id = self.last_invalidation_id() + 1
+        self.invalidation_ids.append(row_id)
+        self.invalidations.append((row_id, guild_id, kind, source, time.time()))
+
+    def last_invalidation_id(self):
+        return self.invalidation_ids[-1] if self.invalidation_ids else 0
+
+    def invalidations_since(self, last_id):
+        start = bisect.bisect_right(self.invalidation_ids, last_id)
+        return [row[:4] for row in self.invalidations[start:]]
+
+    def prune_invalidations(self, older_than):
+        keep = [row for row in self.invalidations if row[4] >= older_than]
+        self.invalidations = keep
+        self.invalidation_ids = array('q', (row[0] for row in keep))
+
+    def write_heartbeat(self, worker_id, shard_ids, report):
+        self.heartbeats[worker_id] = {"pid": os.getpid(), "shard_ids": list(shard_ids or []),
+                                      "updated_at": time.time(), "report": report}
+
+    # Maintenance
+    def probe(self, timeout=1.0):
+        started = time.perf_counter()
+        with self.streak_lock:
+            pass
+        return (time.perf_counter() - started) * 1000
+
+    def compact_streak_history(self, max_age_days, batch_size=5000, vacuum_pages=2000):
+        """Fold gains older than max_age_days into per-role totals; streak sums don't change"""
+        cutoff = _sql_timestamp(time.time() - max_age_days * 86400)
+        compacted = 0
+        with self.streak_lock:
+            for guild_id, gains in self.streak_gains.items():
+                recent = []
+                for gain in gains:
+                    gain_id, user_id, role_id, xp_awarded, timestamp = gain
+                    if timestamp >= cutoff:
+                        recent.append(gain)
+                        continue
+                    total = self.streak_totals.setdefault((guild_id, user_id, role_id), [0, 0, ''])
+                    total[0] += 1
+                    total[1] += xp_awarded or 0
+                    total[2] = max(total[2], timestamp)
+                    compacted += 1
+                gains[:] = recent
+        return {"cutoff": cutoff, "compacted_rows": compacted, "pages_released": 0, "free_pages": 0}
+
+    def vacuum(self):
+        pass
+
+    def export_records(self) -> List[Tuple[str, dict]]:
+        """Every row as (table, record) pairs in xp_transfer's format - a quick copy, safe to write out later"""
+        guild_ids = set(self.users) | set(self.settings) | set(self.role_xp) | set(self.whitelists) | set(self.guild_quests)
+        guild_ids |= {scheduled['guild_id'] for scheduled in self.scheduled_quests.values()} | set(self.archived_quests)
+        with self.streak_lock:
+            guild_ids |= set(self.streak_gains) | {guild_id for guild_id, _ in self.streak_roles}
+            gains = {guild_id: [list(gain) for gain in rows] for guild_id, rows in self.streak_gains.items()}
+            totals = {key: list(value) for key, value in self.streak_totals.items()}
+            roles = dict(self.streak_roles)
+        records = []
+        for guild_id in sorted(guild_ids):
+            if guild_id in self.settings:
+                records.append(("settings", {"guild_id": guild_id, **self.settings[guild_id], "role_xp_assignments": "{}"}))
+            for role_id, (xp, role_type) in self.role_xp.get(guild_id, {}).items():
+                records.append(("role_xp", {"guild_id": guild_id, "role_id": role_id, "xp": xp, "type": role_type}))
+            for channel_id, channel_name in self.whitelists.get(guild_id, {}).items():
+                records.append(("whitelisted_channels",
+                                {"guild_id": guild_id, "channel_id": channel_id, "channel_name": channel_name}))
+            for user_id, (xp, level) in self.users.get(guild_id, {}).items():
+                records.append(("users", {"user_id": user_id, "guild_id": guild_id, "xp": xp, "level": level}))
+            for message_id in self.guild_quests.get(guild_id, {}):
+                quest = self.quests[message_id]
+                records.append(("quests", {
+                    "message_id": message_id, "guild_id": guild_id, "channel_id": quest['channel_id'],
+                    "title": quest['title'], "content": quest['content'],
+                    "completed_users": json.dumps(quest['completed_users']), "xp_reward": quest['xp_reward'],
+                    "expires_at": quest['expires_at']}))
+            for message_id, quest in self.archived_quests.get(guild_id, {}).items():
+                records.append(("quests_archive", {
+                    "message_id": message_id, "guild_id": guild_id, "channel_id": quest['channel_id'],
+                    "title": quest['title'], "content": quest['content'],
+                    "completed_users": json.dumps(quest['completed_users']), "xp_reward": quest['xp_reward'],
+                    "expires_at": quest['expires_at'], "archived_at": quest['archived_at'],
+                    "archive_reason": quest['archive_reason']}))
+            for scheduled in self.scheduled_quests.values():
+                if scheduled['guild_id'] == guild_id:
+                    records.append(("scheduled_quests", {column: scheduled[column]
+                                                         for column in xp_transfer.EXPORT_TABLES["scheduled_quests"][0]}))
+            for _, user_id, role_id, xp_awarded, timestamp in gains.get(guild_id, []):
+                records.append(("streak_role_gains", {"user_id": user_id, "guild_id": guild_id, "role_id": role_id,
+                                                      "role_name": None, "xp_awarded": xp_awarded,
+                                                      "timestamp": timestamp}))
+        for (guild_id, role_id), role_name in roles.items():
+            records.append(("streak_roles", {"guild_id": guild_id, "role_id": role_id, "role_name": role_name}))
+        for (guild_id, user_id, role_id), (gain_count, xp_total, last_gain) in totals.items():
+            records.append(("streak_role_totals", {"guild_id": guild_id, "user_id": user_id, "role_id": role_id,
+                                                   "gains": gain_count, "xp_total": xp_total,
+                                                   "last_gain": last_gain or None}))
+        return records
+
+    def snapshot(self, path: str) -> dict:
+        """Write everything to a new SQLite database at path"""
+        return write_snapshot(self.export_records(), path)
+
+    def close(self):
+        if self.snapshot_path:
+            self.snapshot(self.snapshot_path)
+
+
+def write_snapshot(records, path: str) -> dict:
+    """Write (table, record) pairs to a new SQLite database, replacing path once complete
+
+    Blocking - call it from a worker thread with records taken on the event loop.
+    """
+    started = time.perf_counter()
+    partial_path = path + ".partial"
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+    SQLiteStorage(partial_path).close()  # schema only
+    connection = sqlite3.connect(partial_path)
+    try:
+        # The database is new, so the per-guild clearing import_records does first is a no-op
+        xp_transfer.import_records(connection, iter(records))
+        connection.execute('DELETE FROM cache_invalidations')  # the import's notices, nobody is listening
+        connection.execute('DELETE FROM xp_ledger')  # the ledger isn't part of snapshots
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(partial_path, path)
+    return {
+        "path": path,
+        "size_bytes": os.path.getsize(path),
+        "seconds": round(time.perf_counter() - started, 3),
+        "restarts": 0,
+    }
+
+
+def open_storage(backend: str, db_path: str = None, busy_timeout: float = 5.0, snapshot_path: str = None) -> Storage:
+    """Create the backend named by QUEST_BOT_STORAGE / --storage"""
+    if backend == "sqlite":
+        return SQLiteStorage(db_path, busy_timeout=busy_timeout)
+    if backend == "memory":
+        return InMemoryStorage(snapshot_path=snapshot_path)
+    raise ValueError(f"Unknown storage backend {backend!r} (expected one of {', '.join(BACKENDS)})")
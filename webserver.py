@@ -1,17 +1,156 @@
-from flask import Flask
-from threading import Thread
+from aiohttp import web
+import asyncio
+import math
 import os
+import time
 
-app = Flask('')
-@app.route('/')
-def home():
-    return "Discord bot ok"
+# Runs on the bot's own event loop, so handlers can read bot state directly
+_runner = None
+_started_at = time.time()
 
-def run():
+# Health thresholds (override through environment variables)
+MAX_DISCONNECT_SECONDS = float(os.environ.get("HEALTH_MAX_DISCONNECT", 300))
+MAX_EVENT_SILENCE_SECONDS = float(os.environ.get("HEALTH_MAX_EVENT_SILENCE", 0))  # 0 disables the check
+MAX_BACKLOG = int(os.environ.get("HEALTH_MAX_BACKLOG", 1000))
+DB_PROBE_TIMEOUT = float(os.environ.get("HEALTH_DB_PROBE_TIMEOUT", 1.0))
+
+
+def _latency_ms(bot):
+    latency = bot.latency
+    return round(latency * 1000, 1) if math.isfinite(latency) else None
+
+
+def _seconds_since(timestamp):
+    return round(time.time() - timestamp, 1) if timestamp else None
+
+
+def shard_report(bot, quest_bot):
+    """Per-shard connection state, latency and guild count"""
+    latencies = dict(bot.latencies)
+    shard_ids = sorted(set(bot.shards) | set(quest_bot.shard_status))
+    report = {}
+    for shard_id in shard_ids:
+        status = quest_bot.shard_status.get(shard_id, {})
+        latency = latencies.get(shard_id)
+        shard = bot.get_shard(shard_id)
+        report[str(shard_id)] = {
+            "state": status.get("state", "connecting"),
+            "closed": shard.is_closed() if shard else True,
+            "latency_ms": round(latency * 1000, 1) if latency is not None and math.isfinite(latency) else None,
+            "guilds": status.get("guilds", 0),
+            "disconnected_seconds": _seconds_since(status.get("disconnected_since")),
+            "reconnects": status.get("reconnects", 0),
+        }
+    return report
+
+
+def liveness_report(bot, quest_bot):
+    """Is the process worth keeping? Fails only when restarting would help"""
+    shards = shard_report(bot, quest_bot)
+    # One shard stuck offline is enough to restart - its guilds get no service at all
+    disconnected_for = max((s["disconnected_seconds"] for s in shards.values() if s["disconnected_seconds"] is not None),
+                           default=None)
+    since_last_event = _seconds_since(quest_bot.last_event_at)
+    checks = {
+        "client_open": not bot.is_closed(),
+        "gateway_connected": disconnected_for is None or disconnected_for < MAX_DISCONNECT_SECONDS,
+    }
+    if MAX_EVENT_SILENCE_SECONDS and bot.is_ready():
+        checks["receiving_events"] = since_last_event is not None and since_last_event < MAX_EVENT_SILENCE_SECONDS
+    return {
+        "alive": all(checks.values()),
+        "checks": checks,
+        "disconnected_seconds": disconnected_for,
+        "seconds_since_last_event": since_last_event,
+        "shards": shards,
+        "uptime_seconds": round(time.time() - _started_at)
+    }
+
+
+async def readiness_report(bot, quest_bot):
+    """Should the bot receive traffic? Covers gateway, startup, database and backlog"""
+    database = {"ok": False, "round_trip_ms": None, "error": None}
+    try:
+        # Run off-loop so a locked database can't stall the bot while we wait
+        database["round_trip_ms"] = round(await asyncio.to_thread(quest_bot.probe_database, DB_PROBE_TIMEOUT), 2)
+        database["ok"] = True
+    except Exception as e:
+        database["error"] = str(e)
+
+    latency_ms = _latency_ms(bot)
+    backlog = {"role_syncs": len(quest_bot.pending_role_syncs), "notices": quest_bot.notices.pending_count(),
+               "completions": quest_bot.completions.pending_count(), "ledger": quest_bot.ledger.pending_count()}
+    startup = quest_bot.startup_progress
+    shards = shard_report(bot, quest_bot)
+    checks = {
+        "gateway_ready": bot.is_ready() and latency_ms is not None,
+        "shards_ready": bool(shards) and all(s["state"] == "ready" for s in shards.values()),
+        "startup_complete": quest_bot.startup_complete,
+        "database": database["ok"],
+        "backlog": sum(backlog.values()) < MAX_BACKLOG,
+    }
+    return {
+        "ready": all(checks.values()),
+        "checks": checks,
+        "latency_ms": latency_ms,
+        "seconds_since_last_event": _seconds_since(quest_bot.last_event_at),
+        "database": database,
+        "backlog": backlog,
+        "shards": shards,
+        "startup": {
+            "guilds_total": len(startup),
+            "guilds_ready": sum(1 for state in startup.values() if state == "ready"),
+            "guilds": {str(guild_id): state for guild_id, state in startup.items()}
+        }
+    }
+
+
+def create_app(bot, quest_bot):
+    """Build the health/status web app for a bot instance"""
+    async def home(request):
+        return web.Response(text="Discord bot ok")
+
+    async def liveness(request):
+        report = liveness_report(bot, quest_bot)
+        return web.json_response(report, status=200 if report["alive"] else 503)
+
+    async def readiness(request):
+        report = await readiness_report(bot, quest_bot)
+        return web.json_response(report, status=200 if report["ready"] else 503)
+
+    async def status(request):
+        readiness_data = await readiness_report(bot, quest_bot)
+        return web.json_response({
+            "user": str(bot.user) if bot.user else None,
+            "guilds": len(bot.guilds),
+            "shard_count": bot.shard_count,
+            "cached_members": sum(len(guild.members) for guild in bot.guilds),
+            "liveness": liveness_report(bot, quest_bot),
+            "readiness": readiness_data
+        })
+
+    app = web.Application()
+    app.router.add_get('/', home)
+    app.router.add_get('/healthz', liveness)
+    app.router.add_get('/readyz', readiness)
+    app.router.add_get('/status', status)
+    return app
+
+
+async def start(bot, quest_bot):
+    """Start the web server on the running event loop"""
+    global _runner
     port = int(os.environ.get("PORT", 3000))
     print(f"Web server is starting on port {port}...")
-    app.run(host="0.0.0.0", port=port)
+    _runner = web.AppRunner(create_app(bot, quest_bot), access_log=None)
+    await _runner.setup()
+    site = web.TCPSite(_runner, "0.0.0.0", port)
+    await site.start()
+
 
-def keep_alive():
-    t = Thread(target=run)
-    t.start()
+async def stop():
+    """Shut the web server down cleanly"""
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
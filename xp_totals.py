@@ -0,0 +1,85 @@
+"""Total XP and levels for many members at once.
+
+A member's role XP only depends on which roles they have, so it is folded into
+one value per role up front: the assigned XP for badge roles, 5 for unassigned
+roles with "badge" in the name, and nothing for Level and streak roles (streak
+XP comes from the accumulated gains instead). A member's role XP is then the
+sum of those values over their roles.
+
+With NumPy the memberships form a sparse member-by-role matrix - one row index
+and one role column per membership - and totals come from a weighted bincount
+over it, with levels from searchsorted over the thresholds. Without NumPy the
+same sums run in plain Python, so results are identical either way.
+"""
+from bisect import bisect_right
+from typing import Dict, List, Optional
+
+try:
+    import numpy as np
+except ImportError:  # optional, see requirements.txt
+    np = None
+
+AUTO_BADGE_XP = 5
+
+
+def role_xp_values(roles, assignments: dict) -> Dict[int, int]:
+    """XP each role adds to a member's total, for the roles that add any
+
+    assignments is the guild's role_xp_assignments (role id string -> {"xp", "type"}).
+    Mirrors QuestBot.calculate_role_xp.
+    """
+    values = {}
+    for role in roles:
+        # Level roles never count, to avoid a circular dependency
+        if role.name.startswith("Level "):
+            continue
+        role_data = assignments.get(str(role.id))
+        if role_data:
+            if role_data["type"] != "streak" and role_data["xp"]:
+                values[role.id] = role_data["xp"]
+        elif "badge" in role.name.lower():
+            values[role.id] = AUTO_BADGE_XP
+    return values
+
+
+def total_xp(user_ids: List[int], members: List[Optional[object]], base_xp: Dict[int, int],
+             streak_xp: Dict[int, int], role_values: Dict[int, int]) -> List[int]:
+    """Totals in user_ids order; members[i] is user_ids[i]'s member, or None for base XP only"""
+    if np is None:
+        totals = []
+        for user_id, member in zip(user_ids, members):
+            total = base_xp.get(user_id, 0)
+            if member is not None:
+                total += (streak_xp.get(user_id) or 0) + sum(role_values.get(role.id, 0) for role in member.roles)
+            totals.append(total)
+        return totals
+
+    count = len(user_ids)
+    role_index = {role_id: column for column, role_id in enumerate(role_values)}
+    rows = []
+    columns = []
+    for row, member in enumerate(members):
+        if member is None:
+            continue
+        for role in member.roles:
+            column = role_index.get(role.id)
+            if column is not None:
+                rows.append(row)
+                columns.append(column)
+    role_xp_vector = np.fromiter(role_values.values(), dtype=np.float64, count=len(role_values))
+    # Sparse matrix times vector: each membership adds its role's XP to its member's row
+    role_xp = np.bincount(np.array(rows, dtype=np.intp), weights=role_xp_vector[np.array(columns, dtype=np.intp)],
+                          minlength=count).astype(np.int64)
+
+    base = np.fromiter((base_xp.get(user_id, 0) for user_id in user_ids), dtype=np.int64, count=count)
+    streak = np.fromiter((streak_xp.get(user_id) or 0 for user_id in user_ids), dtype=np.int64, count=count)
+    cached = np.fromiter((member is not None for member in members), dtype=bool, count=count)
+    return (base + np.where(cached, streak + role_xp, 0)).tolist()
+
+
+def levels(totals: List[int], thresholds: List[int]) -> List[int]:
+    """Level for each total; thresholds[i] is the XP needed for level i + 1, ascending"""
+    if np is None:
+        return [max(1, bisect_right(thresholds, total)) for total in totals]
+    found = np.searchsorted(np.asarray(thresholds), np.asarray(totals, dtype=np.int64), side="right")
+    return np.maximum(found, 1).tolist()
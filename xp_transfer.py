@@ -0,0 +1,325 @@
+"""Streaming export and import of a guild's QuestBot data.
+
+Exports read through chunked cursors and write rows as they arrive, and
+imports insert in batches, so memory stays flat no matter how many rows a
+guild has. Two formats are supported:
+
+- NDJSON (optionally gzipped): one {"table": ..., <columns>} object per line
+- CSV: a .zip archive holding one <table>.csv per table
+
+    python xp_transfer.py export --db quest_bot.db --guild 123 --output guild.ndjson.gz
+    python xp_transfer.py import --db quest_bot.db --input guild.ndjson.gz [--target-guild 456]
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+import sqlite3
+import sys
+import time
+import zipfile
+
+CHUNK_SIZE = 5000
+
+# completed_users arrays on popular quests easily exceed the csv module's default field limit
+csv.field_size_limit(min(sys.maxsize, 2**31 - 1))
+
+# table -> (columns, guild filter); columns are exported and imported in this order
+EXPORT_TABLES = {
+    "settings": (["guild_id", "quest_ping_role_id", "quest_channel_id", "role_xp_assignments",
+                  "optin_message_id", "optin_channel_id"], "guild_id = ?"),
+    "role_xp": (["guild_id", "role_id", "xp", "type"], "guild_id = ?"),
+    "whitelisted_channels": (["guild_id", "channel_id", "channel_name"], "guild_id = ?"),
+    "users": (["user_id", "guild_id", "xp", "level"], "guild_id = ?"),
+    "quests": (["message_id", "guild_id", "channel_id", "title", "content", "completed_users", "xp_reward",
+                "expires_at"], "guild_id = ?"),
+    "quests_archive": (["message_id", "guild_id", "channel_id", "title", "content", "completed_users", "xp_reward",
+                        "expires_at", "archived_at", "archive_reason"], "guild_id = ?"),
+    # The schedule ID is local to a database, imported rows get new ones
+    "scheduled_quests": (["guild_id", "channel_id", "title", "content", "xp_reward", "next_start", "duration",
+                          "repeat_every", "created_by", "created_at"], "guild_id = ?"),
+    "streak_role_gains": (["user_id", "guild_id", "role_id", "role_name", "xp_awarded", "timestamp"],
+                          "guild_id = ?"),
+    "streak_roles": (["guild_id", "role_id", "role_name"], "guild_id = ?"),
+    "streak_role_totals": (["guild_id", "user_id", "role_id", "gains", "xp_total", "last_gain"], "guild_id = ?"),
+}
+
+INTEGER_COLUMNS = {"guild_id", "user_id", "channel_id", "message_id", "role_id", "quest_ping_role_id",
+                   "quest_channel_id", "optin_message_id", "optin_channel_id", "xp", "level", "xp_reward",
+                   "xp_awarded", "gains", "xp_total", "created_by"}
+REAL_COLUMNS = {"expires_at", "next_start", "duration", "repeat_every", "created_at", "archived_at"}
+
+# Base XP changes an import makes, as rows for the bot's XP ledger (see storage.py)
+IMPORT_LEDGER = '''INSERT INTO xp_ledger (guild_id, user_id, delta, source, ref, created_at)
+                   SELECT guild_id, user_id, SUM(xp), 'import', ?1, ?2 FROM (
+                       SELECT guild_id, user_id, xp FROM temp.staged_users
+                       UNION ALL
+                       SELECT guild_id, user_id, -xp FROM main.users WHERE guild_id IN (SELECT value FROM json_each(?3))
+                   ) GROUP BY guild_id, user_id HAVING SUM(xp) != 0'''
+
+# Tables whose rows point at roles, channels and messages in the source server, so they can't move to
+# another guild - a remapped import skips them and the target server keeps its own
+GUILD_BOUND_TABLES = {"settings", "role_xp", "whitelisted_channels", "streak_roles", "quests", "quests_archive",
+                      "scheduled_quests"}
+
+
+def iter_table(connection, table: str, guild_id: int, chunk_size: int = CHUNK_SIZE):
+    """Yield one guild's rows from a table using fetchmany instead of fetchall"""
+    columns, where = EXPORT_TABLES[table]
+    cursor = connection.cursor()
+    cursor.execute(f'SELECT {", ".join(columns)} FROM {table} WHERE {where}', (guild_id,))
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield from rows
+
+
+def export_ndjson(connection, guild_id: int, out, chunk_size: int = CHUNK_SIZE) -> dict:
+    """Write every table for a guild as NDJSON lines to a text file object"""
+    counts = {}
+    for table, (columns, _) in EXPORT_TABLES.items():
+        counts[table] = 0
+        for row in iter_table(connection, table, guild_id, chunk_size):
+            record = {"table": table}
+            record.update(zip(columns, row))
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            counts[table] += 1
+    return counts
+
+
+def export_csv_zip(connection, guild_id: int, fileobj, chunk_size: int = CHUNK_SIZE) -> dict:
+    """Write every table for a guild as <table>.csv members of a zip archive"""
+    counts = {}
+    with zipfile.ZipFile(fileobj, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for table, (columns, _) in EXPORT_TABLES.items():
+            counts[table] = 0
+            with archive.open(f"{table}.csv", "w") as raw:
+                text = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+                writer = csv.writer(text)
+                writer.writerow(columns)
+                for row in iter_table(connection, table, guild_id, chunk_size):
+                    writer.writerow(row)
+                    counts[table] += 1
+                text.flush()
+                text.detach()
+    return counts
+
+
+def export_guild(db_path: str, guild_id: int, output_path: str) -> dict:
+    """Export a guild to a file; the format follows the extension (.zip = CSV, otherwise NDJSON)"""
+    connection = sqlite3.connect(db_path)
+    try:
+        if output_path.endswith(".zip"):
+            with open(output_path, "wb") as fh:
+                return export_csv_zip(connection, guild_id, fh)
+        opener = gzip.open if output_path.endswith(".gz") else open
+        with opener(output_path, "wt", encoding="utf-8") as fh:
+            return export_ndjson(connection, guild_id, fh)
+    finally:
+        connection.close()
+
+
+def _coerce(column: str, value):
+    if value is None or value == "":
+        return None
+    if column in INTEGER_COLUMNS:
+        return int(value)
+    if column in REAL_COLUMNS:
+        return float(value)
+    return value
+
+
+def read_ndjson(fileobj):
+    """Yield (table, record) pairs from NDJSON lines"""
+    for line in fileobj:
+        if line.strip():
+            record = json.loads(line)
+            yield record.pop("table"), record
+
+
+def read_csv_zip(fileobj):
+    """Yield (table, record) pairs from a CSV zip archive, table by table"""
+    with zipfile.ZipFile(fileobj) as archive:
+        for table in EXPORT_TABLES:
+            name = f"{table}.csv"
+            if name not in archive.namelist():
+                continue
+            with archive.open(name) as raw:
+                for record in csv.DictReader(io.TextIOWrapper(raw, encoding="utf-8", newline="")):
+                    yield table, {column: _coerce(column, value) for column, value in record.items()}
+
+
+def import_records(connection, records, target_guild_id: int = None, batch_size: int = CHUNK_SIZE,
+                   ref: int = None) -> dict:
+    """Replace the guilds in (table, record) pairs with the records' rows
+
+    The whole file is read into TEMP staging tables first, so an unknown table, an unexpected
+    column or a malformed record fails the import before anything is deleted. The guilds' rows
+    are then swapped for the staged ones in one short transaction - either all of the file
+    lands or none of it does, and the bot's own writes only wait for the swap. The change to each
+    user's base XP is appended to the bot's XP ledger in the same transaction, with ref as its ref.
+    """
+    counts = {}
+    batches = {}
+    guild_ids = set()
+    remapped = False
+    skipped = 0
+
+    for table, (columns, _) in EXPORT_TABLES.items():
+        connection.execute(f'DROP TABLE IF EXISTS temp.staged_{table}')
+        connection.execute(f'CREATE TEMP TABLE staged_{table} AS SELECT {", ".join(columns)} FROM main.{table} LIMIT 0')
+
+    def flush(table):
+        rows = batches.pop(table, [])
+        if rows:
+            columns = EXPORT_TABLES[table][0]
+            connection.executemany(f'INSERT INTO temp.staged_{table} ({", ".join(columns)}) '
+                                   f'VALUES ({", ".join("?" * len(columns))})', rows)
+
+    try:
+        for table, record in records:
+            if table not in EXPORT_TABLES:
+                raise ValueError(f"Unknown table in import: {table}")
+            columns = EXPORT_TABLES[table][0]
+            unexpected = set(record) - set(columns)
+            if unexpected or record.get("guild_id") is None:
+                raise ValueError(f"Unexpected columns in {table} record: {', '.join(sorted(unexpected)) or 'no guild_id'}")
+            if target_guild_id is not None and record["guild_id"] != target_guild_id:
+                remapped = True
+                if table in GUILD_BOUND_TABLES:
+                    skipped += 1
+                    continue
+                record["guild_id"] = target_guild_id
+            guild_ids.add(record["guild_id"])
+            batches.setdefault(table, []).append(tuple(record.get(column) for column in columns))
+            counts[table] = counts.get(table, 0) + 1
+            if len(batches[table]) >= batch_size:
+                flush(table)
+        for table in list(batches):
+            flush(table)
+        connection.commit()  # staging only touched TEMP tables, the main database isn't locked yet
+
+        ledger = table_exists(connection, "xp_ledger")
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            if ledger:
+                connection.execute(IMPORT_LEDGER, (ref, time.time(), json.dumps(list(guild_ids))))
+            for table, (columns, where) in EXPORT_TABLES.items():
+                # Replace, don't merge - re-importing the same file must not double streak XP. Every table
+                # is cleared so tables missing from older exports don't keep stale rows, except the ones a
+                # remap doesn't bring across, where the target server keeps its own.
+                if not (remapped and table in GUILD_BOUND_TABLES):
+                    connection.executemany(f'DELETE FROM {table} WHERE {where}', [(guild_id,) for guild_id in guild_ids])
+                connection.execute(f'INSERT OR REPLACE INTO main.{table} ({", ".join(columns)}) '
+                                   f'SELECT {", ".join(columns)} FROM temp.staged_{table} ORDER BY rowid')
+    finally:
+        if connection.in_transaction:
+            connection.rollback()
+        for table in EXPORT_TABLES:
+            connection.execute(f'DROP TABLE IF EXISTS temp.staged_{table}')
+
+    # Exports from before the role_xp table carry the assignments on the settings row
+    migrate_role_xp_assignments(connection)
+    notify_running_bots(connection, guild_ids)
+    if skipped:
+        counts["server-specific rows (skipped, other guild)"] = skipped
+    return counts
+
+
+def migrate_role_xp_assignments(connection) -> int:
+    """Move role XP assignments still stored as JSON on settings rows into the role_xp table"""
+    rows = connection.execute(
+        "SELECT guild_id, role_xp_assignments FROM settings WHERE role_xp_assignments NOT IN ('', '{}')").fetchall()
+    moved = []
+    for guild_id, assignments in rows:
+        for role_id, data in json.loads(assignments).items():
+            if isinstance(data, int):
+                # Oldest format: role_id -> xp_amount, which always meant a badge role
+                data = {"xp": data, "type": "badge"}
+            moved.append((guild_id, int(role_id), data["xp"], data["type"]))
+    if rows:
+        with connection:
+            # Rows already in role_xp are newer than the JSON copy
+            connection.executemany('INSERT OR IGNORE INTO role_xp (guild_id, role_id, xp, type) VALUES (?, ?, ?, ?)',
+                                   moved)
+            connection.execute("UPDATE settings SET role_xp_assignments = '{}' WHERE role_xp_assignments NOT IN ('', '{}')")
+    return len(moved)
+
+
+def table_exists(connection, name: str) -> bool:
+    return connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+
+def notify_running_bots(connection, guild_ids):
+    """Ask running bot processes to reload everything they cache for the imported guilds"""
+    if not guild_ids or not table_exists(connection, "cache_invalidations"):
+        return
+    with connection:
+        connection.executemany(
+            "INSERT INTO cache_invalidations (guild_id, kind, source, created_at) VALUES (?, 'guild', 'xp_transfer', ?)",
+            [(guild_id, time.time()) for guild_id in guild_ids])
+
+
+def read_file(input_path: str):
+    """Yield (table, record) pairs from a file written by export_guild"""
+    if input_path.endswith(".zip"):
+        with open(input_path, "rb") as fh:
+            yield from read_csv_zip(fh)
+        return
+    opener = gzip.open if input_path.endswith(".gz") else open
+    with opener(input_path, "rt", encoding="utf-8") as fh:
+        yield from read_ndjson(fh)
+
+
+def replaced_tables(input_path: str, target_guild_id: int) -> list:
+    """Tables importing input_path into target_guild_id overwrites - all of them for the file's own
+    guild, all but GUILD_BOUND_TABLES for another guild's export"""
+    records = read_file(input_path)
+    try:
+        _, record = next(records, (None, {}))
+    finally:
+        records.close()
+    if record.get("guild_id", target_guild_id) != target_guild_id:
+        return [table for table in EXPORT_TABLES if table not in GUILD_BOUND_TABLES]
+    return list(EXPORT_TABLES)
+
+
+def import_guild(db_path: str, input_path: str, target_guild_id: int = None, ref: int = None) -> dict:
+    """Import a file written by export_guild; ref is recorded on the import's XP ledger rows"""
+    connection = sqlite3.connect(db_path, timeout=30)
+    try:
+        return import_records(connection, read_file(input_path), target_guild_id, ref=ref)
+    finally:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream a guild's QuestBot data in or out")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = sub.add_parser("export", help="Export one guild")
+    export_parser.add_argument("--db", default="quest_bot.db")
+    export_parser.add_argument("--guild", type=int, required=True)
+    export_parser.add_argument("--output", required=True, help=".ndjson, .ndjson.gz or .zip (CSV)")
+
+    import_parser = sub.add_parser("import", help="Import an export file")
+    import_parser.add_argument("--db", default="quest_bot.db")
+    import_parser.add_argument("--input", required=True)
+    import_parser.add_argument("--target-guild", type=int, help="Load the data into a different guild ID")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        counts = export_guild(args.db, args.guild, args.output)
+        print(f"Exported guild {args.guild} to {args.output}")
+    else:
+        counts = import_guild(args.db, args.input, args.target_guild)
+        print(f"Imported {args.input} into {args.db}")
+    for table, count in counts.items():
+        print(f"  {table}: {count:,} rows")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())